@@ -0,0 +1,93 @@
+import argparse
+import json
+import sys
+
+# Metrics compared between two benchmark results, and whether higher is better.
+METRICS = [
+    (("harmonize_file", "tracks_per_minute"), True),
+    (("harmonize_file", "audio_seconds_per_second"), True),
+    (("enrichments", "serial_lookups_per_second"), True),
+    (("enrichments", "concurrent_lookups_per_second"), True),
+    (("peak_rss_mb",), False),
+    (("children_peak_rss_mb",), False),
+]
+
+
+def lookup(report, path):
+    for key in path:
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+
+def stage_p50s(report):
+    return {
+        row["stage"]: row["p50"]
+        for row in lookup(report, ("harmonize_file", "stages")) or []
+    }
+
+
+def compare(baseline, candidate, threshold):
+    # Returns printable rows and the regressed metric names.
+    rows = []
+    regressions = []
+
+    def add(name, before, after, higher_is_better):
+        if before is None or after is None or before == 0:
+            return
+        change = (after - before) / before * 100
+        regressed = change < -threshold if higher_is_better else change > threshold
+        if regressed:
+            regressions.append(name)
+        rows.append(
+            f"{name:<48} {before:>12.3f} {after:>12.3f} {change:>+8.1f}%"
+            + (" REGRESSION" if regressed else "")
+        )
+
+    for path, higher_is_better in METRICS:
+        add(
+            ".".join(path),
+            lookup(baseline, path),
+            lookup(candidate, path),
+            higher_is_better,
+        )
+    before_stages, after_stages = stage_p50s(baseline), stage_p50s(candidate)
+    for stage in before_stages:
+        add(
+            f"stage {stage} p50",
+            before_stages[stage],
+            after_stages.get(stage),
+            False,
+        )
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares two benchmark results, exits with 1 on regressions."
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="Change in percent above which a metric is a regression.",
+    )
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{'metric':<48} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    print("\n".join(rows))
+    if regressions:
+        print(f"{len(regressions)} regressions above {args.threshold}%.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
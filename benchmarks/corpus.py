@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pydub
+
+# pydub export arguments and file extension of each benchmarked input format.
+FORMATS = {
+    "mp3": {"extension": ".mp3", "export": {"format": "mp3", "bitrate": "320k"}},
+    "flac": {"extension": ".flac", "export": {"format": "flac"}},
+    "m4a": {"extension": ".m4a", "export": {"format": "mp4", "codec": "aac"}},
+}
+CHORD = [220.0, 277.18, 329.63, 440.0]
+
+
+def synthetic_sound(seconds, frame_rate=44100, seed=0):
+    # A chord pulsing at 120 bpm over some noise, so that the encoders and the
+    # fingerprinter have something closer to music than a pure tone to chew on.
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    signal = sum(
+        np.sin(2 * np.pi * f * (1 + 0.01 * seed) * t + rng.uniform(0, np.pi))
+        for f in CHORD
+    )
+    envelope = 0.4 + 0.6 * np.exp(-((t * 2) % 1) * 6)
+    signal = signal * envelope / len(CHORD) + 0.05 * rng.standard_normal(len(t))
+    left = signal * rng.uniform(0.3, 0.9)
+    right = np.roll(left, 100)
+    samples = np.stack([left, right], axis=1) * 32767 * 0.8
+    return pydub.AudioSegment(
+        samples.astype(np.int16).tobytes(),
+        sample_width=2,
+        frame_rate=frame_rate,
+        channels=2,
+    )
+
+
+def track_tags(index):
+    return {
+        "artist": f"benchmark artist {index % 10}",
+        "album": f"benchmark album {index % 25}",
+        "title": f"benchmark track {index}",
+        "tracknumber": str(index % 12 + 1),
+        "date": "2019",
+        "genre": "Electronic",
+    }
+
+
+def generate(directory, tracks, seconds, formats=("mp3", "flac", "m4a"), seed=0):
+    # Exports tracks synthetic files cycling through the formats and returns
+    # their paths.
+    paths = []
+    for index in range(tracks):
+        audio_format = formats[index % len(formats)]
+        path = os.path.join(
+            directory, f"track_{index:04d}" + FORMATS[audio_format]["extension"]
+        )
+        synthetic_sound(seconds, seed=seed + index).export(
+            path, tags=track_tags(index), **FORMATS[audio_format]["export"]
+        )
+        paths.append(path)
+    return paths
@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def discogs_results(query, count=5):
+    return [
+        {
+            "id": i,
+            "type": "release",
+            "title": f"{query} {i}",
+            "format": ["Vinyl" if i % 2 else "CD"],
+            "community": {"want": 10 * i, "have": 5 * i},
+            "cover_image": f"https://img.example.com/{i}.jpeg" if i % 3 else "",
+            "resource_url": f"https://api.example.com/releases/{i}",
+        }
+        for i in range(count)
+    ]
+
+
+def spotify_tracks(query, count=3):
+    return [
+        {
+            "id": f"track{i}",
+            "name": f"{query} {i}",
+            "artists": [{"name": "Artist"}],
+            "album": {"name": "Album"},
+            "popularity": 50 - i,
+        }
+        for i in range(count)
+    ]
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query).get("q", [""])[0]
+        if url.path == "/database/search":
+            body = {
+                "pagination": {
+                    "page": 1,
+                    "pages": 1,
+                    "per_page": 50,
+                    "items": 5,
+                    "urls": {},
+                },
+                "results": discogs_results(query),
+            }
+        elif url.path.startswith("/releases/"):
+            body = {
+                "id": int(url.path.rsplit("/", 1)[1]),
+                "tracklist": [
+                    {
+                        "position": f"A{i + 1}",
+                        "type_": "track",
+                        "title": f"benchmark track {i}",
+                        "duration": "3:00",
+                    }
+                    for i in range(12)
+                ],
+            }
+        elif url.path == "/v1/search":
+            tracks = spotify_tracks(query)
+            body = {
+                "tracks": {
+                    "items": tracks,
+                    "total": len(tracks),
+                    "limit": 20,
+                    "offset": 0,
+                    "next": None,
+                }
+            }
+        else:
+            return self.respond(404, {"message": "Not found"})
+        self.respond(200, body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if urlparse(self.path).path == "/api/token":
+            return self.respond(
+                200,
+                {"access_token": "fake", "token_type": "Bearer", "expires_in": 3600},
+            )
+        self.respond(404, {"message": "Not found"})
+
+    def respond(self, status, body):
+        # Simulated network round-trip
+        time.sleep(self.server.latency)
+        self.server.count_request()
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    # Local stand-in for the Discogs and Spotify APIs, answering every search
+    # after a configurable latency.
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(("127.0.0.1", 0), FakeAPIHandler)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+    @property
+    def urls(self):
+        # In the format of harmonizer.clients.API_URLS
+        return {
+            "discogs": self.url,
+            "spotify": self.url + "/v1/",
+            "spotify_token": self.url + "/api/token",
+        }
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
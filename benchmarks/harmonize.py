@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import acoustid
+
+from benchmarks import corpus, fake_api
+from harmonizer import cli, clients, config, enrichments, instrumentation, manipulations
+
+CREDENTIALS = {
+    "discogs_token": "benchmark",
+    "sp_client_id": "benchmark",
+    "sp_client_secret": "benchmark",
+}
+# High enough for the rate limiters to never throttle the local server.
+UNLIMITED = {"discogs": 10**6, "spotify": 10**6}
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_config(normalization_mode, streaming_mode):
+    return config.parse(
+        {
+            "output_bitrate": 192,
+            "enrichments": {
+                "discogs": {"discogs_token": CREDENTIALS["discogs_token"]},
+                "spotify": {
+                    "sp_client_id": CREDENTIALS["sp_client_id"],
+                    "sp_client_secret": CREDENTIALS["sp_client_secret"],
+                },
+            },
+            "validations": {"mandatory_tags": ["artist", "album", "title"]},
+            "normalization": {"mode": normalization_mode},
+            "streaming": {"mode": streaming_mode},
+            "fingerprinting": {
+                "source": "pcm" if acoustid.have_chromaprint else "file"
+            },
+            "rate_limits": UNLIMITED,
+        }
+    )
+
+
+def throughput(tracks, audio_seconds, wall):
+    return {
+        "tracks": tracks,
+        "audio_seconds": round(audio_seconds, 1),
+        "wall": round(wall, 3),
+        "tracks_per_minute": round(tracks / wall * 60, 2),
+        "audio_seconds_per_second": round(audio_seconds / wall, 2),
+    }
+
+
+def bench_harmonize(paths, parsed_config, output_dir):
+    # Runs harmonize_file on every track, stages are timed by the pipeline
+    # instrumentation.
+    stage_statistics = instrumentation.StageStatistics()
+    per_format = {}
+    for path in paths:
+        audio_format = os.path.splitext(path)[1].lstrip(".")
+        audio_seconds = manipulations.probe(path)["duration"] or 0
+        start_time = time.perf_counter()
+        results = cli.harmonize_file(
+            path, output_dir, output_dir, output_dir, parsed_config
+        )
+        wall = time.perf_counter() - start_time
+        stage_statistics.add(results["timings"])
+        totals = per_format.setdefault(audio_format, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += audio_seconds
+        totals[2] += wall
+
+    tracks = sum(t[0] for t in per_format.values())
+    report = throughput(
+        tracks,
+        sum(t[1] for t in per_format.values()),
+        sum(t[2] for t in per_format.values()),
+    )
+    report["formats"] = {
+        audio_format: throughput(*totals) for audio_format, totals in per_format.items()
+    }
+    report["stages"] = stage_statistics.summary()
+    return report
+
+
+def bench_enrichments(tracks, concurrency):
+    all_tags = [corpus.track_tags(i) for i in range(tracks)]
+    lookups = tracks * 2
+
+    start_time = time.perf_counter()
+    for tags in all_tags:
+        enrichments.pipeline(tags, ["discogs", "spotify"], **CREDENTIALS)
+    serial = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with clients.ClientRegistry(rate_limits=UNLIMITED) as registry:
+        with enrichments.EnrichmentStage(
+            ["discogs", "spotify"],
+            max_in_flight=concurrency,
+            client_registry=registry,
+            **CREDENTIALS,
+        ) as stage:
+            futures = [stage.submit(tags) for tags in all_tags]
+            for f in futures:
+                enrichments.collect(f)
+    concurrent = time.perf_counter() - start_time
+
+    return {
+        "lookups": lookups,
+        "serial_lookups_per_second": round(lookups / serial, 2),
+        "concurrent_lookups_per_second": round(lookups / concurrent, 2),
+        "concurrency": concurrency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks harmonize_file on a synthetic corpus, with "
+        "enrichments answered by a local fake API server."
+    )
+    parser.add_argument("--tracks", type=int, default=12)
+    parser.add_argument("--seconds", type=float, default=180)
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=sorted(corpus.FORMATS),
+        default=["mp3", "flac", "m4a"],
+    )
+    parser.add_argument("--normalization", choices=["peak", "lufs"], default="peak")
+    parser.add_argument(
+        "--streaming", choices=["auto", "always", "never"], default="never"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Seconds the fake API waits before answering.",
+    )
+    parser.add_argument("--enrichment-concurrency", type=int, default=4)
+    parser.add_argument(
+        "--skip-audio",
+        action="store_true",
+        help="Only benchmark enrichments, no ffmpeg needed.",
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "arguments": vars(args),
+    }
+    with fake_api.FakeAPIServer(
+        args.latency
+    ) as api, tempfile.TemporaryDirectory() as workdir:
+        clients.API_URLS.update(api.urls)
+        report["enrichments"] = bench_enrichments(
+            args.tracks, args.enrichment_concurrency
+        )
+        if not args.skip_audio:
+            input_dir = os.path.join(workdir, "inputs")
+            output_dir = os.path.join(workdir, "outputs")
+            os.makedirs(input_dir)
+            os.makedirs(output_dir)
+            paths = corpus.generate(input_dir, args.tracks, args.seconds, args.formats)
+            report["harmonize_file"] = bench_harmonize(
+                paths,
+                benchmark_config(args.normalization, args.streaming),
+                output_dir,
+            )
+        report["api_requests"] = api.requests
+    report["peak_rss_mb"] = instrumentation.peak_rss_mb()
+    report["children_peak_rss_mb"] = instrumentation.children_peak_rss_mb()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    enrichment_report = report["enrichments"]
+    print(
+        f"Enrichments: {enrichment_report['serial_lookups_per_second']} lookups/s "
+        f"serial, {enrichment_report['concurrent_lookups_per_second']} lookups/s "
+        f"with {args.enrichment_concurrency} in flight per provider."
+    )
+    if "harmonize_file" in report:
+        harmonize_report = report["harmonize_file"]
+        print(
+            f"harmonize_file: {harmonize_report['tracks_per_minute']} tracks/min, "
+            f"{harmonize_report['audio_seconds_per_second']} s of audio/s, "
+            f"peak RSS {report['peak_rss_mb']} MB "
+            f"(children {report['children_peak_rss_mb']} MB)."
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
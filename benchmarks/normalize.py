@@ -0,0 +1,53 @@
+import argparse
+import time
+
+import numpy as np
+import pydub
+import pydub.effects
+
+from harmonizer import manipulations
+
+
+def synthetic_track(minutes, frame_rate=44100, channels=2, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = int(minutes * 60 * frame_rate)
+    samples = (rng.standard_normal(frames * channels) * 3000).astype(np.int16)
+    return pydub.AudioSegment(
+        samples.tobytes(), sample_width=2, frame_rate=frame_rate, channels=channels
+    )
+
+
+def pydub_normalize(sound, headroom):
+    normalized = pydub.effects.normalize(sound, headroom)
+    return sound.dBFS, normalized.dBFS, sound.dBFS - normalized.dBFS, normalized
+
+
+def best_time(func, sound, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(sound, 0.1)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the NumPy normalization to pydub.effects.normalize."
+    )
+    parser.add_argument("--minutes", type=float, nargs="+", default=[5, 30, 70])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for minutes in args.minutes:
+        sound = synthetic_track(minutes)
+        numpy_time = best_time(manipulations.normalize, sound, args.repeat)
+        pydub_time = best_time(pydub_normalize, sound, args.repeat)
+        print(
+            f"{minutes:g} min: numpy {numpy_time:.2f}s, pydub {pydub_time:.2f}s, "
+            f"speedup x{pydub_time / numpy_time:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import collections
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from harmonizer import instrumentation, manipulations, validations
+
+AUDIT_FORMATS = ["jsonl", "csv"]
+CSV_FIELDS = [
+    "file",
+    "size",
+    "mime_type",
+    "bitrate",
+    "duration",
+    "valid",
+    "validation_errors",
+    "error",
+]
+
+
+# Validations of the files that cannot be parsed, nothing else can be checked.
+INTEGRITY_PLAN = validations.ValidationPlan({"integrity_check": True})
+
+
+def preflight(local_file_path, preflight_plan, timings=None):
+    # Validations needing only probe data run before any decoding. The probe
+    # data is returned so that the pipeline does not parse the file again.
+    with instrumentation.stage(timings, "probe"):
+        if preflight_plan.config.get("integrity_check", False):
+            probed, integrity_errors = manipulations.probe_integrity(local_file_path)
+        else:
+            probed, integrity_errors = manipulations.probe(local_file_path), []
+    if probed is None:
+        _, errors = INTEGRITY_PLAN.validate(
+            timings=timings, integrity_errors=integrity_errors
+        )
+        return probed, errors
+    _, errors = preflight_plan.validate(
+        timings=timings,
+        integrity_errors=integrity_errors,
+        tags=probed["tags"],
+        input_bitrate=probed["bitrate"],
+        input_mime_type=probed["mime_type"],
+    )
+    return probed, errors
+
+
+def audit_file(local_file_path, preflight_plan):
+    record = {
+        "file": local_file_path,
+        "size": None,
+        "mime_type": None,
+        "bitrate": None,
+        "duration": None,
+        "valid": False,
+        "validation_errors": {},
+        "error": None,
+    }
+    try:
+        record["size"] = os.path.getsize(local_file_path)
+        probed, errors = preflight(local_file_path, preflight_plan)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    if probed is not None:
+        record["mime_type"] = probed["mime_type"]
+        record["bitrate"] = probed["bitrate"]
+        if probed["duration"] is not None:
+            record["duration"] = round(probed["duration"], 3)
+    record["valid"] = not errors
+    record["validation_errors"] = errors
+    return record
+
+
+def audit(local_file_paths, preflight_plan, workers=8):
+    # Only headers and tags are read, which is mostly waiting on the disk, so
+    # threads are enough. Records are yielded in scan order through a bounded
+    # window, the scan of a huge tree is never materialized.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for local_file_path in local_file_paths:
+            pending.append(executor.submit(audit_file, local_file_path, preflight_plan))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class AuditWriter:
+    # Writes audit records as JSON lines or CSV rows, validation errors are
+    # JSON encoded in CSV cells. Counts are kept for the final summary.
+    def __init__(self, f, output_format="jsonl"):
+        self.f = f
+        self.output_format = output_format
+        self.counts = collections.Counter()
+        self._csv = None
+        if output_format == "csv":
+            self._csv = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, record):
+        self.counts["audited"] += 1
+        if record["error"] is not None:
+            self.counts["unreadable"] += 1
+        elif not record["valid"]:
+            self.counts["invalid"] += 1
+        for error_key in record["validation_errors"]:
+            self.counts[error_key] += 1
+        if self._csv is not None:
+            self._csv.writerow(
+                dict(record, validation_errors=json.dumps(record["validation_errors"]))
+            )
+        else:
+            self.f.write(json.dumps(record) + "\n")
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 100000
+CACHE_FILENAME = "enrichments.sqlite"
+
+
+def normalize_query(*parts):
+    return "|".join(
+        re.sub(r"\s+", " ", str(p)).strip().lower() if p is not None else ""
+        for p in parts
+    )
+
+
+class EnrichmentCache:
+    def __init__(
+        self, cache_dir, ttl_days=DEFAULT_TTL_DAYS, max_entries=DEFAULT_MAX_ENTRIES
+    ):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILENAME)
+        self.ttl = ttl_days * 24 * 3600
+        self.max_entries = max_entries
+        self.entries = 0
+        self.hits = 0
+        self.misses = 0
+        # Enrichments are looked up from several threads, sqlite connections are
+        # shared behind a lock.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS enrichments ("
+                "provider TEXT NOT NULL, query TEXT NOT NULL, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (provider, query))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS enrichments_accessed_at "
+                "ON enrichments (accessed_at)"
+            )
+        self.evict()
+
+    def get(self, provider, query):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM enrichments "
+                "WHERE provider = ? AND query = ? AND created_at >= ?",
+                (provider, query, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE enrichments SET accessed_at = ? "
+                    "WHERE provider = ? AND query = ?",
+                    (now, provider, query),
+                )
+        return json.loads(row[0])
+
+    def set(self, provider, query, value):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO enrichments "
+                "(provider, query, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (provider, query, json.dumps(value), now, now),
+            )
+            # Replaced entries are counted too, the eviction counts them again.
+            self.entries += 1
+        if self.entries > self.max_entries:
+            # A tenth of the entries are evicted at once so that the eviction
+            # does not run again on every insert.
+            self.evict(self.max_entries - self.max_entries // 10)
+
+    def evict(self, max_entries=None):
+        if max_entries is None:
+            max_entries = self.max_entries
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM enrichments WHERE created_at < ?",
+                (time.time() - self.ttl,),
+            )
+            # Least recently used entries go first once the cache is full.
+            self._connection.execute(
+                "DELETE FROM enrichments WHERE rowid IN ("
+                "SELECT rowid FROM enrichments ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+            self.entries = self._connection.execute(
+                "SELECT COUNT(*) FROM enrichments"
+            ).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM enrichments"
+            ).fetchone()[0]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
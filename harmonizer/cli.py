@@ -1,7 +1,10 @@
+import collections
+import contextlib
 import json
 import os
 import time
-from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import sys
 
 import click
@@ -9,7 +12,28 @@ import logme
 import schema
 import yaml
 
-from harmonizer import config, enrichments, manipulations, validations
+from harmonizer import (
+    audit,
+    cache,
+    clients,
+    config,
+    covers,
+    enrichments,
+    fingerprints,
+    instrumentation,
+    journal,
+    loudness,
+    manifest,
+    manipulations,
+    report,
+    scanner,
+    streaming,
+    validations,
+)
+
+MAX_PENDING_ENRICHMENTS = 100
+# Enrichment settings of the config which are not credentials.
+ENRICHMENT_OPTIONS = ["match_tracklist"]
 
 
 @click.command(
@@ -38,6 +62,43 @@ from harmonizer import config, enrichments, manipulations, validations
     type=click.Path(exists=True, file_okay=False, dir_okay=True),
     help="Path to directory to which extracted cover arts will be written to.",
 )
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes harmonizing files in parallel.",
+)
+@click.option(
+    "--enrichment-concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Maximum number of in-flight requests per enrichment provider.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Process all files, even those whose outputs are already up to date.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Resume an interrupted run: skip the files it finished and retry the "
+    "enrichments of those it already transcoded.",
+)
+@click.option(
+    "--progress",
+    "progress_file",
+    type=click.File("w"),
+    help="Write JSON-lines progress events to this file, - for stdout.",
+)
+@click.option(
+    "--report",
+    "report_path",
+    type=click.Path(file_okay=True, dir_okay=False, writable=True),
+    help="Write a JSON report of the run to this file.",
+)
 @logme.log(name="Harmonizer CLI")
 def harmonize_directory(
     audio_input_dir,
@@ -45,6 +106,12 @@ def harmonize_directory(
     conf,
     json_output_dir,
     image_output_dir,
+    workers,
+    enrichment_concurrency,
+    force,
+    resume,
+    progress_file,
+    report_path,
     logger=None,
 ):
     if json_output_dir is None:
@@ -52,6 +119,211 @@ def harmonize_directory(
     if image_output_dir is None:
         image_output_dir = audio_output_dir
 
+    parsed_config = load_config(conf, logger)
+    extensions = scanner.extensions_for(
+        parsed_config.get("validations", {}).get(
+            "accepted_input_mime_types", config.HANDLED_MIME_TYPES
+        )
+    )
+    run_manifest = manifest.Manifest(json_output_dir, parsed_config)
+    run_journal = journal.Journal(json_output_dir, parsed_config, resume=resume)
+    run_report = report.RunReport(report.ProgressStream(progress_file))
+    validation_plans = validations.compile_plans(parsed_config.get("validations", {}))
+
+    def pending_jobs():
+        output_dirs = (audio_output_dir, json_output_dir, image_output_dir)
+        for f in scanner.scan(audio_input_dir, extensions, excluded_dirs=output_dirs):
+            if not force and run_manifest.is_up_to_date(f):
+                run_report.file_skipped(f)
+                continue
+            if resume and run_journal.is_done(f):
+                run_report.file_skipped(f)
+                continue
+            job = file_job(
+                f, audio_input_dir, audio_output_dir, json_output_dir, image_output_dir
+            )
+            if resume:
+                job["manipulated"] = run_journal.manipulated(f)
+            run_journal.start(f)
+            run_report.file_started(f)
+            yield job
+
+    stage_statistics = instrumentation.StageStatistics()
+    if workers > 1:
+        manipulated = run_in_pool(
+            manipulate_job, pending_jobs(), (parsed_config, validation_plans), workers
+        )
+    else:
+        manipulated = (
+            (job, run_safely(manipulate_job, job, parsed_config, validation_plans))
+            for job in pending_jobs()
+        )
+
+    manipulated = journaled(deduplicated(manipulated, parsed_config), run_journal)
+
+    enrichment_cache = open_enrichment_cache(parsed_config)
+    client_registry = clients.ClientRegistry(
+        rate_limits=parsed_config.get("rate_limits")
+    )
+    discogs_config = parsed_config.get("enrichments", {}).get("discogs", {})
+    enrichment_stage = enrichments.EnrichmentStage(
+        list(parsed_config.get("enrichments", {}).keys()),
+        max_in_flight=enrichment_concurrency,
+        cache=enrichment_cache,
+        client_registry=client_registry,
+        match_tracklist=discogs_config.get("match_tracklist", False),
+        **enrichment_credentials(parsed_config),
+    )
+    with client_registry, enrichment_stage:
+        outcomes = enrich_and_finalize(
+            manipulated, enrichment_stage, parsed_config, validation_plans
+        )
+        for job, outcome in outcomes:
+            run_report.file_finished(job["local_file_path"], outcome)
+            f = os.path.relpath(job["local_file_path"], audio_input_dir)
+            if outcome["error"] is not None:
+                run_journal.fail(
+                    job["local_file_path"],
+                    outcome.get("failed_stage", "manipulation"),
+                    outcome["error"],
+                )
+                logger.error(f"Failed to process file {f}: {outcome['error']}")
+                continue
+            results = outcome["results"]
+            stage_statistics.add(results["timings"])
+            if results.get("duplicate_of") is not None:
+                logger.info(
+                    f"Skipped file {f}, duplicate of {results['duplicate_of']['path']}."
+                )
+                run_journal.finish(job["local_file_path"], [])
+                run_manifest.record(job["local_file_path"], [])
+                continue
+            if results.get("rejected", False):
+                logger.warning(f"Rejected file {f}: {results['validation_errors']}")
+                run_journal.finish(job["local_file_path"], [])
+                run_manifest.record(job["local_file_path"], [])
+                continue
+            if len(results["validation_errors"]) > 0:
+                logger.warning(
+                    f"Validation error for {f}: {results['validation_errors']}"
+                )
+            logger.info(
+                f"Successfully processed file {f} in {int(outcome['process_time'])} seconds."
+            )
+            logger.debug(f"Stage timings for {f}: {results['timings']}")
+            output_paths = [
+                results["output_file_path"],
+                result_path(job["local_file_path"], job["json_output_dir"]),
+            ]
+            run_journal.finish(job["local_file_path"], output_paths)
+            run_manifest.record(job["local_file_path"], output_paths)
+    run_manifest.save()
+    run_journal.close()
+    fingerprint_index = open_fingerprint_index(parsed_config)
+    if fingerprint_index is not None:
+        fingerprint_index.save()
+    summary = run_report.finish(stage_statistics.summary())
+    if report_path is not None:
+        run_report.save(report_path, summary)
+
+    totals = summary["totals"]
+    if totals["skipped"]:
+        logger.info(
+            f"Skipped {totals['skipped']} files whose outputs are up to date, "
+            "use --force to process them again."
+        )
+    logger.info(
+        f"Processed {totals['processed']} files in {int(summary['duration'])} seconds: "
+        f"{totals['succeeded']} succeeded "
+        f"({totals['with_validation_errors']} with validation errors), "
+        f"{totals['duplicates']} skipped as duplicates, "
+        f"{totals['rejected']} rejected by preflight validations, "
+        f"{totals['failed']} failed."
+    )
+    if enrichment_cache is not None:
+        cache_stats = enrichment_cache.stats()
+        logger.info(
+            f"Enrichment cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses."
+        )
+        enrichment_cache.close()
+    for provider in enrichment_stage.enrichments:
+        scheduler_stats = client_registry.scheduler(provider).stats()
+        logger.info(
+            f"{provider.capitalize()} requests: {scheduler_stats['requests']} sent, "
+            f"{scheduler_stats['retries']} retried after rate limiting, "
+            f"max queue depth {scheduler_stats['max_queue_depth']}, "
+            f"{int(scheduler_stats['total_wait'])} seconds spent waiting."
+        )
+    if stage_statistics.walls:
+        logger.info(f"Stage wall times in seconds:\n{stage_statistics.table()}")
+    if summary["failures"]:
+        logger.error(
+            f"Failed files: {[failure['file'] for failure in summary['failures']]}"
+        )
+
+
+@click.command(
+    help="Audits the audio files of audio_input_dir against the validations of your config, reading only their headers and tags."
+)
+@click.argument(
+    "audio_input_dir", type=click.Path(exists=True, file_okay=False, dir_okay=True)
+)
+@click.argument(
+    "conf",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    envvar="HARMONIZER_CONF",
+)
+@click.option(
+    "--output",
+    "output_file",
+    type=click.File("w"),
+    default="-",
+    help="Write the audit records to this file, - for stdout.",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(audit.AUDIT_FORMATS),
+    default="jsonl",
+    show_default=True,
+    help="Format of the audit records.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Number of threads reading files in parallel.",
+)
+@logme.log(name="Harmonizer CLI")
+def audit_directory(
+    audio_input_dir, conf, output_file, output_format, workers, logger=None
+):
+    parsed_config = load_config(conf, logger)
+    preflight_plan, _ = validations.compile_plans(parsed_config.get("validations", {}))
+    # All handled files are audited, so that those of a mime type which is not
+    # accepted are reported.
+    extensions = scanner.extensions_for(config.HANDLED_MIME_TYPES)
+    start_time = time.time()
+    writer = audit.AuditWriter(output_file, output_format)
+    for record in audit.audit(
+        scanner.scan(audio_input_dir, extensions),
+        preflight_plan,
+        workers=workers,
+    ):
+        writer.write(record)
+    counts = writer.counts
+    logger.info(
+        f"Audited {counts['audited']} files in {int(time.time() - start_time)} seconds: "
+        f"{counts['invalid']} invalid, {counts['unreadable']} unreadable."
+    )
+    for validation in validations.AVAILABLE_VALIDATIONS.values():
+        error_key = validation["error_key"]
+        if counts[error_key]:
+            logger.info(f"{counts[error_key]} files with {error_key}.")
+
+
+def load_config(conf, logger):
     with open(conf, "r") as f:
         try:
             raw_config = yaml.load(f, Loader=yaml.FullLoader)
@@ -70,80 +342,428 @@ def harmonize_directory(
             "Could not parse the config, it does not have the expected schema."
         )
         sys.exit(1)
+    # Checked once here rather than failing the cover art stage of every file.
+    thumbnail_sizes = parsed_config.get("cover_art", {}).get("thumbnail_sizes")
+    if thumbnail_sizes and not covers.thumbnails_available():
+        logger.error(
+            "Cover art thumbnails require Pillow: pip install harmonizer[thumbnails]"
+        )
+        sys.exit(1)
+    return parsed_config
 
-    valid_extensions = [
-        "*." + m.replace("audio/", "")
-        for m in parsed_config.get("validations", {}).get(
-            "accepted_input_mime_types", []
+
+def run_safely(func, *args):
+    start_time = time.time()
+    try:
+        results = func(*args)
+        error = None
+    except Exception as e:
+        results = None
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "results": results,
+        "error": error,
+        "process_time": time.time() - start_time,
+    }
+
+
+def run_in_pool(func, jobs, args, workers):
+    # Jobs are submitted through a bounded window and yielded back in submission
+    # order so that logs stay ordered while workers keep busy.
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = collections.deque()
+    try:
+        for job in jobs:
+            try:
+                future = executor.submit(run_safely, func, job, *args)
+            except BrokenProcessPool:
+                # A worker died (OOM, ffmpeg crash...): in-flight files are reported
+                # as failed and the remaining ones go to a fresh pool.
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=workers)
+                future = executor.submit(run_safely, func, job, *args)
+            pending.append((job, future))
+            if len(pending) >= workers * 2:
+                yield collect_outcome(*pending.popleft())
+        while pending:
+            yield collect_outcome(*pending.popleft())
+    finally:
+        executor.shutdown(wait=True)
+
+
+def collect_outcome(job, future):
+    try:
+        return job, future.result()
+    except Exception as e:
+        return (
+            job,
+            {"results": None, "error": f"{type(e).__name__}: {e}", "process_time": 0},
         )
-    ]
-    globs = [os.path.join(audio_input_dir, ext) for ext in valid_extensions]
 
-    for file_type in globs:
-        for f in glob(file_type):
-            start_time = time.time()
-            results = harmonize_file(
-                f, audio_output_dir, json_output_dir, image_output_dir, parsed_config
-            )
-            process_time = time.time() - start_time
-            f = os.path.basename(f)
-            if len(results["validation_errors"]) > 0:
-                logger.warning(
-                    f"Validation error for {f}: {results['validation_errors']}"
+
+def journaled(manipulated, run_journal):
+    # Manipulation results are journaled before waiting for enrichments, so that
+    # a resumed run does not transcode the file again.
+    for job, outcome in manipulated:
+        if outcome["error"] is None:
+            run_journal.record_manipulated(job["local_file_path"], outcome["results"])
+        yield job, outcome
+
+
+def deduplicated(manipulated, parsed_config):
+    # Workers only see the index as last saved, and files are indexed once
+    # enriched. Transcoded files are checked again here, in order, against
+    # every file of the run before them.
+    if not parsed_config.get("fingerprint_index", {}).get("skip_duplicates", False):
+        yield from manipulated
+        return
+    fingerprint_index = open_fingerprint_index(parsed_config)
+    for job, outcome in manipulated:
+        results = outcome["results"]
+        if outcome["error"] is None and not is_skipped(results):
+            fingerprinting = results["manipulation_metadata"]["fingerprinting"]
+            try:
+                duplicate = fingerprint_index.find_duplicate(
+                    fingerprinting["fingerprint"],
+                    fingerprinting["duration"],
+                    exclude_path=results["local_file_path"],
                 )
-            logger.info(
-                f"Successfully processed file {f} in {int(process_time)} seconds."
-            )
+                if duplicate is None:
+                    fingerprint_index.add(
+                        results["local_file_path"],
+                        fingerprinting["fingerprint"],
+                        fingerprinting["duration"],
+                    )
+            except fingerprints.InvalidFingerprint:
+                duplicate = None
+            if duplicate is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(results["output_file_path"])
+                results = {
+                    **results,
+                    "output_file_path": None,
+                    "duplicate_of": duplicate,
+                }
+                outcome = {**outcome, "results": results}
+        yield job, outcome
+
+
+def enrich_and_finalize(
+    manipulated, enrichment_stage, parsed_config, validation_plans=None
+):
+    # Enrichments of a file run in the background while the next files are being
+    # manipulated. Files are finalized in order as soon as their lookups are done.
+    pending = collections.deque()
+    for job, outcome in manipulated:
+        enrichment_futures = {}
+        timings = instrumentation.Timings()
+        if outcome["error"] is None and not is_skipped(outcome["results"]):
+            tags = outcome["results"]["manipulation_metadata"].get("tags")
+            if tags is not None:
+                enrichment_futures = enrichment_stage.submit(tags, timings)
+        pending.append((job, outcome, enrichment_futures, timings))
+        while pending and (
+            enrichments.is_done(pending[0][2]) or len(pending) > MAX_PENDING_ENRICHMENTS
+        ):
+            yield finalize_outcome(*pending.popleft(), parsed_config, validation_plans)
+    while pending:
+        yield finalize_outcome(*pending.popleft(), parsed_config, validation_plans)
+
+
+def finalize_outcome(
+    job, outcome, enrichment_futures, timings, parsed_config, validation_plans=None
+):
+    if outcome["error"] is not None or is_skipped(outcome["results"]):
+        return job, outcome
+    finalized = run_safely(
+        lambda manipulated: finalize_file(
+            manipulated,
+            enrichments.collect(enrichment_futures),
+            job["json_output_dir"],
+            parsed_config,
+            timings=timings,
+            validation_plans=validation_plans,
+        ),
+        outcome["results"],
+    )
+    finalized["process_time"] += outcome["process_time"]
+    if finalized["error"] is not None:
+        finalized["failed_stage"] = (
+            "enrichment"
+            if any(f.exception() is not None for f in enrichment_futures.values())
+            else "finalization"
+        )
+    return job, finalized
+
+
+def is_skipped(manipulated):
+    # Duplicates and rejected files are not transcoded, nor enriched.
+    return manipulated["output_file_path"] is None
+
+
+def enrichment_credentials(parsed_config):
+    enrichment_creds = {}
+    for e in parsed_config.get("enrichments", {}).values():
+        enrichment_creds.update(
+            {k: v for k, v in e.items() if k not in ENRICHMENT_OPTIONS}
+        )
+    return enrichment_creds
+
+
+def open_enrichment_cache(parsed_config):
+    cache_config = parsed_config.get("enrichment_cache")
+    if cache_config is None:
+        return None
+    return cache.EnrichmentCache(
+        os.path.expanduser(cache_config["directory"]),
+        ttl_days=cache_config.get("ttl_days", cache.DEFAULT_TTL_DAYS),
+        max_entries=cache_config.get("max_entries", cache.DEFAULT_MAX_ENTRIES),
+    )
+
+
+def open_fingerprint_index(parsed_config):
+    index_config = parsed_config.get("fingerprint_index")
+    if index_config is None:
+        return None
+    return fingerprints.shared_index(
+        os.path.expanduser(index_config["directory"]),
+        duplicate_similarity=index_config.get(
+            "duplicate_similarity", fingerprints.DEFAULT_DUPLICATE_SIMILARITY
+        ),
+        near_duplicate_similarity=index_config.get(
+            "near_duplicate_similarity", fingerprints.DEFAULT_NEAR_DUPLICATE_SIMILARITY
+        ),
+    )
 
 
 def harmonize_file(
     local_file_path, audio_output_dir, json_output_dir, image_output_dir, parsed_config
 ):
-    enrichment_creds = {}
-    for e in parsed_config["enrichments"].values():
-        enrichment_creds.update(e)
+    manipulated = manipulate_file(
+        local_file_path, audio_output_dir, image_output_dir, parsed_config
+    )
+    if is_skipped(manipulated):
+        return manipulated
+    timings = instrumentation.Timings()
+    if "tags" in manipulated["manipulation_metadata"]:
+        enrichments_metadata = enrichments.pipeline(
+            manipulated["manipulation_metadata"]["tags"],
+            list(parsed_config.get("enrichments", {}).keys()),
+            timings=timings,
+            **enrichment_credentials(parsed_config),
+        )
+    else:
+        enrichments_metadata = {}
+    return finalize_file(
+        manipulated, enrichments_metadata, json_output_dir, parsed_config, timings
+    )
 
+
+def file_job(
+    local_file_path,
+    audio_input_dir,
+    audio_output_dir,
+    json_output_dir,
+    image_output_dir,
+):
+    # Outputs mirror the folder structure of the input directory.
+    return {
+        "local_file_path": local_file_path,
+        "audio_output_dir": scanner.mirror_dir(
+            audio_output_dir, audio_input_dir, local_file_path
+        ),
+        "json_output_dir": scanner.mirror_dir(
+            json_output_dir, audio_input_dir, local_file_path
+        ),
+        # Cover arts are stored by content, shared by the whole library.
+        "image_output_dir": image_output_dir,
+    }
+
+
+def manipulate_job(job, parsed_config, validation_plans=None):
+    if job.get("manipulated") is not None:
+        # Already transcoded by an interrupted run.
+        return job["manipulated"]
+    return manipulate_file(
+        job["local_file_path"],
+        job["audio_output_dir"],
+        job["image_output_dir"],
+        parsed_config,
+        validation_plans,
+    )
+
+
+def manipulate_file(
+    local_file_path,
+    audio_output_dir,
+    image_output_dir,
+    parsed_config,
+    validation_plans=None,
+):
     basename = os.path.basename(local_file_path)
     basename, _ = os.path.splitext(basename)
     output_file_path = os.path.join(audio_output_dir, basename) + ".mp3"
-    output_result_path = os.path.join(json_output_dir, basename) + ".json"
+    # The file may be rejected or skipped this time, the partial output of a
+    # killed run would then never be replaced.
+    manipulations.remove_partial(output_file_path)
+    timings = instrumentation.Timings()
+    validations_config = parsed_config.get("validations", {})
+    if validation_plans is None:
+        validation_plans = validations.compile_plans(validations_config)
+    preflight_plan, _ = validation_plans
+    probed, preflight_errors = audit.preflight(local_file_path, preflight_plan, timings)
+    if preflight_errors and validations_config.get("preflight") == "reject":
+        return {
+            "local_file_path": local_file_path,
+            "output_file_path": None,
+            "rejected": True,
+            "validation_errors": preflight_errors,
+            "manipulation_metadata": {},
+            "timings": timings.as_dict(),
+        }
+    if parsed_config.get("fingerprint_index", {}).get("skip_duplicates", False):
+        # The input is fingerprinted first so that confirmed duplicates of
+        # indexed tracks are not transcoded.
+        with timings.stage("duplicate_check"):
+            duration, fp = manipulations.fingerprint(
+                local_file_path,
+                parsed_config.get("fingerprinting", {}).get(
+                    "max_length", manipulations.FINGERPRINT_MAX_LENGTH
+                ),
+            )
+            duplicate = open_fingerprint_index(parsed_config).find_duplicate(
+                fp, duration, exclude_path=local_file_path
+            )
+        if duplicate is not None:
+            return {
+                "local_file_path": local_file_path,
+                "output_file_path": None,
+                "duplicate_of": duplicate,
+                "validation_errors": preflight_errors,
+                "manipulation_metadata": {
+                    "fingerprinting": {"duration": duration, "fingerprint": fp}
+                },
+                "timings": timings.as_dict(),
+            }
     manipulation_metadata, exported_filepath, cover_art_path = manipulations.pipeline(
         local_file_path,
         output_file_path,
         image_output_dir,
-        active_normalize=parsed_config["normalization_headroom"] > 0,
+        active_normalize=parsed_config.get("normalization", {}).get("mode") != "none",
         normalization_headroom=parsed_config["normalization_headroom"],
+        target_bitrate=parsed_config["output_bitrate"],
+        fingerprint_source=parsed_config.get("fingerprinting", {}).get(
+            "source", "file"
+        ),
+        fingerprint_max_length=parsed_config.get("fingerprinting", {}).get(
+            "max_length", manipulations.FINGERPRINT_MAX_LENGTH
+        ),
+        fast_path=parsed_config.get("fast_path", {}).get("enabled", False),
+        fast_path_max_gain_change=parsed_config.get("fast_path", {}).get(
+            "max_gain_change_db", manipulations.DEFAULT_FAST_PATH_MAX_GAIN_CHANGE
+        ),
+        normalization_mode=parsed_config.get("normalization", {}).get("mode", "peak"),
+        loudness_target=parsed_config.get("normalization", {}).get(
+            "target", loudness.DEFAULT_TARGET
+        ),
+        max_true_peak=parsed_config.get("normalization", {}).get(
+            "max_true_peak", loudness.DEFAULT_MAX_TRUE_PEAK
+        ),
+        streaming_mode=parsed_config.get("streaming", {}).get("mode", "auto"),
+        streaming_min_duration=parsed_config.get("streaming", {}).get(
+            "min_duration", streaming.DEFAULT_MIN_DURATION
+        ),
+        chunk_seconds=parsed_config.get("streaming", {}).get(
+            "chunk_seconds", manipulations.PCM_CHUNK_SECONDS
+        ),
+        two_pass=parsed_config.get("streaming", {}).get("two_pass", False),
+        cover_thumbnail_sizes=parsed_config.get("cover_art", {}).get(
+            "thumbnail_sizes", []
+        ),
+        probed=probed,
+        timings=timings,
     )
+    return {
+        "local_file_path": local_file_path,
+        "output_file_path": output_file_path,
+        "validation_errors": preflight_errors,
+        "manipulation_metadata": manipulation_metadata,
+        "timings": timings.as_dict(),
+    }
+
+
+def result_path(local_file_path, json_output_dir):
+    basename = os.path.basename(local_file_path)
+    basename, _ = os.path.splitext(basename)
+    return os.path.join(json_output_dir, basename) + ".json"
 
-    if "tags" in manipulation_metadata:
-        enrichments_metadata = enrichments.pipeline(
-            manipulation_metadata["tags"],
-            list(parsed_config.get("enrichments", {}).keys()),
-            **enrichment_creds,
-        )
-    else:
-        enrichments_metadata = {}
 
-    is_valid, validations_metadata = validations.validate(
-        parsed_config.get("validations", {}),
-        tags=manipulation_metadata.get("tags"),
-        output_bitrate=manipulation_metadata["export"].get("output_bitrate"),
-        input_bitrate=manipulation_metadata.get("original_bitrate"),
-        input_mime_type=manipulation_metadata.get("mime_type"),
+def finalize_file(
+    manipulated,
+    enrichments_metadata,
+    json_output_dir,
+    parsed_config,
+    timings=None,
+    validation_plans=None,
+):
+    manipulation_metadata = manipulated["manipulation_metadata"]
+    output_result_path = result_path(manipulated["local_file_path"], json_output_dir)
+    if timings is None:
+        timings = instrumentation.Timings()
+    timings.merge(manipulated.get("timings", {}))
+
+    if validation_plans is None:
+        validation_plans = validations.compile_plans(
+            parsed_config.get("validations", {})
+        )
+    # Preflight validations already ran on the probe data, before manipulation.
+    _, remaining_plan = validation_plans
+    is_valid, validations_metadata = remaining_plan.validate(
+        timings=timings,
+        output_bitrate=manipulation_metadata["export"].get("bitrate"),
         enrichments=enrichments_metadata,
     )
+    validations_metadata = {
+        **manipulated.get("validation_errors", {}),
+        **validations_metadata,
+    }
 
     results = {
-        "output_file_path": output_file_path,
+        "output_file_path": manipulated["output_file_path"],
         "validation_errors": validations_metadata,
         "enrichments_metadata": enrichments_metadata,
         "manipulation_metadata": manipulation_metadata,
     }
+    fingerprint_index = open_fingerprint_index(parsed_config)
+    if fingerprint_index is not None:
+        with timings.stage("fingerprint_index"):
+            results["duplicates"] = index_fingerprint(fingerprint_index, manipulated)
+    results["timings"] = timings.as_dict()
 
-    with open(output_result_path, "w") as f:
+    tmp_path = output_result_path + ".tmp"
+    with open(tmp_path, "w") as f:
         json.dump(results, f)
+    os.replace(tmp_path, output_result_path)
     return results
 
 
+def index_fingerprint(fingerprint_index, manipulated):
+    # Indexed tracks the file duplicates, before indexing it.
+    fingerprinting = manipulated["manipulation_metadata"]["fingerprinting"]
+    local_file_path = manipulated["local_file_path"]
+    try:
+        duplicates = fingerprint_index.query(
+            fingerprinting["fingerprint"],
+            fingerprinting["duration"],
+            exclude_path=local_file_path,
+        )
+        fingerprint_index.add(
+            local_file_path, fingerprinting["fingerprint"], fingerprinting["duration"]
+        )
+    except fingerprints.InvalidFingerprint:
+        return None
+    return duplicates
+
+
 if __name__ == "__main__":
     harmonize_directory()
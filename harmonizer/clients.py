@@ -0,0 +1,118 @@
+import threading
+
+import discogs_client as discogs_api
+import requests
+import spotipy
+from spotipy.oauth2 import SpotifyClientCredentials
+
+try:
+    from spotipy.cache_handler import MemoryCacheHandler
+except ImportError:
+    # Older spotipy versions do not cache client credentials tokens on disk.
+    MemoryCacheHandler = None
+
+from harmonizer import ratelimit
+
+DEFAULT_USER_AGENT = "ingestion"
+# Provider endpoints, they can be pointed to a mirror or a local stand-in server.
+API_URLS = {
+    "discogs": "https://api.discogs.com",
+    "spotify": "https://api.spotify.com/v1/",
+    "spotify_token": "https://accounts.spotify.com/api/token",
+}
+
+
+class SessionUserTokenFetcher(discogs_api.fetchers.UserTokenRequestsFetcher):
+    def __init__(self, user_token, session):
+        super().__init__(user_token)
+        self.session = session
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        resp = self.session.request(
+            method, url, params={"token": self.user_token}, data=data, headers=headers
+        )
+        return resp.content, resp.status_code
+
+
+def discogs_client(discogs_token, client_user_agent=DEFAULT_USER_AGENT, session=None):
+    client = discogs_api.Client(client_user_agent, user_token=discogs_token)
+    client._base_url = API_URLS["discogs"]
+    if session is not None:
+        # discogs_client has no public hook for the HTTP layer, its fetcher is
+        # swapped to keep connections alive between requests.
+        client._fetcher = SessionUserTokenFetcher(discogs_token, session)
+    return client
+
+
+def spotify_client(sp_client_id, sp_client_secret, session=None):
+    # Tokens are kept in memory, spotipy would otherwise write them to a .cache
+    # file in the working directory and reuse them across runs and endpoints.
+    cache_kwargs = {}
+    if MemoryCacheHandler is not None:
+        cache_kwargs["cache_handler"] = MemoryCacheHandler()
+    client_credentials_manager = SpotifyClientCredentials(
+        client_id=sp_client_id, client_secret=sp_client_secret, **cache_kwargs
+    )
+    client_credentials_manager.OAUTH_TOKEN_URL = API_URLS["spotify_token"]
+    client = spotipy.Spotify(
+        client_credentials_manager=client_credentials_manager,
+        requests_session=session if session is not None else True,
+    )
+    client.prefix = API_URLS["spotify"]
+    return client
+
+
+class ClientRegistry:
+    # Authenticated clients are built once per credentials and shared by all the
+    # enrichments of a run, so OAuth tokens and HTTP connections are reused.
+    def __init__(self, client_user_agent=DEFAULT_USER_AGENT, rate_limits=None):
+        self.client_user_agent = client_user_agent
+        self.sessions = {}
+        self.clients = {}
+        rate_limits = dict(ratelimit.DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.schedulers = {
+            provider: ratelimit.RequestScheduler(requests_per_minute)
+            for provider, requests_per_minute in rate_limits.items()
+        }
+        self._lock = threading.Lock()
+
+    def discogs(self, discogs_token):
+        with self._lock:
+            key = ("discogs", discogs_token)
+            if key not in self.clients:
+                self.clients[key] = discogs_client(
+                    discogs_token,
+                    client_user_agent=self.client_user_agent,
+                    session=self.session("discogs"),
+                )
+            return self.clients[key]
+
+    def spotify(self, sp_client_id, sp_client_secret):
+        with self._lock:
+            key = ("spotify", sp_client_id, sp_client_secret)
+            if key not in self.clients:
+                self.clients[key] = spotify_client(
+                    sp_client_id, sp_client_secret, session=self.session("spotify")
+                )
+            return self.clients[key]
+
+    def scheduler(self, provider):
+        return self.schedulers.get(provider)
+
+    def session(self, provider):
+        if provider not in self.sessions:
+            self.sessions[provider] = requests.Session()
+        return self.sessions[provider]
+
+    def close(self):
+        with self._lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+            self.clients = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,9 +1,22 @@
-from schema import Schema, Optional, And
+from schema import Schema, Optional, And, Or
+
+from harmonizer import fingerprints
 
 
 HANDLED_MIME_TYPES = ["audio/mp3", "audio/mpeg", "audio/flac", "audio/mp4", "audio/m4a"]
+MIME_TYPES_EXTENSIONS = {
+    "audio/mp3": [".mp3"],
+    "audio/mpeg": [".mp3"],
+    "audio/flac": [".flac"],
+    "audio/mp4": [".m4a", ".mp4"],
+    "audio/m4a": [".m4a"],
+}
 HANDLED_ENRICHMENTS = ["discogs", "spotify"]
 HANDLED_BITRATES = [320, 192, 128]
+HANDLED_FINGERPRINT_SOURCES = ["file", "pcm"]
+HANDLED_NORMALIZATION_MODES = ["peak", "lufs", "none"]
+HANDLED_STREAMING_MODES = ["auto", "always", "never"]
+HANDLED_PREFLIGHT_MODES = ["reject", "process"]
 HANDLED_MANDATORY_TAGS = [
     "title",
     "artist",
@@ -27,7 +40,7 @@ CONFIG_SCHEMA = Schema(
             Optional(
                 "discogs",
                 error="You must provide a discogs API token for this enrichment",
-            ): {"discogs_token": str},
+            ): {"discogs_token": str, Optional("match_tracklist"): bool},
             Optional(
                 "spotify",
                 error="You must provide a spotify client id and secret for this enrichment",
@@ -54,7 +67,118 @@ CONFIG_SCHEMA = Schema(
                 ),
                 error="This required enrichment is not supported.",
             ),
+            Optional("integrity_check"): bool,
+            Optional("preflight"): And(
+                str,
+                lambda x: x in HANDLED_PREFLIGHT_MODES,
+                error="The validations preflight must be reject or process.",
+            ),
+        },
+        Optional("enrichment_cache"): {
+            "directory": str,
+            Optional("ttl_days"): And(
+                int, lambda x: x > 0, error="Cache ttl_days must be a positive integer."
+            ),
+            Optional("max_entries"): And(
+                int,
+                lambda x: x > 0,
+                error="Cache max_entries must be a positive integer.",
+            ),
+        },
+        Optional("rate_limits"): {
+            Optional(enrichment): And(
+                int,
+                lambda x: x > 0,
+                error="Rate limits must be a positive number of requests per minute.",
+            )
+            for enrichment in HANDLED_ENRICHMENTS
+        },
+        Optional("fingerprinting"): {
+            Optional("source"): And(
+                lambda x: x in HANDLED_FINGERPRINT_SOURCES,
+                error="Fingerprinting source must be file or pcm.",
+            ),
+            Optional("max_length"): And(
+                int,
+                lambda x: x > 0,
+                error="Fingerprinting max_length must be a positive number of seconds.",
+            ),
+        },
+        Optional("cover_art"): {
+            Optional("thumbnail_sizes"): And(
+                [int],
+                lambda sizes: all([x > 0 for x in sizes]),
+                error="Cover art thumbnail_sizes must be positive numbers of pixels.",
+            ),
         },
+        Optional("fingerprint_index"): And(
+            {
+                "directory": str,
+                Optional("skip_duplicates"): bool,
+                Optional("duplicate_similarity"): And(
+                    Or(int, float),
+                    lambda x: 0 < x <= 1,
+                    error="Fingerprint index duplicate_similarity must be between 0 and 1.",
+                ),
+                Optional("near_duplicate_similarity"): And(
+                    Or(int, float),
+                    lambda x: 0 < x <= 1,
+                    error="Fingerprint index near_duplicate_similarity must be between 0 and 1.",
+                ),
+            },
+            lambda x: x.get(
+                "near_duplicate_similarity",
+                fingerprints.DEFAULT_NEAR_DUPLICATE_SIMILARITY,
+            )
+            <= x.get("duplicate_similarity", fingerprints.DEFAULT_DUPLICATE_SIMILARITY),
+            error="Fingerprint index near_duplicate_similarity must not be above duplicate_similarity.",
+        ),
+        Optional("fast_path"): {
+            Optional("enabled"): bool,
+            Optional("max_gain_change_db"): And(
+                Or(int, float),
+                lambda x: x >= 0,
+                error="Fast path max_gain_change_db must be a positive number.",
+            ),
+        },
+        Optional("normalization"): {
+            Optional("mode"): And(
+                lambda x: x in HANDLED_NORMALIZATION_MODES,
+                error="Normalization mode must be peak, lufs or none.",
+            ),
+            Optional("target"): And(
+                Or(int, float),
+                lambda x: -70 < x < 0,
+                error="Loudness target must be between -70 and 0 LUFS.",
+            ),
+            Optional("max_true_peak"): And(
+                Or(int, float),
+                lambda x: x <= 0,
+                error="Maximum true peak must be a negative number of dBTP.",
+            ),
+        },
+        Optional("streaming"): And(
+            {
+                Optional("mode"): And(
+                    lambda x: x in HANDLED_STREAMING_MODES,
+                    error="Streaming mode must be auto, always or never.",
+                ),
+                Optional("min_duration"): And(
+                    int,
+                    lambda x: x > 0,
+                    error="Streaming min_duration must be a positive number of seconds.",
+                ),
+                Optional("chunk_seconds"): And(
+                    int,
+                    lambda x: x > 0,
+                    error="Streaming chunk_seconds must be a positive number of seconds.",
+                ),
+                Optional("two_pass"): bool,
+            },
+            # Tracks are never streamed, two passes would never be used.
+            lambda x: not (x.get("two_pass") and x.get("mode") == "never"),
+            error="Streaming two_pass requires the auto or always streaming mode.",
+        ),
         Optional("normalization_headroom", default=0.1): And(
             lambda x: x in [float("0." + str(i)) for i in range(1, 10)],
             error="Normalization headroom should be between 0.1 and 0.9 with a single digit decimal.",
@@ -0,0 +1,69 @@
+import hashlib
+import io
+import mimetypes
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    # Thumbnails are optional, Pillow is only needed to generate them.
+    Image = None
+
+THUMBNAIL_QUALITY = 85
+
+
+class ThumbnailsUnavailable(Exception):
+    pass
+
+
+def thumbnails_available():
+    return Image is not None
+
+
+def extension(mime_type):
+    if mime_type in ["image/jpeg", "image/jpg"]:
+        return ".jpeg"
+    return mimetypes.guess_extension(mime_type) or ".img"
+
+
+def write_once(path, data):
+    # Files are named after their content, an existing file already holds it.
+    # Concurrent writers rename identical files over each other.
+    if os.path.exists(path):
+        return False
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def thumbnail(data, size):
+    if Image is None:
+        raise ThumbnailsUnavailable("Pillow must be installed to generate thumbnails")
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def store(cover_art, store_dir, thumbnail_sizes=()):
+    # Cover arts are stored by content hash, so the identical covers of the
+    # tracks of an album are written once, as are their thumbnails.
+    digest = hashlib.sha256(cover_art["data"]).hexdigest()
+    path = os.path.join(store_dir, digest + extension(cover_art["mime_type"]))
+    write_once(path, cover_art["data"])
+    thumbnails = {}
+    for size in thumbnail_sizes:
+        thumbnail_path = os.path.join(store_dir, f"{digest}_{size}.jpeg")
+        if not os.path.exists(thumbnail_path):
+            try:
+                data = thumbnail(cover_art["data"], size)
+            except OSError:
+                # Pillow cannot read the image, it is stored as is anyway.
+                break
+            write_once(thumbnail_path, data)
+        thumbnails[str(size)] = thumbnail_path
+    return {"path": path, "sha256": digest, "thumbnails": thumbnails}
@@ -1,9 +1,17 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import discogs_client as discogs_api
 import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+
+from harmonizer import clients, instrumentation
+from harmonizer.cache import normalize_query
+from harmonizer.ratelimit import RateLimitExceeded
 
 
-class TooMuchRequests(Exception):
+class TooMuchRequests(RateLimitExceeded):
     pass
 
 
@@ -23,6 +31,10 @@ ENRICHMENTS_MAPPING = {
     "discogs": {"required_tags": ["album", "artist"]},
     "spotify": {"required_tags": ["title", "artist"]},
 }
+# Album lookups shared by the upcoming tracks of the same album in a run.
+MAX_ALBUM_GROUPS = 64
+# Spotify searches shared by the upcoming tracks sending the same query.
+MAX_SPOTIFY_QUERIES = 256
 
 
 def pipeline(
@@ -31,66 +43,463 @@ def pipeline(
     discogs_token=None,
     sp_client_id=None,
     sp_client_secret=None,
+    cache=None,
+    client_registry=None,
+    timings=None,
 ):
     results = {}
     for enrichement_name in enrichments:
+        results[enrichement_name] = timed_enrich(
+            timings,
+            enrichement_name,
+            track_tags,
+            discogs_token=discogs_token,
+            sp_client_id=sp_client_id,
+            sp_client_secret=sp_client_secret,
+            cache=cache,
+            client_registry=client_registry,
+        )
+    return results
+
+
+def enrich(
+    enrichement_name,
+    track_tags,
+    discogs_token=None,
+    sp_client_id=None,
+    sp_client_secret=None,
+    cache=None,
+    client_registry=None,
+):
+    try:
+        enrichment = ENRICHMENTS_MAPPING[enrichement_name]
+        required_tags = enrichment["required_tags"]
         try:
-            enrichment = ENRICHMENTS_MAPPING[enrichement_name]
-            required_tags = enrichment["required_tags"]
-            try:
-                assert all([t in track_tags for t in required_tags])
-            except AssertionError:
-                raise InsufficientTags(
-                    "The track you try to enrich is missing a tag for the enrichment you want"
+            assert all([t in track_tags for t in required_tags])
+        except AssertionError:
+            raise InsufficientTags(
+                "The track you try to enrich is missing a tag for the enrichment you want"
+            )
+        if enrichement_name == "spotify":
+            if not all([cred is not None for cred in (sp_client_id, sp_client_secret)]):
+                raise MissingCredentials(
+                    "You need to provide sp_client_id and sp_client_secret for Spotify enrichment"
                 )
-            if enrichement_name == "spotify":
-                if not all(
-                    [cred is not None for cred in (sp_client_id, sp_client_secret)]
-                ):
-                    raise MissingCredentials(
-                        "You need to provide sp_client_id and sp_client_secret for Spotify enrichment"
-                    )
-                best_match, other_results = spotify_enrich(
-                    track_tags["title"],
-                    track_tags["artist"],
-                    sp_client_id,
-                    sp_client_secret,
-                    album=track_tags.get("album"),
+        elif enrichement_name == "discogs":
+            if discogs_token is None:
+                raise MissingCredentials(
+                    "You need to provide a discogs token for Discogs enrichment"
                 )
-            elif enrichement_name == "discogs":
-                if discogs_token is None:
-                    raise MissingCredentials(
-                        "You need to provide a discogs token for Discogs enrichment"
-                    )
-                best_match, other_results = discogs_enrich(
-                    track_tags["artist"], track_tags["album"], discogs_token
+        else:
+            raise UnavailableEnrichment(
+                "The enrichment you tried to use does not exist"
+            )
+
+        if cache is not None:
+            query = cache_query(enrichement_name, track_tags)
+            cached_result = cache.get(enrichement_name, query)
+            if cached_result is not None:
+                return cached_result
+
+        client, scheduler = None, None
+        if enrichement_name == "spotify":
+            if client_registry is not None:
+                client = client_registry.spotify(sp_client_id, sp_client_secret)
+                scheduler = client_registry.scheduler(enrichement_name)
+            best_match, other_results = spotify_enrich(
+                track_tags["title"],
+                track_tags["artist"],
+                sp_client_id,
+                sp_client_secret,
+                album=track_tags.get("album"),
+                client=client,
+                scheduler=scheduler,
+            )
+        else:
+            if client_registry is not None:
+                client = client_registry.discogs(discogs_token)
+                scheduler = client_registry.scheduler(enrichement_name)
+            best_match, other_results = discogs_enrich(
+                album_artist(track_tags),
+                track_tags["album"],
+                discogs_token,
+                client=client,
+                scheduler=scheduler,
+            )
+        result = {"best_match": best_match, "other_results": other_results}
+        if cache is not None:
+            cache.set(enrichement_name, query, result)
+        return result
+    except KeyError:
+        raise UnavailableEnrichment("The enrichment you tried to use does not exist")
+
+
+def batch_enrich(
+    enrichement_name,
+    tracks_tags,
+    discogs_token=None,
+    sp_client_id=None,
+    sp_client_secret=None,
+    cache=None,
+    client_registry=None,
+    max_in_flight=4,
+    match_tracklist=False,
+    executor=None,
+):
+    # Enriches many tracks at once, typically the tracks of an album. Results
+    # are in the order of tracks_tags, None for tracks missing a required tag.
+    # Spotify searches run on the given executor, or on a pool of max_in_flight
+    # threads.
+    if enrichement_name not in ENRICHMENTS_MAPPING:
+        raise UnavailableEnrichment("The enrichment you tried to use does not exist")
+    required_tags = ENRICHMENTS_MAPPING[enrichement_name]["required_tags"]
+    enrichable = [
+        i
+        for i, track_tags in enumerate(tracks_tags)
+        if all([t in track_tags for t in required_tags])
+    ]
+    results = [None] * len(tracks_tags)
+    if enrichement_name == "discogs":
+        album_results = {}
+        for i in enrichable:
+            key = album_key(tracks_tags[i])
+            if key not in album_results:
+                album_results[key] = enrich_album(
+                    tracks_tags[i],
+                    discogs_token,
+                    cache=cache,
+                    client_registry=client_registry,
+                    match_tracklist=match_tracklist,
                 )
-            else:
+            results[i] = fan_out(album_results[key], tracks_tags[i])
+        return results
+
+    if not all([cred is not None for cred in (sp_client_id, sp_client_secret)]):
+        raise MissingCredentials(
+            "You need to provide sp_client_id and sp_client_secret for Spotify enrichment"
+        )
+    to_search = []
+    for i in enrichable:
+        if cache is not None:
+            cached_result = cache.get(
+                enrichement_name, cache_query(enrichement_name, tracks_tags[i])
+            )
+            if cached_result is not None:
+                results[i] = cached_result
+                continue
+        to_search.append(i)
+
+    client, scheduler = None, None
+    if client_registry is not None:
+        client = client_registry.spotify(sp_client_id, sp_client_secret)
+        scheduler = client_registry.scheduler(enrichement_name)
+    matches = spotify_enrich_many(
+        [tracks_tags[i] for i in to_search],
+        sp_client_id,
+        sp_client_secret,
+        client=client,
+        scheduler=scheduler,
+        max_in_flight=max_in_flight,
+        executor=executor,
+    )
+    for i, (best_match, other_results) in zip(to_search, matches):
+        results[i] = {"best_match": best_match, "other_results": other_results}
+        if cache is not None:
+            cache.set(
+                enrichement_name,
+                cache_query(enrichement_name, tracks_tags[i]),
+                results[i],
+            )
+    return results
+
+
+def album_artist(track_tags):
+    return track_tags.get("albumartist") or track_tags["artist"]
+
+
+def album_key(track_tags):
+    return normalize_query(album_artist(track_tags), track_tags["album"])
+
+
+def enrich_album(
+    track_tags,
+    discogs_token,
+    cache=None,
+    client_registry=None,
+    match_tracklist=False,
+):
+    # The Discogs release only depends on the album, it is resolved once for all
+    # the tracks of the album and then fanned out to each of them.
+    result = enrich(
+        "discogs",
+        track_tags,
+        discogs_token=discogs_token,
+        cache=cache,
+        client_registry=client_registry,
+    )
+    if match_tracklist and result["best_match"] is not None:
+        client, scheduler = None, None
+        if client_registry is not None:
+            client = client_registry.discogs(discogs_token)
+            scheduler = client_registry.scheduler("discogs")
+        result = dict(
+            result,
+            tracklist=discogs_tracklist(
+                result["best_match"]["id"],
+                discogs_token,
+                client=client,
+                scheduler=scheduler,
+                cache=cache,
+            ),
+        )
+    return result
+
+
+def fan_out(album_result, track_tags):
+    result = {
+        "best_match": album_result["best_match"],
+        "other_results": album_result["other_results"],
+    }
+    if "tracklist" in album_result:
+        result["track"] = match_track(album_result["tracklist"], track_tags)
+    return result
+
+
+def timed_enrich_album(timings, track_tags, discogs_token, **kwargs):
+    with instrumentation.stage(timings, "enrichment.discogs"):
+        return enrich_album(track_tags, discogs_token, **kwargs)
+
+
+def timed_enrich(timings, enrichement_name, track_tags, **kwargs):
+    with instrumentation.stage(timings, f"enrichment.{enrichement_name}"):
+        return enrich(enrichement_name, track_tags, **kwargs)
+
+
+def cache_query(enrichement_name, track_tags):
+    # Mirrors the fields each provider search is built from.
+    if enrichement_name == "discogs":
+        return normalize_query(album_artist(track_tags), track_tags["album"])
+    return normalize_query(
+        track_tags["title"].split("(")[0], track_tags["artist"], track_tags.get("album")
+    )
+
+
+# Runs enrichments in background threads, with at most max_in_flight concurrent
+# lookups per provider, so network round-trips overlap with audio processing.
+class EnrichmentStage:
+    def __init__(
+        self,
+        enrichments,
+        max_in_flight=4,
+        cache=None,
+        client_registry=None,
+        match_tracklist=False,
+        **credentials,
+    ):
+        for enrichement_name in enrichments:
+            if enrichement_name not in ENRICHMENTS_MAPPING:
                 raise UnavailableEnrichment(
                     "The enrichment you tried to use does not exist"
                 )
-            results[enrichement_name] = {
-                "best_match": best_match,
-                "other_results": other_results,
-            }
-        except KeyError:
-            raise UnavailableEnrichment(
-                "The enrichment you tried to use does not exist"
+        self.enrichments = list(enrichments)
+        self.credentials = credentials
+        self.cache = cache
+        self.client_registry = client_registry
+        self.match_tracklist = match_tracklist
+        self.album_groups = collections.OrderedDict()
+        self.spotify_searches = collections.OrderedDict()
+        self._spotify_client = None
+        self.executors = {
+            enrichement_name: ThreadPoolExecutor(
+                max_workers=max_in_flight,
+                thread_name_prefix=f"{enrichement_name}-enrichment",
             )
-    return results
+            for enrichement_name in self.enrichments
+        }
+
+    def submit(self, track_tags, timings=None):
+        futures = {}
+        for enrichement_name in self.enrichments:
+            if enrichement_name == "discogs" and all(
+                [
+                    t in track_tags
+                    for t in ENRICHMENTS_MAPPING["discogs"]["required_tags"]
+                ]
+            ):
+                futures[enrichement_name] = self.submit_album(track_tags, timings)
+                continue
+            if (
+                enrichement_name == "spotify"
+                and all(
+                    [
+                        t in track_tags
+                        for t in ENRICHMENTS_MAPPING["spotify"]["required_tags"]
+                    ]
+                )
+                and self.credentials.get("sp_client_id") is not None
+                and self.credentials.get("sp_client_secret") is not None
+            ):
+                futures[enrichement_name] = self.submit_spotify(track_tags, timings)
+                continue
+            futures[enrichement_name] = self.executors[enrichement_name].submit(
+                timed_enrich,
+                timings,
+                enrichement_name,
+                track_tags,
+                cache=self.cache,
+                client_registry=self.client_registry,
+                **self.credentials,
+            )
+        return futures
 
+    def submit_album(self, track_tags, timings=None):
+        # Tracks of an album already looked up share its lookup, timings are
+        # recorded on the track that triggered it.
+        key = album_key(track_tags)
+        album_future = self.album_groups.get(key)
+        # A failed lookup is retried by the next track of the album.
+        if album_future is None or (
+            album_future.done() and album_future.exception() is not None
+        ):
+            album_future = self.executors["discogs"].submit(
+                timed_enrich_album,
+                timings,
+                track_tags,
+                self.credentials.get("discogs_token"),
+                cache=self.cache,
+                client_registry=self.client_registry,
+                match_tracklist=self.match_tracklist,
+            )
+            self.album_groups[key] = album_future
+            if len(self.album_groups) > MAX_ALBUM_GROUPS:
+                self.album_groups.popitem(last=False)
+        else:
+            self.album_groups.move_to_end(key)
 
-def discogs_enrich(artist, album, discogs_token, client_user_agent="ingestion"):
-    discogs_client = discogs_api.Client(client_user_agent, user_token=discogs_token)
+        track_future = Future()
 
-    try:
-        results = discogs_client.search(f"{artist} {album}", type="release")
-        results = [r.data for r in results.page(1)]
-    except discogs_api.exceptions.HTTPError as e:
-        if hasattr(e, "message") and "too quickly" in e.message:
-            raise TooMuchRequests("You're making too much requests to discogs")
+        def fan_out_result(future):
+            try:
+                track_future.set_result(fan_out(future.result(), track_tags))
+            except Exception as e:
+                track_future.set_exception(e)
+
+        album_future.add_done_callback(fan_out_result)
+        return track_future
+
+    def submit_spotify(self, track_tags, timings=None):
+        # The fallback search of a track is sent along with its first one, and
+        # searches already sent by previous tracks are shared, as in batch_enrich.
+        # The timing recorded is the wall time until the track is matched.
+        query = cache_query("spotify", track_tags)
+        track_future = Future()
+        if self.cache is not None:
+            cached_result = self.cache.get("spotify", query)
+            if cached_result is not None:
+                track_future.set_result(cached_result)
+                return track_future
+        search_futures = [
+            self.submit_spotify_search(q)
+            for q in spotify_queries(
+                track_tags["title"], track_tags["artist"], track_tags.get("album")
+            )
+        ]
+        start_time = time.perf_counter()
+        remaining = [len(search_futures)]
+        lock = threading.Lock()
+
+        def match(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            try:
+                best_match, other_results = spotify_match(
+                    [f.result() for f in search_futures]
+                )
+                result = {"best_match": best_match, "other_results": other_results}
+                if self.cache is not None:
+                    self.cache.set("spotify", query, result)
+            except Exception as e:
+                track_future.set_exception(e)
+                return
+            if timings is not None:
+                timings.record(
+                    "enrichment.spotify", time.perf_counter() - start_time, 0
+                )
+            track_future.set_result(result)
+
+        for search_future in search_futures:
+            search_future.add_done_callback(match)
+        return track_future
+
+    def submit_spotify_search(self, query):
+        search_future = self.spotify_searches.get(query)
+        # A failed search is sent again by the next track needing it.
+        if search_future is None or (
+            search_future.done() and search_future.exception() is not None
+        ):
+            scheduler = None
+            if self.client_registry is not None:
+                scheduler = self.client_registry.scheduler("spotify")
+            search_future = self.executors["spotify"].submit(
+                spotify_tracks, self.spotify_client(), query, scheduler
+            )
+            self.spotify_searches[query] = search_future
+            if len(self.spotify_searches) > MAX_SPOTIFY_QUERIES:
+                self.spotify_searches.popitem(last=False)
         else:
-            raise (e)
+            self.spotify_searches.move_to_end(query)
+        return search_future
+
+    def spotify_client(self):
+        sp_client_id = self.credentials["sp_client_id"]
+        sp_client_secret = self.credentials["sp_client_secret"]
+        if self.client_registry is not None:
+            return self.client_registry.spotify(sp_client_id, sp_client_secret)
+        if self._spotify_client is None:
+            self._spotify_client = clients.spotify_client(
+                sp_client_id, sp_client_secret
+            )
+        return self._spotify_client
+
+    def shutdown(self, wait=True):
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def is_done(enrichment_futures):
+    return all(future.done() for future in enrichment_futures.values())
+
+
+def collect(enrichment_futures):
+    return {
+        enrichement_name: future.result()
+        for enrichement_name, future in enrichment_futures.items()
+    }
+
+
+def discogs_enrich(
+    artist,
+    album,
+    discogs_token,
+    client_user_agent="ingestion",
+    client=None,
+    scheduler=None,
+):
+    if client is None:
+        client = clients.discogs_client(discogs_token, client_user_agent)
+
+    if scheduler is not None:
+        results = scheduler.call(discogs_search, client, f"{artist} {album}")
+    else:
+        results = discogs_search(client, f"{artist} {album}")
 
     if results:
         same_artist_names = [
@@ -126,20 +535,170 @@ def discogs_enrich(artist, album, discogs_token, client_user_agent="ingestion"):
         return None, []
 
 
-def spotify_enrich(title, artist, sp_client_id, sp_client_secret, album=None):
-    client_credentials_manager = SpotifyClientCredentials(
-        client_id=sp_client_id, client_secret=sp_client_secret
+def discogs_search(client, query):
+    try:
+        results = client.search(query, type="release")
+        return [r.data for r in results.page(1)]
+    except discogs_api.exceptions.HTTPError as e:
+        if e.status_code == 429 or "too quickly" in str(e):
+            raise TooMuchRequests("You're making too much requests to discogs")
+        else:
+            raise (e)
+
+
+def discogs_tracklist(
+    release_id, discogs_token, client=None, scheduler=None, cache=None
+):
+    # Cached under the release id, re-runs on an unchanged library do not fetch
+    # the tracklists again.
+    if cache is not None:
+        cached_tracklist = cache.get("discogs_tracklist", str(release_id))
+        if cached_tracklist is not None:
+            return cached_tracklist
+    if client is None:
+        client = clients.discogs_client(discogs_token)
+    if scheduler is not None:
+        tracklist = scheduler.call(discogs_release_tracklist, client, release_id)
+    else:
+        tracklist = discogs_release_tracklist(client, release_id)
+    if cache is not None:
+        cache.set("discogs_tracklist", str(release_id), tracklist)
+    return tracklist
+
+
+def discogs_release_tracklist(client, release_id):
+    try:
+        release = client.release(release_id)
+        release.refresh()
+    except discogs_api.exceptions.HTTPError as e:
+        if e.status_code == 429 or "too quickly" in str(e):
+            raise TooMuchRequests("You're making too much requests to discogs")
+        else:
+            raise (e)
+    return [
+        {
+            "position": t.get("position"),
+            "title": t.get("title"),
+            "duration": t.get("duration"),
+        }
+        for t in release.data.get("tracklist", [])
+        if t.get("type_", "track") == "track"
+    ]
+
+
+def match_track(tracklist, track_tags):
+    # By title first, then by track number.
+    if "title" in track_tags:
+        title = normalize_query(track_tags["title"].split("(")[0])
+        for track in tracklist:
+            if normalize_query((track["title"] or "").split("(")[0]) == title:
+                return track
+    try:
+        tracknumber = int(track_tags.get("tracknumber", "").split("/")[0])
+    except ValueError:
+        return None
+    if 0 < tracknumber <= len(tracklist):
+        return tracklist[tracknumber - 1]
+    return None
+
+
+def spotify_enrich(
+    title,
+    artist,
+    sp_client_id,
+    sp_client_secret,
+    album=None,
+    client=None,
+    scheduler=None,
+):
+    sp = client
+    if sp is None:
+        sp = clients.spotify_client(sp_client_id, sp_client_secret)
+
+    for q in spotify_queries(title, artist, album):
+        tracks = spotify_tracks(sp, q, scheduler)
+        if tracks:
+            return tracks[0], tracks
+    return None, []
+
+
+def spotify_enrich_many(
+    tracks_tags,
+    sp_client_id,
+    sp_client_secret,
+    client=None,
+    scheduler=None,
+    max_in_flight=4,
+    executor=None,
+):
+    # The fallback queries are sent along with the first ones instead of after
+    # them, and a query shared by several tracks is sent once, so a batch costs
+    # about as many round-trips as its slowest query.
+    sp = client
+    if sp is None:
+        sp = clients.spotify_client(sp_client_id, sp_client_secret)
+    tracks_queries = [
+        spotify_queries(t["title"], t["artist"], t.get("album")) for t in tracks_tags
+    ]
+    unique_queries = list(
+        dict.fromkeys(q for queries in tracks_queries for q in queries)
     )
-    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+    if executor is None:
+        with ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="spotify-batch"
+        ) as batch_executor:
+            return spotify_enrich_many(
+                tracks_tags,
+                sp_client_id,
+                sp_client_secret,
+                client=sp,
+                scheduler=scheduler,
+                executor=batch_executor,
+            )
+    found = dict(
+        zip(
+            unique_queries,
+            executor.map(lambda q: spotify_tracks(sp, q, scheduler), unique_queries),
+        )
+    )
+    return [spotify_match([found[q] for q in queries]) for queries in tracks_queries]
+
+
+def spotify_match(tracks_per_query):
+    # Results of the most precise query that found tracks.
+    tracks = next((tracks for tracks in tracks_per_query if tracks), [])
+    if tracks:
+        return tracks[0], tracks
+    return None, []
+
+
+def spotify_queries(title, artist, album=None):
+    # Most precise query first.
     title = title.split("(")[0]
     queries = []
     if album is not None:
         queries.append(f"album:{album} artist:{artist} track:{title}".lower())
     queries.append(f"artist:{artist} track:{title}".lower())
+    return queries
 
-    for q in queries:
-        results = sp.search(q=q, type="track", limit=20)
-        tracks = results["tracks"]["items"]
-        if tracks:
-            return tracks[0], tracks
-    return None, []
+
+def spotify_tracks(sp, query, scheduler=None):
+    if scheduler is not None:
+        results = scheduler.call(spotify_search, sp, query)
+    else:
+        results = spotify_search(sp, query)
+    return results["tracks"]["items"]
+
+
+def spotify_search(sp, query):
+    try:
+        return sp.search(q=query, type="track", limit=20)
+    except spotipy.SpotifyException as e:
+        if e.http_status == 429:
+            retry_after = (getattr(e, "headers", None) or {}).get("Retry-After")
+            raise TooMuchRequests(
+                "You're making too much requests to spotify",
+                retry_after=int(retry_after) if retry_after is not None else None,
+            )
+        else:
+            raise (e)
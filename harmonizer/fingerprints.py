@@ -0,0 +1,351 @@
+import atexit
+import base64
+import os
+import sqlite3
+
+import numpy as np
+
+INDEX_DB_FILENAME = "fingerprints.sqlite"
+INDEX_FILENAME = "index.npy"
+# Sub-fingerprints are about 0.124 s apart, the index covers the first ~15 s.
+INDEX_ITEMS = 120
+INDEX_STRIDE = 2
+MIN_KEY_HITS = 2
+MAX_CANDIDATES = 10
+MIN_OVERLAP = 40
+DEFAULT_DUPLICATE_SIMILARITY = 0.9
+DEFAULT_NEAR_DUPLICATE_SIMILARITY = 0.75
+# Confirmed duplicates also have about the same duration.
+DURATION_TOLERANCE = 3
+SAVE_EVERY = 50
+MAX_NORMAL_BIT = 7
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+_shared_indexes = {}
+
+
+class InvalidFingerprint(Exception):
+    pass
+
+
+def unpack_ints(data, width):
+    # Little-endian bit stream of width-bit integers, as packed by Chromaprint.
+    bytes_array = np.frombuffer(data, dtype=np.uint8)
+    bits = ((bytes_array[:, None] >> np.arange(8, dtype=np.uint8)) & 1).reshape(-1)
+    count = len(bits) // width
+    weights = 1 << np.arange(width)
+    return bits[: count * width].reshape(count, width) @ weights
+
+
+def pack_ints(values, width):
+    values = np.asarray(values, dtype=np.int64)
+    bits = ((values[:, None] >> np.arange(width)) & 1).astype(np.uint8).reshape(-1)
+    bits = np.concatenate([bits, np.zeros(-len(bits) % 8, dtype=np.uint8)])
+    return (
+        (bits.reshape(-1, 8) << np.arange(8, dtype=np.uint8))
+        .sum(axis=1)
+        .astype(np.uint8)
+        .tobytes()
+    )
+
+
+def decode(fingerprint):
+    # Decompresses a Chromaprint fingerprint (fpcalc or acoustid output) into its
+    # 32 bits sub-fingerprints, without needing the Chromaprint library.
+    if isinstance(fingerprint, bytes):
+        fingerprint = fingerprint.decode("ascii")
+    try:
+        data = base64.urlsafe_b64decode(fingerprint + "=" * (-len(fingerprint) % 4))
+    except ValueError:
+        raise InvalidFingerprint("The fingerprint is not valid base64")
+    if len(data) < 4:
+        raise InvalidFingerprint("The fingerprint is too short")
+    length = int.from_bytes(data[1:4], "big")
+    if length == 0:
+        return np.zeros(0, dtype=np.uint32)
+
+    # Each sub-fingerprint is XORed with the previous one and stored as the
+    # gaps between its set bits, terminated by a 0.
+    gaps = unpack_ints(data[4:], 3)
+    ends = np.flatnonzero(gaps == 0)
+    if len(ends) < length:
+        raise InvalidFingerprint("The fingerprint is truncated")
+    gaps = gaps[: ends[length - 1] + 1].astype(np.int64)
+    exceptional = np.flatnonzero(gaps == MAX_NORMAL_BIT)
+    if len(exceptional):
+        offset = 4 + (len(gaps) * 3 + 7) // 8
+        extra = unpack_ints(data[offset:], 5)[: len(exceptional)]
+        if len(extra) < len(exceptional):
+            raise InvalidFingerprint("The fingerprint is truncated")
+        gaps[exceptional] += extra
+
+    item = np.concatenate([[0], np.cumsum(gaps == 0)[:-1]])
+    bit_positions = np.cumsum(gaps)
+    item_starts = np.concatenate([[0], bit_positions[ends[: length - 1]]])
+    set_bits = gaps != 0
+    positions = bit_positions[set_bits] - item_starts[item[set_bits]]
+    if len(positions) and positions.max() > 32:
+        raise InvalidFingerprint("The fingerprint has out of range bits")
+    values = np.zeros(length, dtype=np.uint64)
+    np.bitwise_or.at(
+        values,
+        item[set_bits],
+        np.left_shift(np.uint64(1), (positions - 1).astype(np.uint64)),
+    )
+    return np.bitwise_xor.accumulate(values).astype(np.uint32)
+
+
+def encode(values, algorithm=1):
+    # Inverse of decode, with Chromaprint's compression.
+    values = np.asarray(values, dtype=np.uint32)
+    gaps = []
+    previous = 0
+    for value in values.tolist():
+        x, last_bit, bit = value ^ previous, 0, 1
+        while x:
+            if x & 1:
+                gaps.append(bit - last_bit)
+                last_bit = bit
+            x >>= 1
+            bit += 1
+        gaps.append(0)
+        previous = value
+    normal = [min(gap, MAX_NORMAL_BIT) for gap in gaps]
+    exceptional = [gap - MAX_NORMAL_BIT for gap in gaps if gap >= MAX_NORMAL_BIT]
+    data = bytes([algorithm]) + len(values).to_bytes(3, "big") + pack_ints(normal, 3)
+    if exceptional:
+        data += pack_ints(exceptional, 5)
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def index_keys(values):
+    return np.unique(values[:INDEX_ITEMS:INDEX_STRIDE])
+
+
+def similarity_at(query, candidate, offset):
+    # 1 minus the bit error rate of the overlapping sub-fingerprints, query[i]
+    # being aligned with candidate[i + offset].
+    start = max(0, -offset)
+    count = min(len(query) - start, len(candidate) - start - offset)
+    if count < MIN_OVERLAP:
+        return 0.0
+    xor = (
+        query[start : start + count]
+        ^ candidate[start + offset : start + offset + count]
+    )
+    errors = int(POPCOUNT[xor.view(np.uint8)].sum())
+    return 1 - errors / (32 * count)
+
+
+def similarity(query, candidate):
+    # Aligns the fingerprints on the most common offset between their identical
+    # sub-fingerprints, rips often differ by some leading silence.
+    head = candidate[: INDEX_ITEMS * 2]
+    positions = {}
+    for j, value in enumerate(head.tolist()):
+        positions.setdefault(value, []).append(j)
+    offsets = {}
+    for i, value in enumerate(query[: INDEX_ITEMS * 2].tolist()):
+        for j in positions.get(value, ()):
+            offsets[j - i] = offsets.get(j - i, 0) + 1
+    if not offsets:
+        return similarity_at(query, candidate, 0)
+    offset = max(offsets, key=offsets.get)
+    return max(similarity_at(query, candidate, offset + d) for d in (-1, 0, 1))
+
+
+class FingerprintIndex:
+    # Fingerprints are stored as uint32 arrays in SQLite. The inverted index
+    # over their first sub-fingerprints is a single memory-mapped uint32 array
+    # holding the sorted keys followed by their track ids, tracks added since
+    # the last save are looked up in memory.
+    def __init__(
+        self,
+        index_dir,
+        duplicate_similarity=DEFAULT_DUPLICATE_SIMILARITY,
+        near_duplicate_similarity=DEFAULT_NEAR_DUPLICATE_SIMILARITY,
+    ):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_path = os.path.join(index_dir, INDEX_FILENAME)
+        self.duplicate_similarity = duplicate_similarity
+        self.near_duplicate_similarity = near_duplicate_similarity
+        self._connection = sqlite3.connect(
+            os.path.join(index_dir, INDEX_DB_FILENAME), check_same_thread=False
+        )
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, duration REAL, "
+                "fingerprint BLOB NOT NULL)"
+            )
+        self.pending = {}
+        # Tracks added again since the last save, their saved postings are
+        # ignored until the save drops them.
+        self.stale = set()
+        self.unsaved = 0
+        self.loaded_mtime = None
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.index_path):
+            self.loaded_mtime = os.stat(self.index_path).st_mtime_ns
+            index = np.load(self.index_path, mmap_mode="r")
+        else:
+            index = np.zeros(0, dtype=np.uint32)
+        self.keys = index[: len(index) // 2]
+        self.track_ids = index[len(index) // 2 :]
+
+    def refresh(self):
+        # Picks up the index saved by another process since it was loaded.
+        if not os.path.exists(self.index_path):
+            return
+        if os.stat(self.index_path).st_mtime_ns != self.loaded_mtime:
+            self.load()
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def add(self, path, fingerprint, duration=None):
+        values = decode(fingerprint)
+        path = os.path.abspath(path)
+        existing = self._connection.execute(
+            "SELECT id FROM tracks WHERE path = ?", (path,)
+        ).fetchone()
+        if existing is not None:
+            self.remove_postings(existing[0])
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO tracks (path, duration, fingerprint) VALUES (?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET duration = excluded.duration, "
+                "fingerprint = excluded.fingerprint",
+                (path, duration, values.tobytes()),
+            )
+        track_id = self._connection.execute(
+            "SELECT id FROM tracks WHERE path = ?", (path,)
+        ).fetchone()[0]
+        for key in index_keys(values).tolist():
+            self.pending.setdefault(key, []).append(track_id)
+        self.unsaved += 1
+        if self.unsaved >= SAVE_EVERY:
+            self.save()
+        return track_id
+
+    def remove_postings(self, track_id):
+        self.stale.add(track_id)
+        for key in list(self.pending):
+            track_ids = [i for i in self.pending[key] if i != track_id]
+            if track_ids:
+                self.pending[key] = track_ids
+            else:
+                del self.pending[key]
+
+    def saved_postings(self):
+        if not self.stale:
+            return self.keys, self.track_ids
+        live = ~np.isin(self.track_ids, list(self.stale))
+        return self.keys[live], self.track_ids[live]
+
+    def candidates(self, values):
+        # Every sub-fingerprint of the query is looked up, whatever the offset
+        # of the indexed ones.
+        keys = np.unique(values[:INDEX_ITEMS])
+        starts = np.searchsorted(self.keys, keys, side="left")
+        stops = np.searchsorted(self.keys, keys, side="right")
+        hits = [self.track_ids[start:stop] for start, stop in zip(starts, stops)]
+        if self.stale:
+            stale = list(self.stale)
+            hits = [ids[~np.isin(ids, stale)] for ids in hits]
+        hits.extend(
+            np.asarray(self.pending[key])
+            for key in keys.tolist()
+            if key in self.pending
+        )
+        if not hits:
+            return []
+        track_ids, counts = np.unique(np.concatenate(hits), return_counts=True)
+        order = np.argsort(-counts, kind="stable")[:MAX_CANDIDATES]
+        return [int(track_ids[i]) for i in order if counts[i] >= MIN_KEY_HITS]
+
+    def query(self, fingerprint, duration=None, exclude_path=None):
+        # Indexed tracks at least near-duplicates of the fingerprint, the most
+        # similar first.
+        values = decode(fingerprint)
+        if exclude_path is not None:
+            exclude_path = os.path.abspath(exclude_path)
+        matches = []
+        for track_id in self.candidates(values):
+            path, track_duration, blob = self._connection.execute(
+                "SELECT path, duration, fingerprint FROM tracks WHERE id = ?",
+                (track_id,),
+            ).fetchone()
+            if path == exclude_path:
+                continue
+            score = similarity(values, np.frombuffer(blob, dtype=np.uint32))
+            if score < self.near_duplicate_similarity:
+                continue
+            same_duration = (
+                duration is None
+                or track_duration is None
+                or abs(duration - track_duration) <= DURATION_TOLERANCE
+            )
+            matches.append(
+                {
+                    "path": path,
+                    "similarity": round(score, 4),
+                    "duplicate": score >= self.duplicate_similarity and same_duration,
+                }
+            )
+        return sorted(matches, key=lambda m: m["similarity"], reverse=True)
+
+    def find_duplicate(self, fingerprint, duration=None, exclude_path=None):
+        for match in self.query(fingerprint, duration, exclude_path):
+            if match["duplicate"]:
+                return match
+        return None
+
+    def save(self):
+        if not self.pending and not self.stale:
+            return
+        saved_keys, saved_track_ids = self.saved_postings()
+        new_keys = []
+        new_track_ids = []
+        for key, track_ids in self.pending.items():
+            new_keys.extend([key] * len(track_ids))
+            new_track_ids.extend(track_ids)
+        keys = np.concatenate([saved_keys, np.array(new_keys, dtype=np.uint32)])
+        track_ids = np.concatenate(
+            [saved_track_ids, np.array(new_track_ids, dtype=np.uint32)]
+        )
+        order = np.argsort(keys, kind="stable")
+        # Written next to the index then renamed, readers never see a partial
+        # index.
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.concatenate([keys[order], track_ids[order]]))
+        os.replace(tmp_path, self.index_path)
+        self.pending = {}
+        self.stale = set()
+        self.unsaved = 0
+        self.load()
+
+    def close(self):
+        self.save()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def shared_index(index_dir, **kwargs):
+    # One index per directory and process, so that a serial run queries the
+    # tracks it just added and worker processes keep their memory maps.
+    key = os.path.abspath(index_dir)
+    if key not in _shared_indexes:
+        _shared_indexes[key] = FingerprintIndex(index_dir, **kwargs)
+        atexit.register(_shared_indexes[key].close)
+    else:
+        _shared_indexes[key].refresh()
+    return _shared_indexes[key]
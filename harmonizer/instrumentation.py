@@ -0,0 +1,190 @@
+import contextlib
+import functools
+import math
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is not reported there.
+    resource = None
+
+
+def rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere.
+    if sys.platform == "darwin":
+        peak = peak / 1024
+    return round(peak / 1024, 1)
+
+
+def peak_rss_mb():
+    # Peak resident set size of the current process since it started.
+    if resource is None:
+        return None
+    return rss_mb(resource.RUSAGE_SELF)
+
+
+def children_peak_rss_mb():
+    # Largest peak resident set size of the child processes waited for so far,
+    # ffmpeg and fpcalc run as child processes.
+    if resource is None:
+        return None
+    return rss_mb(resource.RUSAGE_CHILDREN)
+
+
+def children_cpu():
+    # CPU time of the child processes waited for so far.
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Timings:
+    # Wall time and CPU time of each stage. The CPU time is the one of the
+    # calling thread plus the one of the child processes (ffmpeg, fpcalc) that
+    # ended during the stage, the latter is also reported as children_cpu.
+    # Peak RSS are the high-water marks of the process and of its children when
+    # the stage ended, not the memory used by the stage itself.
+    # A stage entered several times accumulates its times.
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        children_cpu_start = children_cpu()
+        try:
+            yield
+        finally:
+            stage_children_cpu = children_cpu() - children_cpu_start
+            self.record(
+                name,
+                time.perf_counter() - wall_start,
+                time.thread_time() - cpu_start + stage_children_cpu,
+                children_cpu=stage_children_cpu,
+            )
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name, wall, cpu, rss=None, children_cpu=0.0, children_rss=None):
+        if rss is None:
+            rss = peak_rss_mb()
+        if children_rss is None:
+            children_rss = children_peak_rss_mb()
+        with self._lock:
+            stage = self.stages.setdefault(
+                name,
+                {
+                    "wall": 0.0,
+                    "cpu": 0.0,
+                    "children_cpu": 0.0,
+                    "peak_rss_mb": None,
+                    "children_peak_rss_mb": None,
+                },
+            )
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["children_cpu"] += children_cpu
+            if rss is not None:
+                stage["peak_rss_mb"] = max(stage["peak_rss_mb"] or 0, rss)
+            if children_rss is not None:
+                stage["children_peak_rss_mb"] = max(
+                    stage["children_peak_rss_mb"] or 0, children_rss
+                )
+
+    def merge(self, stages):
+        # Adds timings recorded elsewhere, e.g. returned by a worker process.
+        for name, stage in stages.items():
+            self.record(
+                name,
+                stage["wall"],
+                stage["cpu"],
+                stage["peak_rss_mb"],
+                children_cpu=stage.get("children_cpu", 0.0),
+                children_rss=stage.get("children_peak_rss_mb"),
+            )
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                name: {
+                    "wall": round(stage["wall"], 4),
+                    "cpu": round(stage["cpu"], 4),
+                    "children_cpu": round(stage["children_cpu"], 4),
+                    "peak_rss_mb": stage["peak_rss_mb"],
+                    "children_peak_rss_mb": stage["children_peak_rss_mb"],
+                }
+                for name, stage in self.stages.items()
+            }
+
+
+@contextlib.contextmanager
+def stage(timings, name):
+    # Times the block when a Timings is given, so that instrumentation stays
+    # optional for library callers.
+    if timings is None:
+        yield
+    else:
+        with timings.stage(name):
+            yield
+
+
+def percentile(sorted_values, percent):
+    # Nearest rank percentile.
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class StageStatistics:
+    # Aggregates the timings of every file of a run.
+    def __init__(self):
+        self.walls = {}
+
+    def add(self, stages):
+        for name, stage in stages.items():
+            self.walls.setdefault(name, []).append(stage["wall"])
+
+    def summary(self):
+        rows = []
+        for name, walls in self.walls.items():
+            walls = sorted(walls)
+            rows.append(
+                {
+                    "stage": name,
+                    "count": len(walls),
+                    "p50": percentile(walls, 50),
+                    "p95": percentile(walls, 95),
+                    "total": sum(walls),
+                }
+            )
+        return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+    def table(self):
+        lines = [
+            "{:<36} {:>7} {:>9} {:>9} {:>10}".format(
+                "stage", "count", "p50", "p95", "total"
+            )
+        ]
+        for row in self.summary():
+            lines.append(
+                "{stage:<36} {count:>7} {p50:>9.3f} {p95:>9.3f} {total:>10.1f}".format(
+                    **row
+                )
+            )
+        return "\n".join(lines)
@@ -0,0 +1,127 @@
+import json
+import os
+import sqlite3
+import time
+
+from harmonizer import manifest
+
+JOURNAL_FILENAME = ".harmonizer-journal.sqlite"
+STARTED = "started"
+MANIPULATED = "manipulated"
+DONE = "done"
+FAILED = "failed"
+
+
+class Journal:
+    # Per-file state of a directory run, committed at every step so that a run
+    # killed midway can be resumed. Manipulation results are kept, so files that
+    # failed later on only have their enrichments retried.
+    def __init__(self, journal_dir, parsed_config, resume=False):
+        self.path = os.path.join(journal_dir, JOURNAL_FILENAME)
+        self.config_hash = manifest.config_hash(parsed_config)
+        self._connection = sqlite3.connect(self.path)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "path TEXT PRIMARY KEY, config_hash TEXT NOT NULL, "
+                "input TEXT NOT NULL, state TEXT NOT NULL, failed_stage TEXT, "
+                "error TEXT, manipulated TEXT, outputs TEXT, "
+                "updated_at REAL NOT NULL)"
+            )
+            if not resume:
+                self._connection.execute("DELETE FROM jobs")
+
+    def entry(self, local_file_path):
+        # Entries recorded for another config or another version of the input
+        # are ignored.
+        row = self._connection.execute(
+            "SELECT config_hash, input, state, manipulated, outputs FROM jobs "
+            "WHERE path = ?",
+            (os.path.abspath(local_file_path),),
+        ).fetchone()
+        if row is None:
+            return None
+        config_hash, signature, state, manipulated, outputs = row
+        if config_hash != self.config_hash:
+            return None
+        if json.loads(signature) != manifest.input_signature(local_file_path):
+            return None
+        return {
+            "state": state,
+            "manipulated": json.loads(manipulated) if manipulated else None,
+            "outputs": json.loads(outputs) if outputs else [],
+        }
+
+    def is_done(self, local_file_path):
+        entry = self.entry(local_file_path)
+        if entry is None or entry["state"] != DONE:
+            return False
+        return all(os.path.exists(p) for p in entry["outputs"])
+
+    def manipulated(self, local_file_path):
+        # Manipulation results of a file whose run stopped after its audio
+        # output was written.
+        entry = self.entry(local_file_path)
+        if entry is None or entry["manipulated"] is None:
+            return None
+        # Duplicates skipped by the fingerprint index have no output.
+        output_file_path = entry["manipulated"]["output_file_path"]
+        if output_file_path is not None and not os.path.exists(output_file_path):
+            return None
+        return entry["manipulated"]
+
+    def start(self, local_file_path):
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs (path, config_hash, input, state, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+                "config_hash = excluded.config_hash, input = excluded.input, "
+                "state = excluded.state, failed_stage = NULL, error = NULL, "
+                "updated_at = excluded.updated_at",
+                (
+                    os.path.abspath(local_file_path),
+                    self.config_hash,
+                    json.dumps(manifest.input_signature(local_file_path)),
+                    STARTED,
+                    time.time(),
+                ),
+            )
+
+    def record_manipulated(self, local_file_path, manipulated):
+        self.update(
+            local_file_path, state=MANIPULATED, manipulated=json.dumps(manipulated)
+        )
+
+    def finish(self, local_file_path, output_paths):
+        self.update(local_file_path, state=DONE, outputs=json.dumps(list(output_paths)))
+
+    def fail(self, local_file_path, stage, error):
+        self.update(local_file_path, state=FAILED, failed_stage=stage, error=error)
+
+    def update(self, local_file_path, **columns):
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self._connection:
+            self._connection.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE path = ?",
+                (*columns.values(), time.time(), os.path.abspath(local_file_path)),
+            )
+
+    def stats(self):
+        counts = dict(
+            self._connection.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        )
+        return {
+            state: counts.get(state, 0)
+            for state in (STARTED, MANIPULATED, DONE, FAILED)
+        }
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
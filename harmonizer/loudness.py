@@ -0,0 +1,215 @@
+import math
+
+import numpy as np
+import scipy.signal
+
+# ITU-R BS.1770-4 integrated loudness: K-weighted mean square over 400 ms blocks
+# overlapping by 75 %, gated at -70 LUFS then 10 LU below the ungated loudness.
+BLOCK_SECONDS = 0.4
+STEP_SECONDS = 0.1
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+LOUDNESS_OFFSET = -0.691
+DEFAULT_TARGET = -16.0
+DEFAULT_MAX_TRUE_PEAK = -1.0
+# Channel weights for 5.1 layouts (L, R, C, LFE, Ls, Rs), other layouts weight
+# every channel equally.
+SURROUND_WEIGHTS = [1.0, 1.0, 1.0, 0.0, 1.41, 1.41]
+# Taps of each polyphase branch of the true peak interpolation filter.
+TRUE_PEAK_TAPS = 12
+# Frames interpolated at once when looking for the true peak.
+TRUE_PEAK_BLOCK_SIZE = 1024
+
+
+def k_weighting(rate):
+    # Pre-filter (high shelf) and RLB filter (high pass) coefficients computed
+    # for any sample rate, as libebur128 does.
+    f0 = 1681.974450955533
+    gain = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / rate)
+    vh = 10 ** (gain / 20)
+    vb = vh**0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [
+        (vh + vb * k / q + k * k) / a0,
+        2 * (k * k - vh) / a0,
+        (vh - vb * k / q + k * k) / a0,
+        1.0,
+        2 * (k * k - 1) / a0,
+        (1 - k / q + k * k) / a0,
+    ]
+
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / rate)
+    a0 = 1 + k / q + k * k
+    high_pass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, high_pass])
+
+
+def oversampling_factor(rate):
+    if rate < 96000:
+        return 4
+    if rate < 192000:
+        return 2
+    return 1
+
+
+def interpolation_filter(factor):
+    # Low pass FIR removing the images of the zero-stuffed signal.
+    if factor == 1:
+        return None
+    return scipy.signal.firwin(TRUE_PEAK_TAPS * factor, 1 / factor) * factor
+
+
+def power_to_lufs(power):
+    if power <= 0:
+        return -float("infinity")
+    return LOUDNESS_OFFSET + 10 * math.log10(power)
+
+
+def lufs_to_power(lufs):
+    return 10 ** ((lufs - LOUDNESS_OFFSET) / 10)
+
+
+def amplitude_to_db(amplitude):
+    if amplitude <= 0:
+        return -float("infinity")
+    return 20 * math.log10(amplitude)
+
+
+class LoudnessMeter:
+    # Measures integrated loudness and true peak of samples pushed chunk by
+    # chunk: filter states are carried over between chunks and only one energy
+    # value per 100 ms is kept.
+    def __init__(self, rate, channels):
+        self.rate = rate
+        self.channels = channels
+        if channels == len(SURROUND_WEIGHTS):
+            self.weights = np.array(SURROUND_WEIGHTS)
+        else:
+            self.weights = np.ones(channels)
+        self.step = int(round(rate * STEP_SECONDS))
+        self.steps_per_block = int(round(BLOCK_SECONDS / STEP_SECONDS))
+
+        self.sos = k_weighting(rate)
+        self.sos_state = np.zeros((len(self.sos), channels, 2))
+        self.oversampling = oversampling_factor(rate)
+        self.interpolation = interpolation_filter(self.oversampling)
+        if self.interpolation is not None:
+            # No interpolated sample can exceed its input neighbourhood by more
+            # than this factor.
+            self.interpolation_bound = max(
+                np.abs(self.interpolation[phase :: self.oversampling]).sum()
+                for phase in range(self.oversampling)
+            )
+        self.peak_history = np.zeros((channels, TRUE_PEAK_TAPS - 1))
+
+        self.step_energies = []
+        self.pending_energy = 0.0
+        self.pending_count = 0
+        self.peak = 0.0
+
+    def push(self, samples):
+        # samples: float array of shape (frames, channels) in [-1, 1]. They are
+        # processed channel by channel, which keeps every filter on contiguous
+        # memory.
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, self.channels)
+        if len(samples) == 0:
+            return
+        channels = np.ascontiguousarray(samples.T)
+        self._measure_peak(channels)
+
+        filtered, self.sos_state = scipy.signal.sosfilt(
+            self.sos, channels, axis=1, zi=self.sos_state
+        )
+        np.square(filtered, out=filtered)
+        self._accumulate(self.weights @ filtered)
+
+    def _measure_peak(self, channels):
+        # Blocks are interpolated loudest first and the others are skipped as
+        # soon as their bound cannot beat the running peak, which is exact and
+        # avoids oversampling most of a track.
+        history = self.peak_history.shape[1]
+        frames = np.concatenate([self.peak_history, channels], axis=1)
+        self.peak_history = frames[:, -history:]
+        magnitudes = np.abs(frames[0])
+        for channel in frames[1:]:
+            np.maximum(magnitudes, np.abs(channel), out=magnitudes)
+        self.peak = max(self.peak, magnitudes.max())
+        if self.interpolation is None:
+            return
+
+        size = TRUE_PEAK_BLOCK_SIZE
+        block_peaks = np.maximum.reduceat(
+            magnitudes, np.arange(0, len(magnitudes), size)
+        )
+        # Block j outputs frames [history + j * size, history + (j + 1) * size)
+        # which depend on frames [j * size, history + (j + 1) * size).
+        blocks = -(-channels.shape[1] // size)
+        bounds = np.maximum(
+            block_peaks[:blocks], np.append(block_peaks, 0)[1:][:blocks]
+        )
+        bounds *= self.interpolation_bound
+        for j in np.argsort(-bounds):
+            if bounds[j] <= self.peak:
+                break
+            block = frames[:, j * size : history + (j + 1) * size]
+            interpolated = scipy.signal.upfirdn(
+                self.interpolation, block, self.oversampling, axis=1
+            )
+            interpolated = interpolated[
+                :, history * self.oversampling : block.shape[1] * self.oversampling
+            ]
+            self.peak = max(self.peak, np.abs(interpolated).max())
+
+    def _accumulate(self, energy):
+        # Completes the pending 100 ms step then sums whole steps at once.
+        head = energy[: self.step - self.pending_count]
+        self.pending_energy += head.sum()
+        self.pending_count += len(head)
+        if self.pending_count == self.step:
+            self.step_energies.append(np.array([self.pending_energy]))
+            self.pending_energy, self.pending_count = 0.0, 0
+
+        rest = energy[len(head) :]
+        whole = len(rest) // self.step * self.step
+        if whole:
+            self.step_energies.append(rest[:whole].reshape(-1, self.step).sum(axis=1))
+        tail = rest[whole:]
+        if len(tail):
+            self.pending_energy += tail.sum()
+            self.pending_count += len(tail)
+
+    def block_powers(self):
+        if not self.step_energies:
+            return np.zeros(0)
+        steps = np.concatenate(self.step_energies)
+        if len(steps) < self.steps_per_block:
+            return np.zeros(0)
+        window = np.ones(self.steps_per_block)
+        return np.convolve(steps, window, "valid") / (self.step * self.steps_per_block)
+
+    def integrated_loudness(self):
+        powers = self.block_powers()
+        powers = powers[powers > lufs_to_power(ABSOLUTE_GATE)]
+        if len(powers) == 0:
+            return -float("infinity")
+        relative_gate = power_to_lufs(powers.mean()) + RELATIVE_GATE
+        powers = powers[powers > lufs_to_power(relative_gate)]
+        return power_to_lufs(powers.mean())
+
+    def true_peak(self):
+        return amplitude_to_db(self.peak)
+
+
+def loudness_gain(integrated_loudness, true_peak, target, max_true_peak):
+    # Gain bringing the track to the target loudness without pushing its true
+    # peak over max_true_peak.
+    if integrated_loudness == -float("infinity"):
+        return 0.0
+    gain = target - integrated_loudness
+    if true_peak + gain > max_true_peak:
+        gain = max_true_peak - true_peak
+    return gain
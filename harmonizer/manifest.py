@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = ".harmonizer-manifest.json"
+# Operational settings that have no effect on the produced files.
+CONFIG_KEYS_IGNORED = ["enrichment_cache", "rate_limits"]
+SAVE_EVERY = 50
+
+
+def config_hash(parsed_config):
+    relevant_config = {
+        k: v for k, v in parsed_config.items() if k not in CONFIG_KEYS_IGNORED
+    }
+    serialized = json.dumps(relevant_config, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf8")).hexdigest()
+
+
+def input_signature(local_file_path):
+    stat = os.stat(local_file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class Manifest:
+    def __init__(self, manifest_dir, parsed_config):
+        self.path = os.path.join(manifest_dir, MANIFEST_FILENAME)
+        self.config_hash = config_hash(parsed_config)
+        self.entries = {}
+        self.unsaved = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    def is_up_to_date(self, local_file_path):
+        entry = self.entries.get(os.path.abspath(local_file_path))
+        if entry is None or entry["config_hash"] != self.config_hash:
+            return False
+        if entry["input"] != input_signature(local_file_path):
+            return False
+        return all(os.path.exists(p) for p in entry["outputs"])
+
+    def record(self, local_file_path, output_paths):
+        self.entries[os.path.abspath(local_file_path)] = {
+            "input": input_signature(local_file_path),
+            "config_hash": self.config_hash,
+            "outputs": list(output_paths),
+        }
+        self.unsaved += 1
+        if self.unsaved >= SAVE_EVERY:
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
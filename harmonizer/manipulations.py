@@ -1,21 +1,178 @@
-import mimetypes
+import contextlib
 import os
+import shutil
 
 import acoustid
-import eyed3
 import mutagen
+import mutagen.flac
+import mutagen.id3
+import mutagen.mp3
+import mutagen.mp4
+import numpy as np
 import pydub
+import pydub.utils
+from mutagen.easyid3 import EasyID3
+from mutagen.easymp4 import EasyMP4Tags
 from titlecase import titlecase
 
+from harmonizer import covers, instrumentation, loudness, streaming
+
+FINGERPRINT_MAX_LENGTH = acoustid.MAX_AUDIO_LENGTH
+PCM_CHUNK_SECONDS = 10
+DEFAULT_FAST_PATH_MAX_GAIN_CHANGE = 0.5
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+# Number of samples converted to floats at once during analysis.
+ANALYSIS_BLOCK_SIZE = 2**20
+
 
 def load_audio(local_audio_path):
     return pydub.AudioSegment.from_file(local_audio_path)
 
 
+def samples_array(sound):
+    return np.frombuffer(sound.raw_data, dtype=SAMPLE_DTYPES[sound.sample_width])
+
+
+def sample_chunks(sound, chunk_seconds=PCM_CHUNK_SECONDS):
+    # Views on the samples of the sound, nothing is copied.
+    samples = samples_array(sound)
+    chunk_size = int(chunk_seconds * sound.frame_rate) * sound.channels
+    for offset in range(0, len(samples), chunk_size):
+        yield samples[offset : offset + chunk_size]
+
+
+def measure(samples):
+    # Peak and RMS in a single pass, block by block so that the float copy of
+    # the samples stays small.
+    return measure_chunks(
+        samples[offset : offset + ANALYSIS_BLOCK_SIZE]
+        for offset in range(0, len(samples), ANALYSIS_BLOCK_SIZE)
+    )
+
+
+def measure_chunks(chunks):
+    peak = 0
+    sum_of_squares = 0.0
+    sample_count = 0
+    for chunk in chunks:
+        block = chunk.astype(np.float64)
+        peak = max(peak, np.max(np.abs(block), initial=0))
+        sum_of_squares += np.dot(block, block)
+        sample_count += len(block)
+    return peak, rms_of(sum_of_squares, sample_count)
+
+
+def to_dbfs(rms, max_possible_amplitude):
+    if rms == 0:
+        return -float("infinity")
+    return pydub.utils.ratio_to_db(rms / max_possible_amplitude)
+
+
+def peak_gain(peak, max_possible_amplitude, headroom=0.1):
+    # Gain in dB bringing the peak headroom dB below full scale, as
+    # pydub.effects.normalize does.
+    if peak == 0:
+        return 0.0
+    target_peak = max_possible_amplitude * pydub.utils.db_to_float(-headroom)
+    return pydub.utils.ratio_to_db(target_peak / peak)
+
+
+def apply_gain(samples, gain, minimum, maximum):
+    # Scales the samples in place and returns the RMS of the result.
+    return rms_of(scale(samples, gain, minimum, maximum), len(samples))
+
+
+def scale(samples, gain, minimum, maximum):
+    # Scales the samples in place and returns the sum of squares of the result.
+    factor = pydub.utils.db_to_float(gain)
+    sum_of_squares = 0.0
+    for offset in range(0, len(samples), ANALYSIS_BLOCK_SIZE):
+        block = samples[offset : offset + ANALYSIS_BLOCK_SIZE].astype(np.float64)
+        block *= factor
+        np.floor(block, out=block)
+        np.clip(block, minimum, maximum, out=block)
+        samples[offset : offset + ANALYSIS_BLOCK_SIZE] = block
+        sum_of_squares += np.dot(block, block)
+    return sum_of_squares
+
+
+def rms_of(sum_of_squares, sample_count):
+    # Truncated like audioop.rms so that dBFS values match pydub's.
+    if sample_count == 0:
+        return 0
+    return int(np.sqrt(sum_of_squares / sample_count))
+
+
 def normalize(sound, headroom=0.1):
-    normalized = pydub.effects.normalize(sound, headroom)
-    change_in_dbfs = sound.dBFS - normalized.dBFS
-    return sound.dBFS, normalized.dBFS, change_in_dbfs, normalized
+    max_possible_amplitude = sound.max_possible_amplitude
+    peak, rms = measure(samples_array(sound))
+    original_dbfs = to_dbfs(rms, max_possible_amplitude)
+    if peak == 0:
+        return original_dbfs, original_dbfs, 0.0, sound
+
+    normalized_rms, normalized = amplify(
+        sound, peak_gain(peak, max_possible_amplitude, headroom)
+    )
+    normalized_dbfs = to_dbfs(normalized_rms, max_possible_amplitude)
+    change_in_dbfs = original_dbfs - normalized_dbfs
+    return original_dbfs, normalized_dbfs, change_in_dbfs, normalized
+
+
+def amplify(sound, gain):
+    # Applies the gain to a full copy of the samples, returns its RMS and the
+    # new sound. The pipeline applies its gain while encoding instead.
+    buffer = bytearray(sound.raw_data)
+    samples = np.frombuffer(buffer, dtype=SAMPLE_DTYPES[sound.sample_width])
+    dtype_info = np.iinfo(samples.dtype)
+    rms = apply_gain(samples, gain, dtype_info.min, dtype_info.max)
+    return rms, sound._spawn(buffer)
+
+
+def measure_loudness(sound, chunk_seconds=PCM_CHUNK_SECONDS):
+    # Integrated loudness (LUFS) and true peak (dBTP), the samples are fed to
+    # the meter as floats one chunk at a time.
+    return measure_loudness_chunks(
+        sample_chunks(sound, chunk_seconds),
+        sound.frame_rate,
+        sound.channels,
+        sound.sample_width,
+    )
+
+
+def measure_loudness_chunks(chunks, frame_rate, channels, sample_width):
+    meter = loudness.LoudnessMeter(frame_rate, channels)
+    full_scale = 2 ** (8 * sample_width - 1)
+    for chunk in chunks:
+        chunk = chunk.astype(np.float64)
+        chunk /= full_scale
+        meter.push(chunk.reshape(-1, channels))
+    return meter.integrated_loudness(), meter.true_peak()
+
+
+def loudness_metadata(original_lufs, true_peak, gain, target):
+    return {
+        "mode": "lufs",
+        "target_lufs": target,
+        "original_lufs": original_lufs,
+        "normalized_lufs": original_lufs + gain,
+        "original_true_peak_dbtp": true_peak,
+        "normalized_true_peak_dbtp": true_peak + gain,
+        "change_db": gain,
+    }
+
+
+def peak_metadata(original_dbfs, normalized_dbfs, change_in_dbfs):
+    return {
+        "mode": "peak",
+        "change_dbfs": change_in_dbfs,
+        "normalized_dbfs": normalized_dbfs,
+        "original_dbfs": original_dbfs,
+    }
+
+
+def normalization_gain(sound, headroom=0.1):
+    peak, _ = measure(samples_array(sound))
+    return peak_gain(peak, sound.max_possible_amplitude, headroom)
 
 
 def export(sound, output_path, audio_format="mp3", bitrate=192, tags={}):
@@ -25,44 +182,186 @@ def export(sound, output_path, audio_format="mp3", bitrate=192, tags={}):
     return audio_format, bitrate, output_path
 
 
-def fingerprint(local_normalized_path):
-    duration, fp_encoded = acoustid.fingerprint_file(local_normalized_path)
+def copy_and_retag(local_audio_path, output_path, bitrate, tags={}):
+    shutil.copyfile(local_audio_path, output_path)
+    audio = mutagen.File(output_path, easy=True)
+    if audio.tags is None:
+        audio.add_tags()
+    for k, v in tags.items():
+        try:
+            audio.tags[k] = v
+        except mutagen.easyid3.EasyID3KeyError:
+            pass
+    audio.save()
+    return "mp3", bitrate, output_path
+
+
+def fingerprint(local_normalized_path, max_length=FINGERPRINT_MAX_LENGTH):
+    duration, fp_encoded = acoustid.fingerprint_file(
+        local_normalized_path, maxlength=max_length
+    )
     return duration, fp_encoded.decode("utf8")
 
 
-def extract_file_metadata(local_path):
-    mime_type = None
-    tags = {}
-    mutagen_file = mutagen.File(local_path, easy=True)
-    if mutagen_file is not None:
-        mime_type = mutagen_file.mime[0]
-        if mutagen_file.tags is not None:
-            tags = {k: ", ".join(v) for k, v in dict(mutagen_file.tags).items()}
-    return mime_type, tags
+def fingerprint_sound(sound, max_length=FINGERPRINT_MAX_LENGTH):
+    # Feeds the decoded samples straight to Chromaprint instead of decoding the
+    # exported file again through fpcalc. Like fpcalc, only the first max_length
+    # seconds are fingerprinted.
+    duration = sound.duration_seconds
+    sound = sound[: max_length * 1000]
+    # Chromaprint only accepts 16 bits signed samples.
+    if sound.sample_width != 2:
+        sound = sound.set_sample_width(2)
+    fp_encoded = acoustid.fingerprint(
+        sound.frame_rate, sound.channels, pcm_chunks(sound), max_length
+    )
+    return duration, fp_encoded.decode("utf8")
 
 
-def get_cover_art(file_path, image_output_dir):
-    audio = mutagen.File(file_path)
-    raw_bytes = None
+class PCMFingerprinter:
+    # Incremental counterpart of acoustid.fingerprint, fed with chunks of
+    # interleaved samples while they stream through the pipeline.
+    def __init__(self, frame_rate, channels, max_length=FINGERPRINT_MAX_LENGTH):
+        self.fingerprinter = acoustid.chromaprint.Fingerprinter()
+        self.fingerprinter.start(frame_rate, channels)
+        self.remaining = frame_rate * channels * max_length
+
+    def feed(self, samples):
+        if self.remaining <= 0:
+            return
+        samples = samples[: self.remaining]
+        # Chromaprint only accepts 16 bits signed samples.
+        if samples.dtype != np.int16:
+            samples = (samples >> 16).astype(np.int16)
+        self.fingerprinter.feed(samples.tobytes())
+        self.remaining -= len(samples)
+
+    def finish(self):
+        return self.fingerprinter.finish().decode("utf8")
+
+
+def pcm_chunks(sound, chunk_seconds=PCM_CHUNK_SECONDS):
+    raw_data = memoryview(sound.raw_data)
+    chunk_size = int(chunk_seconds * sound.frame_rate) * sound.frame_width
+    for offset in range(0, len(raw_data), chunk_size):
+        yield raw_data[offset : offset + chunk_size].tobytes()
+
+
+def probe(local_path):
+    # Parses the container once and gathers everything the pipeline needs before
+    # decoding: mime type, easy tags, cover art, bitrate and duration.
+    probed = {
+        "mime_type": None,
+        "tags": {},
+        "cover_art": None,
+        "bitrate": None,
+        "constant_bitrate": None,
+        "duration": None,
+    }
+    audio = mutagen.File(local_path)
     if audio is not None:
-        for t in ["covr", "APIC:cover", "APIC:"]:
-            if t in audio:
-                try:
-                    raw_bytes = audio[t].data
-                    mime_type = audio[t].mime
-                except AttributeError:
-                    raw_bytes = None
-        if raw_bytes is not None:
-            image_output_path = os.path.basename(file_path)
-            image_output_name, _ = os.path.splitext(image_output_path)
-            if mime_type in ["image/jpeg", "image/jpg"]:
-                ext = ".jpeg"
+        probed["mime_type"] = audio.mime[0]
+        if audio.tags is not None:
+            probed["tags"] = {k: ", ".join(v) for k, v in easy_tags(audio.tags).items()}
+        probed["cover_art"] = find_cover_art(audio)
+        probed["bitrate"] = mp3_bitrate(audio)
+        probed["constant_bitrate"] = mp3_constant_bitrate(audio)
+        probed["duration"] = getattr(audio.info, "length", None)
+    return probed
+
+
+def probe_integrity(local_path):
+    # Probe data, None when mutagen cannot parse the file, and the integrity
+    # errors found without decoding the audio.
+    try:
+        probed = probe(local_path)
+    except mutagen.MutagenError as e:
+        return None, [f"{type(e).__name__}: {e}"]
+    if probed["mime_type"] is None:
+        return probed, ["Unrecognized audio file."]
+    if not probed["duration"]:
+        return probed, ["The file has no audio duration."]
+    return probed, streaming.probe_errors(local_path)
+
+
+def easy_tags(tags):
+    if isinstance(tags, mutagen.id3.ID3):
+        easy = {}
+        for key, getter in EasyID3.Get.items():
+            if key in EasyID3.List:
+                keys = EasyID3.List[key](tags, key)
             else:
-                ext = mimetypes.guess_extension(mime_type)
-            image_output_path = os.path.join(image_output_dir, image_output_name + ext)
-            with open(image_output_path, "wb") as f:
-                f.write(raw_bytes)
-            return image_output_path
+                keys = [key]
+            for k in keys:
+                try:
+                    easy[k] = getter(tags, k)
+                except KeyError:
+                    pass
+        return easy
+    if isinstance(tags, mutagen.mp4.MP4Tags):
+        easy = {}
+        for key, getter in EasyMP4Tags.Get.items():
+            try:
+                easy[key] = getter(tags, key)
+            except KeyError:
+                pass
+        return easy
+    return dict(tags)
+
+
+def find_cover_art(audio):
+    # Stops at the first picture found.
+    if isinstance(audio.tags, mutagen.id3.ID3):
+        for t in ["APIC:cover", "APIC:"]:
+            if t in audio.tags:
+                return {"data": audio.tags[t].data, "mime_type": audio.tags[t].mime}
+        for frame in audio.tags.values():
+            if isinstance(frame, mutagen.id3.APIC):
+                return {"data": frame.data, "mime_type": frame.mime}
+    elif isinstance(audio.tags, mutagen.mp4.MP4Tags) and audio.tags.get("covr"):
+        cover = audio.tags["covr"][0]
+        if cover.imageformat == mutagen.mp4.MP4Cover.FORMAT_PNG:
+            return {"data": bytes(cover), "mime_type": "image/png"}
+        return {"data": bytes(cover), "mime_type": "image/jpeg"}
+    elif isinstance(audio, mutagen.flac.FLAC) and audio.pictures:
+        picture = audio.pictures[0]
+        return {"data": picture.data, "mime_type": picture.mime}
+    return None
+
+
+def mp3_bitrate(audio):
+    # Mono streams count twice, as the stereo bitrate of the same quality.
+    if isinstance(audio, mutagen.mp3.MP3):
+        bitrate = audio.info.bitrate // 1000
+        if audio.info.mode == mutagen.mp3.MONO:
+            bitrate = bitrate * 2
+        return bitrate
+
+
+def mp3_constant_bitrate(audio):
+    # Bitrate of constant bitrate MP3s, counted like mp3_bitrate. Files without
+    # a VBR header are assumed to be constant bitrate.
+    if isinstance(audio, mutagen.mp3.MP3) and audio.info.bitrate_mode in [
+        mutagen.mp3.BitrateMode.CBR,
+        mutagen.mp3.BitrateMode.UNKNOWN,
+    ]:
+        return mp3_bitrate(audio)
+
+
+def extract_file_metadata(local_path):
+    probed = probe(local_path)
+    return probed["mime_type"], probed["tags"]
+
+
+def get_cover_art(file_path, image_output_dir):
+    stored = write_cover_art(probe(file_path)["cover_art"], image_output_dir)
+    if stored is not None:
+        return stored["path"]
+
+
+def write_cover_art(cover_art, image_output_dir, thumbnail_sizes=()):
+    if cover_art is not None:
+        return covers.store(cover_art, image_output_dir, thumbnail_sizes)
 
 
 def capitalize_tags(tags, tags_to_capitalize=["artist", "album", "title"]):
@@ -74,12 +373,161 @@ def capitalize_tags(tags, tags_to_capitalize=["artist", "album", "title"]):
 
 
 def get_mp3_bitrate(local_file_path):
-    audio = eyed3.load(local_file_path)
-    if audio is not None:
-        bitrate = audio.info.mp3_header.bit_rate
-        if audio.info.mp3_header.mode == "Mono":
-            bitrate = bitrate * 2
-        return bitrate
+    return probe(local_file_path)["bitrate"]
+
+
+def stream_manipulation(
+    local_audio_path,
+    audio_output_path,
+    tags,
+    copy_input,
+    output_audio_format="mp3",
+    active_normalize=False,
+    normalization_headroom=0.1,
+    target_bitrate=192,
+    fingerprint_source="file",
+    fingerprint_max_length=FINGERPRINT_MAX_LENGTH,
+    fast_path_max_gain_change=DEFAULT_FAST_PATH_MAX_GAIN_CHANGE,
+    normalization_mode="peak",
+    loudness_target=loudness.DEFAULT_TARGET,
+    max_true_peak=loudness.DEFAULT_MAX_TRUE_PEAK,
+    chunk_seconds=PCM_CHUNK_SECONDS,
+    two_pass=False,
+    timings=None,
+):
+    # Same steps as the in memory pipeline, with the PCM flowing in chunks
+    # from an ffmpeg decoder to an ffmpeg encoder. When normalizing, the
+    # decoded samples are spooled to disk while the gain is measured, or
+    # decoded a second time with two_pass.
+    info = streaming.stream_info(local_audio_path)
+    frame_rate, channels = info["frame_rate"], info["channels"]
+    sample_width = info["sample_width"]
+    max_possible_amplitude = 2 ** (8 * sample_width - 1)
+    chunk_frames = int(chunk_seconds * frame_rate)
+    fingerprinter = None
+    if fingerprint_source == "pcm" and acoustid.have_chromaprint:
+        fingerprinter = PCMFingerprinter(frame_rate, channels, fingerprint_max_length)
+
+    def decoded(fingerprint=True):
+        chunks = streaming.decode(
+            local_audio_path, sample_width, channels, chunk_frames
+        )
+        if fingerprinter is None or not fingerprint:
+            return chunks
+        return tee_chunks(chunks, fingerprinter.feed)
+
+    with contextlib.ExitStack() as stack:
+        source = None
+        measured = None
+        normalized_rms = None
+        gain = 0.0
+        if active_normalize:
+            with instrumentation.stage(timings, "analyze"):
+                chunks = decoded()
+                if not copy_input and not two_pass:
+                    spool = stack.enter_context(streaming.Spool(sample_width))
+                    chunks = tee_chunks(chunks, spool.write)
+                    source = spool.chunks(chunk_frames * channels)
+                if normalization_mode == "lufs":
+                    measured = measure_loudness_chunks(
+                        chunks, frame_rate, channels, sample_width
+                    )
+                    gain = loudness.loudness_gain(
+                        *measured, loudness_target, max_true_peak
+                    )
+                else:
+                    peak, measured = measure_chunks(chunks)
+                    gain = peak_gain(
+                        peak, max_possible_amplitude, normalization_headroom
+                    )
+            if copy_input:
+                copy_input = abs(gain) <= fast_path_max_gain_change
+        elif copy_input and fingerprinter is not None:
+            with instrumentation.stage(timings, "fingerprint"):
+                for _ in decoded():
+                    pass
+
+        with instrumentation.stage(timings, "export"):
+            if copy_input:
+                gain = 0.0
+                export_result = copy_and_retag(
+                    local_audio_path, audio_output_path, target_bitrate, tags
+                )
+            else:
+                if source is None:
+                    # The analysis pass already fed the fingerprinter
+                    source = decoded(fingerprint=not active_normalize)
+                with streaming.Encoder(
+                    audio_output_path,
+                    frame_rate,
+                    channels,
+                    sample_width,
+                    output_audio_format,
+                    target_bitrate,
+                    tags,
+                ) as encoder:
+                    normalized_rms = encode_chunks(source, encoder, gain)
+                export_result = output_audio_format, target_bitrate, audio_output_path
+
+    normalization_meta = normalization_metadata(
+        normalization_mode,
+        measured,
+        gain,
+        normalized_rms,
+        loudness_target,
+        max_possible_amplitude,
+    )
+
+    pcm_fingerprint = None
+    if fingerprinter is not None:
+        pcm_fingerprint = info["duration"], fingerprinter.finish()
+    return normalization_meta, copy_input, export_result, pcm_fingerprint
+
+
+def tee_chunks(chunks, consumer):
+    for chunk in chunks:
+        consumer(chunk)
+        yield chunk
+
+
+def encode_chunks(chunks, encoder, gain=0.0):
+    # Writes the chunks to the encoder, applying the gain on the way, and
+    # returns the RMS of what was written.
+    sum_of_squares = 0.0
+    sample_count = 0
+    for chunk in chunks:
+        if gain != 0:
+            chunk = chunk.copy()
+            dtype_info = np.iinfo(chunk.dtype)
+            sum_of_squares += scale(chunk, gain, dtype_info.min, dtype_info.max)
+            sample_count += len(chunk)
+        encoder.write(chunk)
+    return rms_of(sum_of_squares, sample_count)
+
+
+def partial_path(output_path):
+    # Same directory for the rename to be atomic, same extension for the
+    # encoders and taggers that look at it.
+    directory, basename = os.path.split(output_path)
+    return os.path.join(directory, ".partial-" + basename)
+
+
+def remove_partial(output_path):
+    # Left behind when a run is killed while writing the output.
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(partial_path(output_path))
+
+
+@contextlib.contextmanager
+def output_file(output_path):
+    partial_output_path = partial_path(output_path)
+    try:
+        yield partial_output_path
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial_output_path)
+        raise
+    os.replace(partial_output_path, output_path)
 
 
 def pipeline(
@@ -91,42 +539,252 @@ def pipeline(
     normalization_headroom=0.1,
     target_bitrate=192,
     capitalized_tags=True,
+    fingerprint_source="file",
+    fingerprint_max_length=FINGERPRINT_MAX_LENGTH,
+    fast_path=False,
+    fast_path_max_gain_change=DEFAULT_FAST_PATH_MAX_GAIN_CHANGE,
+    normalization_mode="peak",
+    loudness_target=loudness.DEFAULT_TARGET,
+    max_true_peak=loudness.DEFAULT_MAX_TRUE_PEAK,
+    streaming_mode="never",
+    streaming_min_duration=streaming.DEFAULT_MIN_DURATION,
+    chunk_seconds=PCM_CHUNK_SECONDS,
+    two_pass=False,
+    cover_thumbnail_sizes=(),
+    probed=None,
+    timings=None,
 ):
-    mime_type, tags = extract_file_metadata(local_audio_path)
-
-    original_bitrate = get_mp3_bitrate(local_audio_path)
-    cover_art_path = get_cover_art(local_audio_path, image_output_dir)
+    if probed is None:
+        with instrumentation.stage(timings, "probe"):
+            probed = probe(local_audio_path)
+    mime_type, tags = probed["mime_type"], probed["tags"]
+    original_bitrate = probed["bitrate"]
+    with instrumentation.stage(timings, "cover_art"):
+        cover_art = write_cover_art(
+            probed["cover_art"], image_output_dir, cover_thumbnail_sizes
+        )
     if capitalized_tags:
         tags = capitalize_tags(tags)
-    sound = load_audio(local_audio_path)
-    if active_normalize:
-        original_dbfs, normalized_dbfs, change_in_dbfs, sound = normalize(
-            sound, normalization_headroom
-        )
-        normalization_meta = {
-            "change_dbfs": change_in_dbfs,
-            "normalized_dbfs": normalized_dbfs,
-            "original_dbfs": original_dbfs,
-        }
 
-    else:
-        normalization_meta = {}
-
-    output_audio_format, output_bitrate, exported_audio_path = export(
-        sound, audio_output_path, output_audio_format, target_bitrate, tags
+    # Inputs that are already MP3s at the target bitrate are copied and retagged
+    # instead of being decoded and encoded again, unless normalization would
+    # change their gain noticeably.
+    copy_input = (
+        fast_path
+        and output_audio_format == "mp3"
+        and probed["constant_bitrate"] == target_bitrate
     )
-    duration, fp = fingerprint(exported_audio_path)
+
+    # Two pass normalization only exists on the streamed path, so it streams
+    # every track whatever its duration.
+    stream = two_pass
+    if not stream:
+        duration = probed["duration"]
+        if streaming_mode == "auto" and duration is None:
+            duration = streaming.stream_info(local_audio_path)["duration"]
+        stream = streaming.use_streaming(
+            streaming_mode, duration, streaming_min_duration
+        )
+    # Outputs are written to a partial file renamed once complete, so that an
+    # interrupted run never leaves a truncated file under the final name.
+    with output_file(audio_output_path) as partial_output_path:
+        pcm_fingerprint = None
+        if stream:
+            normalization_meta, copy_input, export_result, pcm_fingerprint = (
+                stream_manipulation(
+                    local_audio_path,
+                    partial_output_path,
+                    tags,
+                    copy_input,
+                    output_audio_format=output_audio_format,
+                    active_normalize=active_normalize,
+                    normalization_headroom=normalization_headroom,
+                    target_bitrate=target_bitrate,
+                    fingerprint_source=fingerprint_source,
+                    fingerprint_max_length=fingerprint_max_length,
+                    fast_path_max_gain_change=fast_path_max_gain_change,
+                    normalization_mode=normalization_mode,
+                    loudness_target=loudness_target,
+                    max_true_peak=max_true_peak,
+                    chunk_seconds=chunk_seconds,
+                    two_pass=two_pass,
+                    timings=timings,
+                )
+            )
+        else:
+            normalization_meta, copy_input, export_result, pcm_fingerprint = (
+                manipulate_in_memory(
+                    local_audio_path,
+                    partial_output_path,
+                    tags,
+                    copy_input,
+                    output_audio_format=output_audio_format,
+                    active_normalize=active_normalize,
+                    normalization_headroom=normalization_headroom,
+                    target_bitrate=target_bitrate,
+                    fingerprint_source=fingerprint_source,
+                    fingerprint_max_length=fingerprint_max_length,
+                    fast_path_max_gain_change=fast_path_max_gain_change,
+                    normalization_mode=normalization_mode,
+                    loudness_target=loudness_target,
+                    max_true_peak=max_true_peak,
+                    timings=timings,
+                )
+            )
+        output_audio_format, output_bitrate, exported_audio_path = export_result
+
+        # Fingerprinting from PCM needs the Chromaprint library, fpcalc is used on
+        # the exported file otherwise.
+        if pcm_fingerprint is not None:
+            duration, fp = pcm_fingerprint
+        else:
+            with instrumentation.stage(timings, "fingerprint"):
+                duration, fp = fingerprint(exported_audio_path, fingerprint_max_length)
 
     return (
         {
             "normalization": normalization_meta,
             "tags": tags,
-            "has_cover_art": cover_art_path is not None,
+            "has_cover_art": cover_art is not None,
+            "cover_art": cover_art,
             "fingerprinting": {"duration": duration, "fingerprint": fp},
             "mime_type": mime_type,
             "original_bitrate": original_bitrate,
-            "export": {"audio_format": output_audio_format, "bitrate": output_bitrate},
+            "export": {
+                "audio_format": output_audio_format,
+                "bitrate": output_bitrate,
+                "transcoded": not copy_input,
+            },
         },
-        exported_audio_path,
-        cover_art_path,
+        audio_output_path,
+        cover_art["path"] if cover_art is not None else None,
+    )
+
+
+def manipulate_in_memory(
+    local_audio_path,
+    audio_output_path,
+    tags,
+    copy_input,
+    output_audio_format="mp3",
+    active_normalize=False,
+    normalization_headroom=0.1,
+    target_bitrate=192,
+    fingerprint_source="file",
+    fingerprint_max_length=FINGERPRINT_MAX_LENGTH,
+    fast_path_max_gain_change=DEFAULT_FAST_PATH_MAX_GAIN_CHANGE,
+    normalization_mode="peak",
+    loudness_target=loudness.DEFAULT_TARGET,
+    max_true_peak=loudness.DEFAULT_MAX_TRUE_PEAK,
+    timings=None,
+):
+    sound = None
+    if (
+        active_normalize
+        or not copy_input
+        or (fingerprint_source == "pcm" and acoustid.have_chromaprint)
+    ):
+        with instrumentation.stage(timings, "decode"):
+            sound = load_audio(local_audio_path)
+        # The encoder only takes 16 and 32 bits samples.
+        if sound.sample_width not in streaming.SAMPLE_FORMATS:
+            sound = sound.set_sample_width(2 if sound.sample_width == 1 else 4)
+
+    with instrumentation.stage(timings, "normalize"):
+        measured, copy_input, gain = normalize_in_memory(
+            sound,
+            copy_input,
+            active_normalize=active_normalize,
+            normalization_headroom=normalization_headroom,
+            fast_path_max_gain_change=fast_path_max_gain_change,
+            normalization_mode=normalization_mode,
+            loudness_target=loudness_target,
+            max_true_peak=max_true_peak,
+        )
+
+    pcm_fingerprint = None
+    if fingerprint_source == "pcm" and acoustid.have_chromaprint:
+        with instrumentation.stage(timings, "fingerprint"):
+            pcm_fingerprint = fingerprint_sound(sound, fingerprint_max_length)
+
+    normalized_rms = None
+    with instrumentation.stage(timings, "export"):
+        if copy_input:
+            export_result = copy_and_retag(
+                local_audio_path, audio_output_path, target_bitrate, tags
+            )
+        else:
+            # The gain is applied chunk by chunk on the way to the encoder, like
+            # the streamed path, rather than to a full copy of the samples.
+            with streaming.Encoder(
+                audio_output_path,
+                sound.frame_rate,
+                sound.channels,
+                sound.sample_width,
+                output_audio_format,
+                target_bitrate,
+                tags,
+            ) as encoder:
+                normalized_rms = encode_chunks(sample_chunks(sound), encoder, gain)
+            export_result = output_audio_format, target_bitrate, audio_output_path
+
+    normalization_meta = normalization_metadata(
+        normalization_mode,
+        measured,
+        gain,
+        normalized_rms,
+        loudness_target,
+        sound.max_possible_amplitude if sound is not None else None,
+    )
+    return normalization_meta, copy_input, export_result, pcm_fingerprint
+
+
+def normalize_in_memory(
+    sound,
+    copy_input,
+    active_normalize=False,
+    normalization_headroom=0.1,
+    fast_path_max_gain_change=DEFAULT_FAST_PATH_MAX_GAIN_CHANGE,
+    normalization_mode="peak",
+    loudness_target=loudness.DEFAULT_TARGET,
+    max_true_peak=loudness.DEFAULT_MAX_TRUE_PEAK,
+):
+    # Measures the sound and the gain normalizing it, the gain is applied
+    # while encoding. Inputs copied by the fast path keep their gain.
+    measured = None
+    gain = 0.0
+    if active_normalize and normalization_mode == "lufs":
+        measured = measure_loudness(sound)
+        gain = loudness.loudness_gain(*measured, loudness_target, max_true_peak)
+    elif active_normalize:
+        peak, measured = measure(samples_array(sound))
+        gain = peak_gain(peak, sound.max_possible_amplitude, normalization_headroom)
+    if active_normalize and copy_input:
+        copy_input = abs(gain) <= fast_path_max_gain_change
+    if copy_input:
+        gain = 0.0
+    return measured, copy_input, gain
+
+
+def normalization_metadata(
+    normalization_mode,
+    measured,
+    gain,
+    normalized_rms,
+    loudness_target,
+    max_possible_amplitude,
+):
+    # measured is the integrated loudness and true peak in lufs mode, the RMS
+    # in peak mode and None without normalization.
+    if measured is None:
+        return {}
+    if normalization_mode == "lufs":
+        original_lufs, true_peak = measured
+        return loudness_metadata(original_lufs, true_peak, gain, loudness_target)
+    original_dbfs = to_dbfs(measured, max_possible_amplitude)
+    normalized_dbfs = original_dbfs
+    if gain != 0:
+        normalized_dbfs = to_dbfs(normalized_rms, max_possible_amplitude)
+    return peak_metadata(
+        original_dbfs, normalized_dbfs, original_dbfs - normalized_dbfs
     )
@@ -0,0 +1,104 @@
+import threading
+import time
+
+# Requests per minute allowed by each provider. Discogs documents 60 requests per
+# minute for authenticated clients, Spotify does not publish a fixed limit and
+# answers 429 with a Retry-After header.
+DEFAULT_RATE_LIMITS = {"discogs": 60, "spotify": 180}
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 2.0
+MAX_BACKOFF = 120
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, burst=1):
+        self.rate = requests_per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Every caller reserves its token right away, going into debt if needed,
+        # and is told how long to wait: callers are served in arrival order.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, self.paused_until - now, 0)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        requests_per_minute,
+        burst=1,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff_factor=DEFAULT_BACKOFF_FACTOR,
+    ):
+        self.bucket = TokenBucket(requests_per_minute, burst)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.requests = 0
+        self.retries = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0
+        self.max_wait = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.wait_for_token()
+            try:
+                return func(*args, **kwargs)
+            except RateLimitExceeded as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                delay = e.retry_after
+                if delay is None:
+                    delay = min(MAX_BACKOFF, self.backoff_factor * 2 ** (attempt - 1))
+                # The provider asked everyone to slow down, not only this request.
+                self.bucket.pause(delay)
+
+    def wait_for_token(self):
+        wait = self.bucket.reserve()
+        with self._lock:
+            self.requests += 1
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        if wait > 0:
+            time.sleep(wait)
+        with self._lock:
+            self.queue_depth -= 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+            }
@@ -0,0 +1,133 @@
+import json
+import os
+import time
+
+SLOWEST_FILES = 10
+
+
+def file_size(path):
+    if path is None or not os.path.exists(path):
+        return None
+    return os.path.getsize(path)
+
+
+class ProgressStream:
+    # JSON-lines events flushed as soon as they happen, so that an orchestrator
+    # tailing the stream can follow the run. Without a file it does nothing.
+    def __init__(self, f=None):
+        self.f = f
+
+    def emit(self, event, **fields):
+        if self.f is None:
+            return
+        self.f.write(
+            json.dumps({"event": event, "time": round(time.time(), 3), **fields}) + "\n"
+        )
+        self.f.flush()
+
+
+class RunReport:
+    # Collects a record per file from the outcomes of the run and builds the
+    # final summary out of them.
+    def __init__(self, progress=None):
+        self.progress = progress if progress is not None else ProgressStream()
+        self.start_time = time.time()
+        self.files = []
+        self.skipped = 0
+        self.progress.emit("run_started")
+
+    def file_started(self, local_file_path):
+        self.progress.emit(
+            "file_started",
+            file=local_file_path,
+            bytes_in=file_size(local_file_path),
+        )
+
+    def file_skipped(self, local_file_path):
+        self.skipped += 1
+        self.progress.emit("file_skipped", file=local_file_path)
+
+    def file_finished(self, local_file_path, outcome):
+        results = outcome["results"]
+        record = {
+            "file": local_file_path,
+            "status": "failed" if outcome["error"] is not None else "succeeded",
+            "duplicate_of": None,
+            "duration": round(outcome["process_time"], 3),
+            "error": outcome["error"],
+            "validation_errors": [],
+            "bytes_in": file_size(local_file_path),
+            "bytes_out": None,
+            "stages": {},
+        }
+        if results is not None:
+            if results.get("duplicate_of") is not None:
+                record["status"] = "duplicate"
+                record["duplicate_of"] = results["duplicate_of"]["path"]
+            if results.get("rejected", False):
+                record["status"] = "rejected"
+            record["validation_errors"] = results.get("validation_errors", [])
+            record["bytes_out"] = file_size(results["output_file_path"])
+            record["stages"] = {
+                name: stage["wall"] for name, stage in results["timings"].items()
+            }
+        self.files.append(record)
+        self.progress.emit(
+            "file_finished",
+            processed=len(self.files),
+            elapsed=round(time.time() - self.start_time, 3),
+            **record,
+        )
+        return record
+
+    def summary(self):
+        duration = time.time() - self.start_time
+        failed = [r for r in self.files if r["status"] == "failed"]
+        duplicates = [r for r in self.files if r["status"] == "duplicate"]
+        rejected = [r for r in self.files if r["status"] == "rejected"]
+        succeeded = [r for r in self.files if r["status"] == "succeeded"]
+        bytes_in = sum(r["bytes_in"] or 0 for r in self.files)
+        bytes_out = sum(r["bytes_out"] or 0 for r in succeeded)
+        slowest = sorted(self.files, key=lambda r: r["duration"], reverse=True)
+        slowest = slowest[:SLOWEST_FILES]
+        return {
+            "duration": round(duration, 3),
+            "totals": {
+                "processed": len(self.files),
+                "succeeded": len(succeeded),
+                "failed": len(failed),
+                "duplicates": len(duplicates),
+                "rejected": len(rejected),
+                "with_validation_errors": sum(
+                    1 for r in succeeded if r["validation_errors"]
+                ),
+                "skipped": self.skipped,
+                "bytes_in": bytes_in,
+                "bytes_out": bytes_out,
+            },
+            "throughput": {
+                "files_per_minute": (
+                    round(len(self.files) / duration * 60, 2) if duration > 0 else None
+                ),
+                "input_mb_per_second": (
+                    round(bytes_in / 1024**2 / duration, 3) if duration > 0 else None
+                ),
+            },
+            "failures": [{"file": r["file"], "error": r["error"]} for r in failed],
+            "slowest_files": [
+                {"file": r["file"], "duration": r["duration"]} for r in slowest
+            ],
+        }
+
+    def finish(self, stages=None):
+        # Emits and returns the summary, with the aggregated stage timings
+        # when given.
+        summary = self.summary()
+        if stages is not None:
+            summary["stages"] = stages
+        self.progress.emit("run_finished", **summary)
+        return summary
+
+    def save(self, path, summary):
+        with open(path, "w") as f:
+            json.dump(dict(summary, files=self.files), f, indent=2)
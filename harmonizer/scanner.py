@@ -0,0 +1,44 @@
+import os
+
+from harmonizer import config
+
+
+def extensions_for(mime_types):
+    return {
+        ext
+        for mime_type in mime_types
+        for ext in config.MIME_TYPES_EXTENSIONS[mime_type]
+    }
+
+
+def scan(root, extensions, excluded_dirs=()):
+    # Walks the tree lazily with os.scandir: files are yielded as soon as their
+    # directory is listed, so processing can start right away on huge trees.
+    excluded_dirs = {os.path.realpath(d) for d in excluded_dirs}
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                # Output directories nested in the input tree are not rescanned.
+                if os.path.realpath(entry.path) not in excluded_dirs:
+                    subdirectories.append(entry.path)
+            elif (
+                entry.is_file()
+                and os.path.splitext(entry.name)[1].lower() in extensions
+            ):
+                yield entry.path
+        directories.extend(reversed(subdirectories))
+
+
+def mirror_dir(output_dir, root, local_file_path):
+    relative_dir = os.path.relpath(os.path.dirname(local_file_path), root)
+    mirrored_dir = os.path.normpath(os.path.join(output_dir, relative_dir))
+    os.makedirs(mirrored_dir, exist_ok=True)
+    return mirrored_dir
@@ -0,0 +1,223 @@
+import subprocess
+import tempfile
+
+import numpy as np
+import pydub.utils
+
+DEFAULT_MIN_DURATION = 1200
+SAMPLE_FORMATS = {2: "s16le", 4: "s32le"}
+SAMPLE_DTYPES = {2: np.int16, 4: np.int32}
+# Codecs decoded to float by ffmpeg, pydub decodes them to 16 bits.
+FLOAT_DECODED_CODECS = ["mp3", "mp4", "aac", "webm", "ogg"]
+
+
+class FFmpegError(Exception):
+    pass
+
+
+def stream_info(local_audio_path):
+    # Frame rate, channels, sample width and duration of the first audio
+    # stream, read by ffprobe without decoding anything.
+    info = pydub.utils.mediainfo_json(local_audio_path)
+    audio_streams = [s for s in info["streams"] if s["codec_type"] == "audio"]
+    if not audio_streams:
+        raise FFmpegError("No audio stream in {}".format(local_audio_path))
+    audio_stream = audio_streams[0]
+    if (
+        audio_stream.get("sample_fmt") == "fltp"
+        and audio_stream.get("codec_name") in FLOAT_DECODED_CODECS
+    ):
+        bits_per_sample = 16
+    else:
+        bits_per_sample = audio_stream.get("bits_per_sample") or 16
+    duration = audio_stream.get("duration") or info.get("format", {}).get("duration")
+    return {
+        "frame_rate": int(audio_stream["sample_rate"]),
+        "channels": int(audio_stream["channels"]),
+        "sample_width": 2 if bits_per_sample <= 16 else 4,
+        "duration": float(duration) if duration is not None else None,
+    }
+
+
+def use_streaming(streaming_mode, duration, min_duration=DEFAULT_MIN_DURATION):
+    if streaming_mode == "always":
+        return True
+    if streaming_mode == "auto":
+        return duration is not None and duration >= min_duration
+    return False
+
+
+def decode(local_audio_path, sample_width, channels, chunk_frames):
+    # Yields the decoded interleaved samples chunk_frames at a time, ffmpeg is
+    # killed if the caller stops iterating early.
+    sample_format = SAMPLE_FORMATS[sample_width]
+    command = [
+        pydub.utils.get_encoder_name(),
+        "-nostdin",
+        "-v",
+        "error",
+        "-i",
+        local_audio_path,
+        "-vn",
+        "-f",
+        sample_format,
+        "-acodec",
+        "pcm_" + sample_format,
+        "-",
+    ]
+    chunk_size = chunk_frames * channels * sample_width
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr
+        )
+        try:
+            while True:
+                data = process.stdout.read(chunk_size)
+                if not data:
+                    break
+                yield np.frombuffer(data, dtype=SAMPLE_DTYPES[sample_width])
+        except GeneratorExit:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise FFmpegError(
+                "Decoding {} failed: {}".format(
+                    local_audio_path, stderr.read().decode(errors="ignore")
+                )
+            )
+
+
+def probe_errors(local_audio_path):
+    # ffprobe only reads the headers and the first packets of the file, which
+    # catches truncated or corrupt files without decoding them.
+    command = [
+        pydub.utils.get_prober_name(),
+        "-v",
+        "error",
+        "-show_entries",
+        "stream=codec_type",
+        "-of",
+        "csv=p=0",
+        local_audio_path,
+    ]
+    completed = subprocess.run(
+        command, stdin=subprocess.DEVNULL, capture_output=True, text=True
+    )
+    errors = [line for line in completed.stderr.splitlines() if line.strip()]
+    if completed.returncode != 0 and not errors:
+        errors.append(f"ffprobe exited with code {completed.returncode}.")
+    if completed.returncode == 0 and "audio" not in completed.stdout.split():
+        errors.append("No audio stream found.")
+    return errors
+
+
+class Encoder:
+    # Encodes interleaved samples written chunk by chunk, tags are written by
+    # ffmpeg like pydub's export does.
+    def __init__(
+        self,
+        output_path,
+        frame_rate,
+        channels,
+        sample_width,
+        audio_format="mp3",
+        bitrate=192,
+        tags={},
+    ):
+        sample_format = SAMPLE_FORMATS[sample_width]
+        command = [
+            pydub.utils.get_encoder_name(),
+            "-nostdin",
+            "-v",
+            "error",
+            "-y",
+            "-f",
+            sample_format,
+            "-ar",
+            str(frame_rate),
+            "-ac",
+            str(channels),
+            "-i",
+            "-",
+            "-b:a",
+            str(bitrate) + "k",
+        ]
+        for key, value in tags.items():
+            command.extend(["-metadata", "{}={}".format(key, value)])
+        if audio_format == "mp3":
+            command.extend(["-id3v2_version", "4"])
+        command.extend(["-f", audio_format, output_path])
+        self.output_path = output_path
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self.stderr,
+        )
+
+    def write(self, samples):
+        try:
+            self.process.stdin.write(samples.tobytes())
+        except BrokenPipeError:
+            # ffmpeg died, its error is reported by close.
+            pass
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.stderr.seek(0)
+        error = self.stderr.read().decode(errors="ignore")
+        self.stderr.close()
+        if self.process.returncode != 0:
+            raise FFmpegError("Encoding {} failed: {}".format(self.output_path, error))
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        self.stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Spool:
+    # Temporary file holding decoded samples between the analysis and the
+    # encoding, so that a long track never has to fit in memory.
+    def __init__(self, sample_width, directory=None):
+        self.dtype = SAMPLE_DTYPES[sample_width]
+        self.file = tempfile.TemporaryFile(dir=directory)
+
+    def write(self, samples):
+        self.file.write(samples.tobytes())
+
+    def chunks(self, chunk_samples):
+        self.file.seek(0)
+        chunk_size = chunk_samples * np.dtype(self.dtype).itemsize
+        while True:
+            data = self.file.read(chunk_size)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=self.dtype)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
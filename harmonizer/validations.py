@@ -1,5 +1,14 @@
+import functools
+
+import numpy as np
 from titlecase import titlecase
 
+from harmonizer import instrumentation
+
+# Tags values repeat a lot across a library (artists, albums), their titlecase
+# is computed once.
+cached_titlecase = functools.lru_cache(maxsize=4096)(titlecase)
+
 
 class CannotValidate(Exception):
     pass
@@ -38,6 +47,12 @@ def check_bitrate(bitrate, minimum_bitrate):
     return is_valid, error
 
 
+def check_integrity(integrity_errors, integrity_check):
+    if not integrity_check:
+        return True, []
+    return len(integrity_errors) == 0, integrity_errors
+
+
 def check_enrichment_success(enrichments, expected_enrichments):
     missing_enrichments = []
     for k in expected_enrichments:
@@ -54,32 +69,64 @@ def check_capitalization(tags, tags_to_capitalize):
     errors = []
     for t in tags_to_capitalize:
         try:
-            assert tags.get(t) == titlecase(tags.get(t, ""))
+            assert tags.get(t) == cached_titlecase(tags.get(t, ""))
         except AssertionError:
             errors.append(t)
     return len(errors) == 0, errors
 
 
+# Batch filters return the indexes of the values which may be invalid, only
+# those are checked one by one.
+def filter_missing_tags(tags_list, mandatory_tags):
+    mandatory_tags = set(mandatory_tags)
+    return [i for i, tags in enumerate(tags_list) if not mandatory_tags <= tags.keys()]
+
+
+def filter_mime_types(mime_types, valid_mime_types):
+    # A library only has a handful of distinct mime types, they are checked
+    # once and the batch is only scanned again when one of them is invalid.
+    invalid_mime_types = set(mime_types) - set(valid_mime_types)
+    if not invalid_mime_types:
+        return []
+    return [i for i, m in enumerate(mime_types) if m in invalid_mime_types]
+
+
+def filter_bitrates(bitrates, minimum_bitrate):
+    bitrates = np.array(
+        [np.inf if b is None else b for b in bitrates], dtype=np.float64
+    )
+    return np.flatnonzero(bitrates < minimum_bitrate).tolist()
+
+
 AVAILABLE_VALIDATIONS = {
     "mandatory_tags": {
         "func": check_mandatory_tags,
         "object_to_check": "tags",
         "error_key": "missing_tags",
+        "batch_filter": filter_missing_tags,
     },
     "accepted_input_mime_types": {
         "func": check_mime_type,
         "object_to_check": "input_mime_type",
         "error_key": "invalid_input_mime_type",
+        "batch_filter": filter_mime_types,
     },
     "minimum_input_bitrate": {
         "func": check_bitrate,
         "object_to_check": "input_bitrate",
         "error_key": "low_input_bitrate",
+        "batch_filter": filter_bitrates,
     },
     "minimum_output_bitrate": {
         "func": check_bitrate,
         "object_to_check": "output_bitrate",
         "error_key": "low_output_bitrate",
+        "batch_filter": filter_bitrates,
+    },
+    "integrity_check": {
+        "func": check_integrity,
+        "object_to_check": "integrity_errors",
+        "error_key": "corrupt_input",
     },
     "required_enrichments": {
         "func": check_enrichment_success,
@@ -88,23 +135,98 @@ AVAILABLE_VALIDATIONS = {
     },
 }
 
-
-def validate(config, **kwargs):
-    validation_errors = {}
-    for validation in AVAILABLE_VALIDATIONS.keys():
-        if config.get(validation) is not None:
-            constraint = config.get(validation)
-            validation_func = AVAILABLE_VALIDATIONS[validation]["func"]
-            error_key = AVAILABLE_VALIDATIONS[validation]["error_key"]
-            object_to_check = AVAILABLE_VALIDATIONS[validation]["object_to_check"]
-            try:
-                is_valid, errors = validation_func(kwargs[object_to_check], constraint)
-                if not is_valid:
-                    validation_errors[error_key] = errors
-            except KeyError:
-                raise CannotValidate(
-                    f"Cannot validate {validation} because {object_to_check} was not provided to the validator."
-                )
-
-    global_valid = not bool(validation_errors)
-    return global_valid, validation_errors
+# Validations that only need probe data, they run before any decoding.
+PREFLIGHT_VALIDATIONS = [
+    "integrity_check",
+    "mandatory_tags",
+    "accepted_input_mime_types",
+    "minimum_input_bitrate",
+]
+
+
+def split_preflight(config):
+    preflight_config = {k: v for k, v in config.items() if k in PREFLIGHT_VALIDATIONS}
+    remaining_config = {
+        k: v for k, v in config.items() if k not in PREFLIGHT_VALIDATIONS
+    }
+    return preflight_config, remaining_config
+
+
+class ValidationPlan:
+    # The validations of a config, resolved once and applied to any number of
+    # files.
+    def __init__(self, config):
+        self.config = config
+        self.checks = [
+            (validation, AVAILABLE_VALIDATIONS[validation], config[validation])
+            for validation in AVAILABLE_VALIDATIONS.keys()
+            if config.get(validation) is not None
+        ]
+
+    def validate(self, timings=None, **kwargs):
+        validation_errors = {}
+        for validation, spec, constraint in self.checks:
+            value = self.object_to_check(validation, spec, kwargs)
+            with instrumentation.stage(timings, f"validation.{validation}"):
+                is_valid, errors = spec["func"](value, constraint)
+            if not is_valid:
+                validation_errors[spec["error_key"]] = errors
+
+        global_valid = not bool(validation_errors)
+        return global_valid, validation_errors
+
+    def validate_many(self, objects, timings=None):
+        # Validations run field by field over the whole batch. Returns the
+        # validity and the errors of every object, like validate.
+        objects = list(objects)
+        validation_errors = [{} for _ in objects]
+        for validation, spec, constraint in self.checks:
+            values = [self.object_to_check(validation, spec, o) for o in objects]
+            with instrumentation.stage(timings, f"validation.{validation}"):
+                batch_filter = spec.get("batch_filter")
+                if batch_filter is None:
+                    candidates = range(len(values))
+                else:
+                    candidates = batch_filter(values, constraint)
+                for i in candidates:
+                    is_valid, errors = spec["func"](values[i], constraint)
+                    if not is_valid:
+                        validation_errors[i][spec["error_key"]] = errors
+        return [(not bool(errors), errors) for errors in validation_errors]
+
+    @staticmethod
+    def object_to_check(validation, spec, objects):
+        try:
+            return objects[spec["object_to_check"]]
+        except KeyError:
+            raise CannotValidate(
+                f"Cannot validate {validation} because {spec['object_to_check']} was not provided to the validator."
+            )
+
+
+def validate(config, timings=None, **kwargs):
+    return ValidationPlan(config).validate(timings=timings, **kwargs)
+
+
+def compile_plans(config):
+    # Plans of the preflight validations and of the remaining ones, compiled
+    # once per run.
+    preflight_config, remaining_config = split_preflight(config)
+    return ValidationPlan(preflight_config), ValidationPlan(remaining_config)
+
+
+def result_objects(results):
+    # Objects to check of the JSON results of a file, to validate a catalog
+    # again after a rule change without reprocessing it.
+    manipulation_metadata = results["manipulation_metadata"]
+    return {
+        "tags": manipulation_metadata.get("tags", {}),
+        "input_mime_type": manipulation_metadata.get("mime_type"),
+        "input_bitrate": manipulation_metadata.get("original_bitrate"),
+        "output_bitrate": manipulation_metadata.get("export", {}).get("bitrate"),
+        "enrichments": results.get("enrichments_metadata", {}),
+        # The input is not read again, its integrity errors are kept.
+        "integrity_errors": results.get("validation_errors", {}).get(
+            "corrupt_input", []
+        ),
+    }
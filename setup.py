@@ -23,9 +23,8 @@ setup(
     author="Augustin Lafanechere",
     author_email="augustin.lafanechere@gmail.com",
     license="GPLv3+",
-    packages=find_packages(exclude=["tests*"]),
+    packages=find_packages(exclude=["tests*", "benchmarks*"]),
     install_requires=[
-        "eyeD3==0.8.10",
         "pydub==0.23.1",
         "pyacoustid==1.1.5",
         "mutagen==1.42.0",
@@ -36,10 +35,18 @@ setup(
         "pyyaml==5.1",
         "logme==1.3.2",
         "schema==0.7.0",
+        "numpy==1.16.4",
+        "scipy==1.3.0",
     ],
+    extras_require={"thumbnails": ["Pillow"]},
     setup_requires=["pytest-runner"],
-    tests_require=["pytest"],
+    tests_require=["pytest", "Pillow", "eyeD3==0.8.10"],
     include_package_data=True,
-    entry_points={"console_scripts": ["harmonizer=harmonizer.cli:harmonize_directory"]},
+    entry_points={
+        "console_scripts": [
+            "harmonizer=harmonizer.cli:harmonize_directory",
+            "harmonizer-audit=harmonizer.cli:audit_directory",
+        ]
+    },
     zip_safe=False,
 )
@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+
+from harmonizer import audit, validations
+
+PREFLIGHT_PLAN = validations.ValidationPlan(
+    {"minimum_input_bitrate": 128, "mandatory_tags": ["artist"]}
+)
+
+
+def test_audit_file():
+    record = audit.audit_file("tests/audio_samples/inputs/64k.mp3", PREFLIGHT_PLAN)
+    assert record["mime_type"] == "audio/mp3"
+    assert record["bitrate"] == 64
+    assert not record["valid"]
+    assert "low_input_bitrate" in record["validation_errors"]
+    assert record["error"] is None
+
+    record = audit.audit_file(
+        "tests/audio_samples/inputs/missing.mp3", validations.ValidationPlan({})
+    )
+    assert record["error"].startswith("FileNotFoundError")
+
+
+def test_audit_keeps_order():
+    paths = [
+        "tests/audio_samples/inputs/64k.mp3",
+        "tests/audio_samples/inputs/test2.mp3",
+        "tests/audio_samples/inputs/missing.mp3",
+    ] * 5
+    records = list(audit.audit(paths, PREFLIGHT_PLAN, workers=2))
+    assert [record["file"] for record in records] == paths
+
+
+def test_audit_writer():
+    record = audit.audit_file("tests/audio_samples/inputs/64k.mp3", PREFLIGHT_PLAN)
+    output = io.StringIO()
+    writer = audit.AuditWriter(output, "csv")
+    writer.write(record)
+    (row,) = csv.DictReader(io.StringIO(output.getvalue()))
+    assert json.loads(row["validation_errors"]) == record["validation_errors"]
+    assert writer.counts["invalid"] == 1
+    assert writer.counts["low_input_bitrate"] == 1
+
+    output = io.StringIO()
+    audit.AuditWriter(output).write(record)
+    assert json.loads(output.getvalue()) == record
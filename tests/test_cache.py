@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from harmonizer import cache, enrichments
+
+
+@pytest.fixture
+def enrichment_cache(tmpdir):
+    with cache.EnrichmentCache(str(tmpdir)) as c:
+        yield c
+
+
+@pytest.fixture
+def discogs_result():
+    return {"best_match": {"id": 31382}, "other_results": [{"id": 31382}]}
+
+
+def test_normalize_query():
+    assert (
+        cache.normalize_query(" Herbie  Hancock ", "THRUST") == "herbie hancock|thrust"
+    )
+    assert cache.normalize_query("Nujabes", None) == "nujabes|"
+
+
+def test_get_set(enrichment_cache, discogs_result):
+    assert enrichment_cache.get("discogs", "herbie hancock|thrust") is None
+    enrichment_cache.set("discogs", "herbie hancock|thrust", discogs_result)
+    assert enrichment_cache.get("discogs", "herbie hancock|thrust") == discogs_result
+    assert enrichment_cache.get("spotify", "herbie hancock|thrust") is None
+    assert enrichment_cache.stats() == {"hits": 1, "misses": 2}
+
+
+def test_persistence(tmpdir, discogs_result):
+    with cache.EnrichmentCache(str(tmpdir)) as c:
+        c.set("discogs", "herbie hancock|thrust", discogs_result)
+    with cache.EnrichmentCache(str(tmpdir)) as c:
+        assert c.get("discogs", "herbie hancock|thrust") == discogs_result
+
+
+def test_ttl(tmpdir, discogs_result):
+    with cache.EnrichmentCache(str(tmpdir), ttl_days=1) as c:
+        c.set("discogs", "herbie hancock|thrust", discogs_result)
+        c.ttl = -1
+        assert c.get("discogs", "herbie hancock|thrust") is None
+        c.evict()
+        assert len(c) == 0
+
+
+def test_size_eviction(tmpdir, discogs_result):
+    with cache.EnrichmentCache(str(tmpdir), max_entries=2) as c:
+        for query in ["a", "b"]:
+            c.set("discogs", query, discogs_result)
+            time.sleep(0.01)
+        c.get("discogs", "a")
+        time.sleep(0.01)
+        c.set("discogs", "c", discogs_result)
+        assert len(c) == 2
+        assert c.get("discogs", "b") is None
+        assert c.get("discogs", "a") == discogs_result
+
+
+def test_pipeline_uses_cache(monkeypatch, enrichment_cache, discogs_result):
+    calls = []
+
+    def discogs_enrich(artist, album, token, **kwargs):
+        calls.append((artist, album))
+        return discogs_result["best_match"], discogs_result["other_results"]
+
+    monkeypatch.setattr(enrichments, "discogs_enrich", discogs_enrich)
+    track_tags = {"title": "Butterfly", "artist": "Herbie Hancock", "album": "Thrust"}
+    for title in ["Butterfly", "Palm Grease", "Actual Proof"]:
+        results = enrichments.pipeline(
+            dict(track_tags, title=title),
+            ["discogs"],
+            discogs_token="xxx",
+            cache=enrichment_cache,
+        )
+        assert results["discogs"] == discogs_result
+    assert calls == [("Herbie Hancock", "Thrust")]
+    assert enrichment_cache.stats() == {"hits": 2, "misses": 1}
+
+
+def test_size_eviction_during_run(tmpdir, discogs_result):
+    with cache.EnrichmentCache(str(tmpdir), max_entries=10) as c:
+        for i in range(25):
+            c.set("discogs", f"query {i}", discogs_result)
+            assert len(c) <= 10
+        # A tenth of the entries are evicted at once, the latest are kept.
+        assert c.get("discogs", "query 24") == discogs_result
+        c.set("discogs", "query 24", discogs_result)
+        assert len(c) <= 10
@@ -0,0 +1,216 @@
+import logging
+
+import numpy as np
+import pytest
+
+from harmonizer import cli, covers, enrichments, fingerprints, manipulations
+
+
+@pytest.fixture
+def parsed_config():
+    return {"output_bitrate": 192, "normalization_headroom": 0.1, "enrichments": {}}
+
+
+@pytest.fixture
+def harmonize_args(tmpdir, parsed_config):
+    return (str(tmpdir), str(tmpdir), str(tmpdir), parsed_config)
+
+
+@pytest.fixture
+def manipulated(tmpdir):
+    return {
+        "local_file_path": "tests/audio_samples/inputs/test1.mp3",
+        "output_file_path": str(tmpdir.join("test1.mp3")),
+        "manipulation_metadata": {
+            "tags": {"artist": "Herbie Hancock", "album": "Thrust"},
+            "export": {"audio_format": "mp3", "bitrate": 192},
+        },
+    }
+
+
+def test_run_safely_catches_errors(harmonize_args):
+    outcome = cli.run_safely(
+        cli.harmonize_file, "tests/audio_samples/inputs/missing.mp3", *harmonize_args
+    )
+    assert outcome["results"] is None
+    assert outcome["error"] is not None
+    assert outcome["process_time"] >= 0
+
+
+def test_run_in_pool_keeps_order(tmpdir, parsed_config):
+    jobs = [
+        cli.file_job(
+            f"tests/audio_samples/inputs/missing_{i}.mp3",
+            "tests/audio_samples/inputs",
+            str(tmpdir),
+            str(tmpdir),
+            str(tmpdir),
+        )
+        for i in range(5)
+    ]
+    outcomes = list(cli.run_in_pool(cli.manipulate_job, jobs, (parsed_config,), 2))
+    assert [job for job, _ in outcomes] == jobs
+    assert all(outcome["error"] is not None for _, outcome in outcomes)
+
+
+def test_enrich_and_finalize(monkeypatch, tmpdir, parsed_config, manipulated):
+    monkeypatch.setattr(
+        enrichments,
+        "discogs_enrich",
+        lambda artist, album, token, **kwargs: ({"id": 1}, []),
+    )
+    jobs = [{"json_output_dir": str(tmpdir)}, {"json_output_dir": str(tmpdir)}]
+    manipulated_outcomes = [
+        (jobs[0], {"results": manipulated, "error": None, "process_time": 1}),
+        (jobs[1], {"results": None, "error": "Boom", "process_time": 0}),
+    ]
+    with enrichments.EnrichmentStage(["discogs"], discogs_token="xxx") as stage:
+        outcomes = list(
+            cli.enrich_and_finalize(manipulated_outcomes, stage, parsed_config)
+        )
+    assert [job for job, _ in outcomes] == jobs
+    results = outcomes[0][1]["results"]
+    assert results["enrichments_metadata"]["discogs"]["best_match"] == {"id": 1}
+    assert "enrichment.discogs" in results["timings"]
+    assert tmpdir.join("test1.json").check()
+    assert outcomes[1][1]["error"] == "Boom"
+
+
+def test_resumed_job_is_not_manipulated_again(parsed_config, manipulated):
+    job = {"local_file_path": "tests/audio_samples/inputs/missing.mp3"}
+    job["manipulated"] = manipulated
+    assert cli.manipulate_job(job, parsed_config) is manipulated
+
+
+def test_failed_enrichment_stage(monkeypatch, tmpdir, parsed_config, manipulated):
+    def banned(artist, album, token, **kwargs):
+        raise enrichments.TooMuchRequests("Banned")
+
+    monkeypatch.setattr(enrichments, "discogs_enrich", banned)
+    job = {"json_output_dir": str(tmpdir)}
+    with enrichments.EnrichmentStage(["discogs"], discogs_token="xxx") as stage:
+        ((_, outcome),) = cli.enrich_and_finalize(
+            [(job, {"results": manipulated, "error": None, "process_time": 1})],
+            stage,
+            parsed_config,
+        )
+    assert outcome["failed_stage"] == "enrichment"
+    assert not tmpdir.join("test1.json").check()
+
+
+def test_duplicates_are_not_transcoded(monkeypatch, tmpdir, parsed_config):
+    fingerprint = fingerprints.encode(np.arange(1000, dtype=np.uint32) * 7919)
+    monkeypatch.setattr(
+        manipulations, "fingerprint", lambda path, max_length: (180, fingerprint)
+    )
+    monkeypatch.setattr(fingerprints, "_shared_indexes", {})
+    parsed_config["fingerprint_index"] = {
+        "directory": str(tmpdir.join("index")),
+        "skip_duplicates": True,
+    }
+    cli.open_fingerprint_index(parsed_config).add("original.flac", fingerprint, 180)
+
+    manipulated = cli.manipulate_file(
+        "tests/audio_samples/inputs/test1.mp3", str(tmpdir), str(tmpdir), parsed_config
+    )
+    assert manipulated["duplicate_of"]["path"].endswith("original.flac")
+    assert manipulated["output_file_path"] is None
+    assert not tmpdir.join("test1.mp3").check()
+    cli.open_fingerprint_index(parsed_config).close()
+
+
+def test_duplicates_within_a_run(monkeypatch, tmpdir, parsed_config):
+    # Workers do not see the files transcoded by the others in the same run.
+    fingerprint = fingerprints.encode(np.arange(1000, dtype=np.uint32) * 7919)
+    monkeypatch.setattr(fingerprints, "_shared_indexes", {})
+    parsed_config["fingerprint_index"] = {
+        "directory": str(tmpdir.join("index")),
+        "skip_duplicates": True,
+    }
+    manipulated_outcomes = []
+    for name in ["first", "second"]:
+        tmpdir.join(f"{name}.mp3").write_binary(b"")
+        manipulated = {
+            "local_file_path": f"{name}.flac",
+            "output_file_path": str(tmpdir.join(f"{name}.mp3")),
+            "manipulation_metadata": {
+                "fingerprinting": {"duration": 180, "fingerprint": fingerprint}
+            },
+        }
+        manipulated_outcomes.append(
+            ({}, {"results": manipulated, "error": None, "process_time": 1})
+        )
+
+    (_, first), (_, second) = cli.deduplicated(manipulated_outcomes, parsed_config)
+    assert first["results"].get("duplicate_of") is None
+    assert tmpdir.join("first.mp3").check()
+    assert second["results"]["duplicate_of"]["path"].endswith("first.flac")
+    assert cli.is_skipped(second["results"])
+    assert not tmpdir.join("second.mp3").check()
+    cli.open_fingerprint_index(parsed_config).close()
+
+
+def test_preflight_rejects_before_transcoding(tmpdir, parsed_config):
+    parsed_config["validations"] = {"minimum_input_bitrate": 192, "preflight": "reject"}
+    manipulated = cli.manipulate_file(
+        "tests/audio_samples/inputs/64k.mp3", str(tmpdir), str(tmpdir), parsed_config
+    )
+    assert manipulated["rejected"]
+    assert "low_input_bitrate" in manipulated["validation_errors"]
+    assert manipulated["output_file_path"] is None
+    assert not tmpdir.join("64k.mp3").check()
+
+
+def test_preflight_integrity_check(tmpdir, parsed_config):
+    broken = tmpdir.join("broken.mp3")
+    broken.write_binary(b"\x00" * 4096)
+    parsed_config["validations"] = {
+        "mandatory_tags": ["artist"],
+        "integrity_check": True,
+        "preflight": "reject",
+    }
+    manipulated = cli.manipulate_file(
+        str(broken), str(tmpdir), str(tmpdir), parsed_config
+    )
+    assert manipulated["rejected"]
+    assert manipulated["validation_errors"]["corrupt_input"]
+
+
+def test_thumbnails_require_pillow(monkeypatch, tmpdir):
+    conf = tmpdir.join("conf.yml")
+    conf.write(
+        "output_bitrate: 192\n"
+        "normalization_headroom: 0.1\n"
+        "cover_art:\n"
+        "  thumbnail_sizes: [250]\n"
+    )
+    logger = logging.getLogger("test")
+    assert cli.load_config(str(conf), logger)["cover_art"]["thumbnail_sizes"] == [250]
+    monkeypatch.setattr(covers, "Image", None)
+    with pytest.raises(SystemExit):
+        cli.load_config(str(conf), logger)
+
+
+def test_stale_partial_output_is_removed(tmpdir, parsed_config):
+    partial = tmpdir.join(".partial-64k.mp3")
+    partial.write_binary(b"\x00" * 4096)
+    parsed_config["validations"] = {"minimum_input_bitrate": 192, "preflight": "reject"}
+    cli.manipulate_file(
+        "tests/audio_samples/inputs/64k.mp3", str(tmpdir), str(tmpdir), parsed_config
+    )
+    assert not partial.check()
+
+
+def test_normalization_mode_none(monkeypatch, tmpdir, parsed_config):
+    pipeline_kwargs = {}
+
+    def pipeline(local_file_path, output_file_path, image_output_dir, **kwargs):
+        pipeline_kwargs.update(kwargs)
+        return {}, output_file_path, None
+
+    monkeypatch.setattr(manipulations, "pipeline", pipeline)
+    parsed_config["normalization"] = {"mode": "none"}
+    cli.manipulate_file(
+        "tests/audio_samples/inputs/test1.mp3", str(tmpdir), str(tmpdir), parsed_config
+    )
+    assert not pipeline_kwargs["active_normalize"]
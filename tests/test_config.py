@@ -283,3 +283,108 @@ def test_invalid_min_bitrate(invalid_min_max_bitrate):
     with pytest.raises(schema.SchemaError) as excinfo:
         config.parse(invalid_min_max_bitrate)
     assert "The minimum_input_bitrate is not 320, 192 or 128" in str(excinfo.value)
+
+
+def test_enrichment_cache_config(valid_config):
+    valid_config["enrichment_cache"] = {"directory": "/tmp/harmonizer", "ttl_days": 7}
+    parsed_config = config.parse(valid_config)
+    assert parsed_config["enrichment_cache"]["ttl_days"] == 7
+
+    valid_config["enrichment_cache"]["max_entries"] = 0
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "Cache max_entries must be a positive integer." in str(excinfo.value)
+
+
+def test_rate_limits_config(valid_config):
+    valid_config["rate_limits"] = {"discogs": 25}
+    parsed_config = config.parse(valid_config)
+    assert parsed_config["rate_limits"] == {"discogs": 25}
+
+    valid_config["rate_limits"] = {"discogs": -1}
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "Rate limits must be a positive number" in str(excinfo.value)
+
+    valid_config["rate_limits"] = {"deezer": 60}
+    with pytest.raises(schema.SchemaError):
+        config.parse(valid_config)
+
+
+def test_fingerprinting_config(valid_config):
+    valid_config["fingerprinting"] = {"source": "pcm", "max_length": 30}
+    parsed_config = config.parse(valid_config)
+    assert parsed_config["fingerprinting"] == {"source": "pcm", "max_length": 30}
+
+    valid_config["fingerprinting"] = {"source": "audio"}
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "Fingerprinting source must be file or pcm." in str(excinfo.value)
+
+
+def test_normalization_config(valid_config):
+    valid_config["normalization"] = {
+        "mode": "lufs",
+        "target": -16,
+        "max_true_peak": -1.5,
+    }
+    parsed_config = config.parse(valid_config)
+    assert parsed_config["normalization"]["mode"] == "lufs"
+
+    valid_config["normalization"] = {"mode": "none"}
+    assert config.parse(valid_config)["normalization"]["mode"] == "none"
+
+    valid_config["normalization"] = {"mode": "rms"}
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "Normalization mode must be peak, lufs or none." in str(excinfo.value)
+
+    valid_config["normalization"] = {"mode": "lufs", "target": 3}
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "Loudness target must be between -70 and 0 LUFS." in str(excinfo.value)
+
+
+def test_streaming_config(valid_config):
+    valid_config["streaming"] = {"mode": "auto", "min_duration": 600}
+    parsed_config = config.parse(valid_config)
+    assert parsed_config["streaming"] == {"mode": "auto", "min_duration": 600}
+
+    valid_config["streaming"] = {"mode": "sometimes"}
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "Streaming mode must be auto, always or never." in str(excinfo.value)
+
+    valid_config["streaming"] = {"mode": "never", "two_pass": True}
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "two_pass requires the auto or always streaming mode" in str(excinfo.value)
+
+
+def test_fingerprint_index_config(valid_config):
+    valid_config["fingerprint_index"] = {
+        "directory": "~/.harmonizer/fingerprints",
+        "skip_duplicates": True,
+        "duplicate_similarity": 0.95,
+    }
+    assert config.parse(valid_config)["fingerprint_index"]["skip_duplicates"]
+
+    valid_config["fingerprint_index"]["near_duplicate_similarity"] = 1.5
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "near_duplicate_similarity must be between 0 and 1" in str(excinfo.value)
+
+    valid_config["fingerprint_index"]["near_duplicate_similarity"] = 1
+    valid_config["fingerprint_index"]["duplicate_similarity"] = 1
+    assert config.parse(valid_config)["fingerprint_index"]["near_duplicate_similarity"]
+
+    valid_config["fingerprint_index"]["duplicate_similarity"] = 0.8
+    with pytest.raises(schema.SchemaError) as excinfo:
+        config.parse(valid_config)
+    assert "must not be above duplicate_similarity" in str(excinfo.value)
+
+    # Compared with the default duplicate_similarity when it is not set.
+    del valid_config["fingerprint_index"]["duplicate_similarity"]
+    valid_config["fingerprint_index"]["near_duplicate_similarity"] = 0.95
+    with pytest.raises(schema.SchemaError):
+        config.parse(valid_config)
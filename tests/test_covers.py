@@ -0,0 +1,38 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from harmonizer import covers
+
+
+@pytest.fixture
+def cover_art():
+    output = io.BytesIO()
+    Image.new("RGB", (1000, 800), "orange").save(output, "JPEG")
+    return {"data": output.getvalue(), "mime_type": "image/jpeg"}
+
+
+def test_store_writes_once(tmpdir, cover_art):
+    first = covers.store(cover_art, str(tmpdir))
+    second = covers.store(dict(cover_art), str(tmpdir))
+    assert first == second
+    assert first["path"] == str(tmpdir.join(first["sha256"] + ".jpeg"))
+    assert len(tmpdir.listdir()) == 1
+
+    other = covers.store({"data": b"png", "mime_type": "image/png"}, str(tmpdir))
+    assert other["path"].endswith(".png")
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_store_thumbnails(tmpdir, cover_art):
+    stored = covers.store(cover_art, str(tmpdir), thumbnail_sizes=[250, 500])
+    with Image.open(stored["thumbnails"]["250"]) as image:
+        assert image.size == (250, 200)
+    modified = os.path.getmtime(stored["thumbnails"]["500"])
+    assert covers.store(cover_art, str(tmpdir), [500])["thumbnails"]["500"]
+    assert os.path.getmtime(stored["thumbnails"]["500"]) == modified
+
+    broken = {"data": b"fake jpeg", "mime_type": "image/jpeg"}
+    assert covers.store(broken, str(tmpdir), [250])["thumbnails"] == {}
@@ -1,8 +1,9 @@
 import os
+import threading
 import time
 import pytest
 
-from harmonizer import enrichments
+from harmonizer import cache, clients, enrichments, ratelimit
 
 
 @pytest.fixture
@@ -191,3 +192,212 @@ def test_enrichment_pipeline_insufficient_tags(
         track_tags, enrichments=["discogs"], discogs_token=discogs_token
     )
     assert "discogs" in results
+
+
+@pytest.fixture
+def local_apis(monkeypatch):
+    in_flight = {"discogs": 0, "spotify": 0}
+    max_in_flight = {"discogs": 0, "spotify": 0}
+    lock = threading.Lock()
+
+    def stand_in(provider, best_match):
+        with lock:
+            in_flight[provider] += 1
+            max_in_flight[provider] = max(max_in_flight[provider], in_flight[provider])
+        time.sleep(0.05)
+        with lock:
+            in_flight[provider] -= 1
+        return best_match, [best_match]
+
+    def spotify_search(sp, query):
+        best_match, _ = stand_in("spotify", {"query": query})
+        return {"tracks": {"items": [best_match]}}
+
+    monkeypatch.setattr(
+        enrichments,
+        "discogs_enrich",
+        lambda artist, album, token, **kwargs: stand_in("discogs", {"album": album}),
+    )
+    monkeypatch.setattr(enrichments, "spotify_search", spotify_search)
+    return max_in_flight
+
+
+def test_enrichment_stage(test_tracks, all_creds, local_apis):
+    all_creds = {k: "xxx" for k in all_creds}
+    with enrichments.EnrichmentStage(
+        ["discogs", "spotify"], max_in_flight=2, **all_creds
+    ) as stage:
+        jobs = [stage.submit(t) for t in test_tracks + test_tracks[:1]]
+        results = [enrichments.collect(job) for job in jobs]
+    for track, result in zip(test_tracks, results):
+        assert result["discogs"]["best_match"] == {"album": track["album"]}
+        # The most precise search is used, the fallback one is sent with it.
+        assert result["spotify"]["best_match"] == {
+            "query": enrichments.spotify_queries(
+                track["title"], track["artist"], track["album"]
+            )[0]
+        }
+    assert results[-1] == results[0]
+    assert len(stage.spotify_searches) == 2 * len(test_tracks)
+    assert local_apis == {"discogs": 2, "spotify": 2}
+
+
+def test_enrichment_stage_errors(test_tracks):
+    with pytest.raises(enrichments.UnavailableEnrichment):
+        enrichments.EnrichmentStage(["youtube"])
+
+    with enrichments.EnrichmentStage(["discogs"]) as stage:
+        job = stage.submit(test_tracks[0])
+        with pytest.raises(enrichments.MissingCredentials):
+            enrichments.collect(job)
+
+
+class FakeResponse:
+    content = b'{"results": [], "pagination": {"pages": 0, "items": 0}}'
+    status_code = 200
+
+
+class FakeSession:
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs["params"]))
+        return FakeResponse()
+
+    def close(self):
+        pass
+
+
+def test_client_registry_reuses_clients():
+    with clients.ClientRegistry() as registry:
+        discogs_client = registry.discogs("xxx")
+        assert registry.discogs("xxx") is discogs_client
+        assert registry.discogs("yyy") is not discogs_client
+
+        spotify_client = registry.spotify("id", "secret")
+        assert registry.spotify("id", "secret") is spotify_client
+        assert spotify_client._session is registry.session("spotify")
+
+
+def test_discogs_enrich_with_shared_client():
+    session = FakeSession()
+    client = clients.discogs_client("xxx", session=session)
+    for _ in range(2):
+        match, results = enrichments.discogs_enrich(
+            "Guy Hemaire", "Le Patron", "xxx", client=client
+        )
+        assert match is None
+        assert results == []
+    assert len(session.requests) == 2
+    assert all(params == {"token": "xxx"} for _, _, params in session.requests)
+
+
+class RateLimitedSession(FakeSession):
+    def request(self, method, url, **kwargs):
+        super().request(method, url, **kwargs)
+        if len(self.requests) == 1:
+            response = FakeResponse()
+            response.content = b'{"message": "You are making requests too quickly."}'
+            response.status_code = 429
+            return response
+        return FakeResponse()
+
+
+def test_discogs_enrich_retries_when_rate_limited():
+    session = RateLimitedSession()
+    client = clients.discogs_client("xxx", session=session)
+    with pytest.raises(enrichments.TooMuchRequests):
+        enrichments.discogs_enrich("Guy Hemaire", "Le Patron", "xxx", client=client)
+
+    scheduler = ratelimit.RequestScheduler(6000, backoff_factor=0.01)
+    session.requests = []
+    match, results = enrichments.discogs_enrich(
+        "Guy Hemaire", "Le Patron", "xxx", client=client, scheduler=scheduler
+    )
+    assert match is None
+    assert len(session.requests) == 2
+    assert scheduler.stats()["retries"] == 1
+
+
+def test_batch_enrich_spotify(monkeypatch, test_tracks):
+    queries = []
+    lock = threading.Lock()
+
+    def search(sp, query):
+        with lock:
+            queries.append(query)
+        # Only the fallback query finds Nujabes.
+        if "nujabes" in query and "album:" in query:
+            return {"tracks": {"items": []}}
+        return {"tracks": {"items": [{"query": query}]}}
+
+    monkeypatch.setattr(enrichments, "spotify_search", search)
+    tracks = test_tracks + [test_tracks[0], {"artist": "Missing title"}]
+    results = enrichments.batch_enrich(
+        "spotify", tracks, sp_client_id="xxx", sp_client_secret="xxx"
+    )
+    assert len(results) == len(tracks)
+    assert results[0]["best_match"]["query"].startswith("album:thrust")
+    assert results[3]["best_match"]["query"] == "artist:nujabes track:feather "
+    assert results[4] == results[0]
+    assert results[5] is None
+    # Both queries of each distinct track, the duplicate track is not searched.
+    assert len(queries) == len(set(queries)) == 8
+
+    with pytest.raises(enrichments.MissingCredentials):
+        enrichments.batch_enrich("spotify", tracks)
+
+
+def test_enrichment_stage_resolves_albums_once(monkeypatch):
+    lookups = []
+
+    def discogs_enrich(artist, album, token, **kwargs):
+        lookups.append((artist, album))
+        time.sleep(0.05)
+        return {"id": 1, "title": album}, [{"id": 1}]
+
+    monkeypatch.setattr(enrichments, "discogs_enrich", discogs_enrich)
+    monkeypatch.setattr(
+        enrichments,
+        "discogs_tracklist",
+        lambda release_id, token, **kwargs: [
+            {"position": "A1", "title": "Palm Grease", "duration": "10:38"},
+            {"position": "A2", "title": "Actual Proof", "duration": "9:42"},
+        ],
+    )
+    tracks = [
+        {"artist": "Herbie Hancock", "album": "Thrust", "title": "Actual Proof"},
+        {"artist": "herbie hancock", "album": "Thrust", "tracknumber": "1/4"},
+        {"artist": "Nujabes", "album": "Modal Soul", "title": "Feather"},
+    ]
+    with enrichments.EnrichmentStage(
+        ["discogs"], match_tracklist=True, discogs_token="xxx"
+    ) as stage:
+        jobs = [stage.submit(t) for t in tracks]
+        results = [enrichments.collect(job)["discogs"] for job in jobs]
+    assert lookups == [("Herbie Hancock", "Thrust"), ("Nujabes", "Modal Soul")]
+    assert results[0]["best_match"] == results[1]["best_match"]
+    assert results[0]["track"]["position"] == "A2"
+    assert results[1]["track"]["position"] == "A1"
+
+    results = enrichments.batch_enrich("discogs", tracks, discogs_token="xxx")
+    assert len(lookups) == 4
+    assert "track" not in results[0]
+
+
+def test_discogs_tracklist_cache(monkeypatch, tmpdir):
+    fetched = []
+
+    def release_tracklist(client, release_id):
+        fetched.append(release_id)
+        return [{"position": "A1", "title": "Palm Grease", "duration": "10:38"}]
+
+    monkeypatch.setattr(enrichments, "discogs_release_tracklist", release_tracklist)
+    with cache.EnrichmentCache(str(tmpdir)) as enrichment_cache:
+        for _ in range(2):
+            tracklist = enrichments.discogs_tracklist(
+                1, "xxx", client=object(), cache=enrichment_cache
+            )
+            assert tracklist[0]["position"] == "A1"
+    assert fetched == [1]
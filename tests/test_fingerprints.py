@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from harmonizer import fingerprints
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def track(rng):
+    return rng.integers(0, 2**32, 1000, dtype=np.uint64).astype(np.uint32)
+
+
+def noisy_copy(rng, values, shift, bit_error_rate):
+    # Another rip of the same audio: shifted, with some flipped bits.
+    copy = values[shift:].copy()
+    flips = rng.random((len(copy), 32)) < bit_error_rate
+    copy ^= (
+        (flips * (1 << np.arange(32, dtype=np.uint64))).sum(axis=1).astype(np.uint32)
+    )
+    return copy
+
+
+@pytest.mark.parametrize("length", [0, 1, 7, 1000])
+def test_encode_decode(rng, length):
+    values = rng.integers(0, 2**32, length, dtype=np.uint64).astype(np.uint32)
+    assert (fingerprints.decode(fingerprints.encode(values)) == values).all()
+
+
+def test_decode_invalid():
+    with pytest.raises(fingerprints.InvalidFingerprint):
+        fingerprints.decode("AQ")
+    truncated = fingerprints.encode(np.arange(100, dtype=np.uint32))[:40]
+    with pytest.raises(fingerprints.InvalidFingerprint):
+        fingerprints.decode(truncated)
+
+
+def test_similarity(rng, track):
+    assert fingerprints.similarity(track, track) == 1
+    copy = noisy_copy(rng, track, 5, 0.05)
+    assert fingerprints.similarity(copy, track) > 0.9
+    other = rng.integers(0, 2**32, 1000, dtype=np.uint64).astype(np.uint32)
+    assert fingerprints.similarity(other, track) < 0.6
+
+
+def test_index_query(tmpdir, rng, track):
+    with fingerprints.FingerprintIndex(str(tmpdir)) as index:
+        index.add("original.mp3", fingerprints.encode(track), 180)
+        for i in range(20):
+            other = rng.integers(0, 2**32, 1000, dtype=np.uint64).astype(np.uint32)
+            index.add(f"other_{i}.mp3", fingerprints.encode(other), 180)
+        copy = fingerprints.encode(noisy_copy(rng, track, 3, 0.05))
+
+        (match,) = index.query(copy, 181)
+        assert match["path"].endswith("original.mp3")
+        assert match["duplicate"]
+        # A different edit of the same song is only a near-duplicate.
+        assert not index.query(copy, 240)[0]["duplicate"]
+        assert index.find_duplicate(copy, 240) is None
+        assert index.query(copy, exclude_path="original.mp3") == []
+
+    # Persisted and memory-mapped once saved.
+    index = fingerprints.FingerprintIndex(str(tmpdir))
+    assert len(index) == 21
+    assert len(index.keys) > 0
+    assert index.find_duplicate(copy, 181)["path"].endswith("original.mp3")
+    index.close()
+
+
+def test_index_add_same_path(tmpdir, rng, track):
+    other = rng.integers(0, 2**32, 1000, dtype=np.uint64).astype(np.uint32)
+    with fingerprints.FingerprintIndex(str(tmpdir)) as index:
+        index.add("track.mp3", fingerprints.encode(track), 180)
+        index.save()
+        postings = len(index.keys)
+        candidates = index.candidates(track)
+
+        # Re-adding the path replaces its postings, pending or saved.
+        index.add("track.mp3", fingerprints.encode(track), 180)
+        index.add("track.mp3", fingerprints.encode(track), 180)
+        assert index.candidates(track) == candidates
+        index.save()
+        assert len(index.keys) == postings
+        assert index.candidates(track) == candidates
+
+        index.add("track.mp3", fingerprints.encode(other), 180)
+        assert index.candidates(track) == []
+        assert len(index.candidates(other)) == 1
+        index.save()
+        assert len(index.keys) == len(fingerprints.index_keys(other))
+        assert len(index) == 1
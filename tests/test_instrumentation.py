@@ -0,0 +1,77 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from harmonizer import instrumentation
+
+
+def test_timings_stage():
+    timings = instrumentation.Timings()
+    for _ in range(2):
+        with timings.stage("decode"):
+            time.sleep(0.01)
+    stages = timings.as_dict()
+    assert list(stages) == ["decode"]
+    assert stages["decode"]["wall"] >= 0.02
+    assert stages["decode"]["cpu"] < stages["decode"]["wall"]
+    if instrumentation.resource is not None:
+        assert stages["decode"]["peak_rss_mb"] > 0
+
+
+def test_timings_decorator_and_merge():
+    timings = instrumentation.Timings()
+
+    @timings.timed("export")
+    def export(x):
+        return x * 2
+
+    assert export(2) == 4
+    timings.merge({"decode": {"wall": 1.5, "cpu": 1.0, "peak_rss_mb": 10.0}})
+    stages = timings.as_dict()
+    assert set(stages) == {"export", "decode"}
+    assert stages["decode"]["wall"] == 1.5
+
+
+def test_stage_without_timings():
+    with instrumentation.stage(None, "decode"):
+        pass
+    with pytest.raises(ValueError):
+        with instrumentation.stage(instrumentation.Timings(), "decode"):
+            raise ValueError()
+
+
+def test_stage_statistics():
+    statistics = instrumentation.StageStatistics()
+    for wall in range(1, 101):
+        statistics.add(
+            {
+                "decode": {"wall": wall, "cpu": 0, "peak_rss_mb": None},
+                "probe": {"wall": 0.01, "cpu": 0, "peak_rss_mb": None},
+            }
+        )
+    decode, probe = statistics.summary()
+    assert decode == {
+        "stage": "decode",
+        "count": 100,
+        "p50": 50,
+        "p95": 95,
+        "total": 5050,
+    }
+    assert probe["stage"] == "probe"
+    assert "decode" in statistics.table()
+
+
+@pytest.mark.skipif(instrumentation.resource is None, reason="No getrusage")
+def test_timings_stage_counts_child_processes():
+    timings = instrumentation.Timings()
+    with timings.stage("export"):
+        subprocess.run(
+            [sys.executable, "-c", "sum(i * i for i in range(2 * 10 ** 6))"],
+            check=True,
+        )
+    stage = timings.as_dict()["export"]
+    assert stage["children_cpu"] > 0
+    assert stage["cpu"] >= stage["children_cpu"]
+    assert stage["children_peak_rss_mb"] > 0
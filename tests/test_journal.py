@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from harmonizer import journal
+
+
+@pytest.fixture
+def parsed_config():
+    return {"output_bitrate": 192, "normalization_headroom": 0.1}
+
+
+@pytest.fixture
+def input_file(tmpdir):
+    path = tmpdir.join("input.mp3")
+    path.write(b"audio")
+    return str(path)
+
+
+@pytest.fixture
+def manipulated(tmpdir, input_file):
+    output = tmpdir.join("output.mp3")
+    output.write(b"normalized")
+    return {"local_file_path": input_file, "output_file_path": str(output)}
+
+
+def test_journal_lifecycle(tmpdir, parsed_config, input_file, manipulated):
+    with journal.Journal(str(tmpdir), parsed_config) as run_journal:
+        run_journal.start(input_file)
+        assert run_journal.manipulated(input_file) is None
+        run_journal.record_manipulated(input_file, manipulated)
+        run_journal.fail(input_file, "enrichment", "TooMuchRequests")
+        assert run_journal.stats()[journal.FAILED] == 1
+
+    with journal.Journal(str(tmpdir), parsed_config, resume=True) as run_journal:
+        assert not run_journal.is_done(input_file)
+        assert run_journal.manipulated(input_file) == manipulated
+        run_journal.start(input_file)
+        run_journal.finish(input_file, [manipulated["output_file_path"]])
+        assert run_journal.is_done(input_file)
+
+        os.remove(manipulated["output_file_path"])
+        assert not run_journal.is_done(input_file)
+        assert run_journal.manipulated(input_file) is None
+
+    with journal.Journal(str(tmpdir), parsed_config) as run_journal:
+        assert run_journal.entry(input_file) is None
+
+
+def test_journal_ignores_stale_entries(tmpdir, parsed_config, input_file, manipulated):
+    with journal.Journal(str(tmpdir), parsed_config) as run_journal:
+        run_journal.start(input_file)
+        run_journal.record_manipulated(input_file, manipulated)
+
+    changed_config = dict(parsed_config, output_bitrate=320)
+    with journal.Journal(str(tmpdir), changed_config, resume=True) as run_journal:
+        assert run_journal.manipulated(input_file) is None
+
+    with open(input_file, "ab") as f:
+        f.write(b"more audio")
+    with journal.Journal(str(tmpdir), parsed_config, resume=True) as run_journal:
+        assert run_journal.manipulated(input_file) is None
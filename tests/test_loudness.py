@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from harmonizer import loudness
+
+
+def sine(frequency, amplitude, rate, seconds, channels=2, phase=0):
+    t = np.arange(int(rate * seconds)) / rate
+    wave = amplitude * np.sin(2 * np.pi * frequency * t + phase)
+    return np.stack([wave] * channels, axis=1)
+
+
+@pytest.mark.parametrize("rate", [32000, 44100, 48000, 96000])
+def test_integrated_loudness_of_reference_sine(rate):
+    # A 1 kHz stereo sine at -23 dBFS measures -23 LUFS (EBU Tech 3341).
+    meter = loudness.LoudnessMeter(rate, 2)
+    meter.push(sine(1000, 10 ** (-23 / 20), rate, 10))
+    assert meter.integrated_loudness() == pytest.approx(-23, abs=0.05)
+    assert meter.true_peak() == pytest.approx(-23, abs=0.05)
+
+
+def test_chunked_measurement_matches_single_push():
+    samples = np.random.default_rng(0).standard_normal((48000 * 5, 2)) * 0.1
+    whole = loudness.LoudnessMeter(48000, 2)
+    whole.push(samples)
+    chunked = loudness.LoudnessMeter(48000, 2)
+    for offset in range(0, len(samples), 7777):
+        chunked.push(samples[offset : offset + 7777])
+    assert chunked.integrated_loudness() == pytest.approx(whole.integrated_loudness())
+    assert chunked.true_peak() == pytest.approx(whole.true_peak())
+
+
+def test_true_peak_between_samples():
+    # Sampled at 45 degrees, a quarter sample rate sine never hits its peak.
+    samples = sine(12000, 1.0, 48000, 1, channels=1, phase=np.pi / 4)
+    meter = loudness.LoudnessMeter(48000, 1)
+    meter.push(samples)
+    assert np.abs(samples).max() == pytest.approx(np.sqrt(0.5))
+    assert meter.true_peak() == pytest.approx(0, abs=0.1)
+
+
+def test_gating():
+    meter = loudness.LoudnessMeter(48000, 2)
+    meter.push(sine(1000, 10 ** (-23 / 20), 48000, 5))
+    # Silence is below the absolute gate and barely lowers the loudness, only
+    # through the blocks overlapping the transition.
+    meter.push(np.zeros((48000 * 5, 2)))
+    assert meter.integrated_loudness() == pytest.approx(-23, abs=0.2)
+
+    silent = loudness.LoudnessMeter(48000, 2)
+    silent.push(np.zeros((48000, 2)))
+    assert silent.integrated_loudness() == -float("infinity")
+    assert silent.true_peak() == -float("infinity")
+
+
+def test_loudness_gain():
+    assert loudness.loudness_gain(-20, -6, -16, -1) == 4
+    # Limited by the true peak ceiling
+    assert loudness.loudness_gain(-20, -3, -16, -1) == 2
+    assert loudness.loudness_gain(-float("infinity"), -3, -16, -1) == 0
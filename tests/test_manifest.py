@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import pytest
+
+from harmonizer import manifest
+
+
+@pytest.fixture
+def parsed_config():
+    return {"output_bitrate": 192, "normalization_headroom": 0.1}
+
+
+@pytest.fixture
+def input_file(tmpdir):
+    path = str(tmpdir.join("test1.mp3"))
+    shutil.copyfile("tests/audio_samples/inputs/test1.mp3", path)
+    return path
+
+
+@pytest.fixture
+def output_paths(tmpdir):
+    paths = [str(tmpdir.join("out.mp3")), str(tmpdir.join("out.json"))]
+    for p in paths:
+        tmpdir.join(os.path.basename(p)).write("")
+    return paths
+
+
+def test_config_hash(parsed_config):
+    reference_hash = manifest.config_hash(parsed_config)
+    assert reference_hash == manifest.config_hash(dict(parsed_config))
+    assert reference_hash == manifest.config_hash(
+        dict(parsed_config, rate_limits={"discogs": 30})
+    )
+    assert reference_hash != manifest.config_hash(
+        dict(parsed_config, output_bitrate=320)
+    )
+
+
+def test_manifest(tmpdir, parsed_config, input_file, output_paths):
+    run_manifest = manifest.Manifest(str(tmpdir), parsed_config)
+    assert not run_manifest.is_up_to_date(input_file)
+    run_manifest.record(input_file, output_paths)
+    assert run_manifest.is_up_to_date(input_file)
+    run_manifest.save()
+
+    run_manifest = manifest.Manifest(str(tmpdir), parsed_config)
+    assert run_manifest.is_up_to_date(input_file)
+
+    changed_config = dict(parsed_config, output_bitrate=320)
+    assert not manifest.Manifest(str(tmpdir), changed_config).is_up_to_date(input_file)
+
+    os.remove(output_paths[1])
+    assert not run_manifest.is_up_to_date(input_file)
+
+
+def test_manifest_modified_input(tmpdir, parsed_config, input_file, output_paths):
+    run_manifest = manifest.Manifest(str(tmpdir), parsed_config)
+    run_manifest.record(input_file, output_paths)
+    with open(input_file, "ab") as f:
+        f.write(b"\0")
+    assert not run_manifest.is_up_to_date(input_file)
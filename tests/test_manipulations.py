@@ -1,10 +1,15 @@
 import os
 import base64
+import hashlib
+import shutil
 from glob import glob
 
 import eyed3
 import pydub
+import pydub.effects
+import pydub.generators
 import pytest
+from mutagen.id3 import APIC, ID3
 from titlecase import titlecase
 
 from harmonizer import manipulations
@@ -112,6 +117,13 @@ def test_bitrate(low_bitrate_mp3s, not_mp3s, high_bitrate_mp3s):
     assert original_bitrate is None
 
 
+def test_mono_bitrate():
+    # A 32 kbps mono stream, counted like a 64 kbps stereo one
+    probed = manipulations.probe("tests/audio_samples/inputs/64k.mp3")
+    assert probed["bitrate"] == 64
+    assert probed["constant_bitrate"] == probed["bitrate"]
+
+
 def test_full_manip(various_samples):
     for s_in, s_out, _ in various_samples:
         sound = manipulations.load_audio(s_in)
@@ -213,3 +225,374 @@ def test_get_covert_art(mp3_with_cover, mp3_without_cover):
         mp3_without_cover, "tests/image_outputs"
     )
     assert cover_art_path is None
+
+
+@pytest.fixture
+def mp3_with_apic(tmpdir):
+    path = str(tmpdir.join("with_apic.mp3"))
+    shutil.copyfile("tests/audio_samples/inputs/test2.mp3", path)
+    id3 = ID3(path)
+    id3.add(APIC(mime="image/jpeg", type=3, desc="cover", data=b"fake jpeg"))
+    id3.save()
+    return path
+
+
+def test_probe(various_samples):
+    for s_in, _, _ in various_samples:
+        probed = manipulations.probe(s_in)
+        assert probed["mime_type"].startswith("audio/")
+        assert isinstance(probed["tags"], dict)
+        if probed["mime_type"] == "audio/mp3":
+            assert isinstance(probed["bitrate"], int)
+        else:
+            assert probed["bitrate"] is None
+
+    probed = manipulations.probe("tests/audio_samples/inputs/with_tags_m4a.m4a")
+    assert probed["tags"]["album"] == "Lye And The Shaman"
+    assert probed["tags"]["tracknumber"] == "4"
+
+
+def test_probe_cover_art(mp3_with_apic, tmpdir):
+    probed = manipulations.probe(mp3_with_apic)
+    assert probed["cover_art"] == {"data": b"fake jpeg", "mime_type": "image/jpeg"}
+    assert probed["tags"]["title"] == "ringing rythm abstract"
+
+    cover_art_path = manipulations.get_cover_art(mp3_with_apic, str(tmpdir))
+    assert cover_art_path == str(
+        tmpdir.join(hashlib.sha256(b"fake jpeg").hexdigest() + ".jpeg")
+    )
+    with open(cover_art_path, "rb") as f:
+        assert f.read() == b"fake jpeg"
+
+
+@pytest.fixture
+def sine_sound():
+    return (
+        pydub.generators.Sine(440, sample_rate=44100, bit_depth=32)
+        .to_audio_segment(duration=3000, volume=-6)
+        .set_channels(2)
+    )
+
+
+def test_pcm_chunks(sine_sound):
+    chunks = list(manipulations.pcm_chunks(sine_sound, chunk_seconds=1))
+    assert len(chunks) == 3
+    assert all(len(c) == 44100 * sine_sound.frame_width for c in chunks)
+    assert b"".join(chunks) == sine_sound.raw_data
+
+
+def test_fingerprint_sound(monkeypatch, sine_sound):
+    fed = {}
+
+    def fake_fingerprint(samplerate, channels, pcmiter, maxlength):
+        fed.update(samplerate=samplerate, channels=channels, maxlength=maxlength)
+        fed["data"] = b"".join(pcmiter)
+        return b"AQAAfake"
+
+    monkeypatch.setattr(manipulations.acoustid, "fingerprint", fake_fingerprint)
+    duration, fingerprint = manipulations.fingerprint_sound(sine_sound, max_length=2)
+    assert duration == pytest.approx(3)
+    assert fingerprint == "AQAAfake"
+    assert fed["samplerate"] == 44100
+    assert fed["channels"] == 2
+    assert fed["maxlength"] == 2
+    # Two seconds of 16 bits stereo samples
+    assert len(fed["data"]) == 2 * 44100 * 2 * 2
+
+
+def test_normalization_gain(sine_sound):
+    gain = manipulations.normalization_gain(sine_sound, 0.1)
+    normalized = pydub.effects.normalize(sine_sound, 0.1)
+    assert gain == pytest.approx(normalized.dBFS - sine_sound.dBFS, abs=0.01)
+
+
+def test_copy_and_retag(tmpdir):
+    output_path = str(tmpdir.join("out.mp3"))
+    audio_format, bitrate, exported_path = manipulations.copy_and_retag(
+        "tests/audio_samples/inputs/test2.mp3",
+        output_path,
+        128,
+        {"title": "Ringing Rythm Abstract", "artist": "Stephan", "unknown": "x"},
+    )
+    assert (audio_format, bitrate, exported_path) == ("mp3", 128, output_path)
+    _, tags = manipulations.extract_file_metadata(output_path)
+    assert tags == {"title": "Ringing Rythm Abstract", "artist": "Stephan"}
+
+
+def test_pipeline_fast_path(monkeypatch, tmpdir):
+    def no_decoding(local_audio_path):
+        raise AssertionError("The fast path should not decode the input")
+
+    monkeypatch.setattr(manipulations, "load_audio", no_decoding)
+    monkeypatch.setattr(
+        manipulations, "fingerprint", lambda path, max_length: (5, "AQAAfake")
+    )
+    output_path = str(tmpdir.join("test2.mp3"))
+    manipulation_result, exported_filepath, _ = manipulations.pipeline(
+        "tests/audio_samples/inputs/test2.mp3",
+        output_path,
+        str(tmpdir),
+        target_bitrate=128,
+        fast_path=True,
+    )
+    assert exported_filepath == output_path
+    assert manipulation_result["export"] == {
+        "audio_format": "mp3",
+        "bitrate": 128,
+        "transcoded": False,
+    }
+    assert manipulations.probe(output_path)["tags"]["title"] == "Ringing Rythm Abstract"
+
+
+def test_pipeline_fast_path_without_chromaprint(monkeypatch, tmpdir):
+    def no_decoding(local_audio_path):
+        raise AssertionError("PCM fingerprinting is unavailable without Chromaprint")
+
+    monkeypatch.setattr(manipulations, "load_audio", no_decoding)
+    monkeypatch.setattr(manipulations.acoustid, "have_chromaprint", False)
+    monkeypatch.setattr(
+        manipulations, "fingerprint", lambda path, max_length: (5, "AQAAfake")
+    )
+    manipulation_result, _, _ = manipulations.pipeline(
+        "tests/audio_samples/inputs/test2.mp3",
+        str(tmpdir.join("test2.mp3")),
+        str(tmpdir),
+        target_bitrate=128,
+        fingerprint_source="pcm",
+        fast_path=True,
+    )
+    assert not manipulation_result["export"]["transcoded"]
+    assert manipulation_result["fingerprinting"]["fingerprint"] == "AQAAfake"
+
+
+def test_pipeline_two_pass_streams(monkeypatch, tmpdir):
+    def fake_stream_manipulation(local_audio_path, audio_output_path, *args, **kwargs):
+        assert kwargs["two_pass"]
+        open(audio_output_path, "wb").close()
+        return {}, False, ("mp3", 192, audio_output_path), (5, "AQAAfake")
+
+    def no_decoding(local_audio_path):
+        raise AssertionError("Two pass normalization should not decode in memory")
+
+    monkeypatch.setattr(manipulations, "stream_manipulation", fake_stream_manipulation)
+    monkeypatch.setattr(manipulations, "load_audio", no_decoding)
+    output_path = str(tmpdir.join("test1.mp3"))
+    manipulation_result, exported_filepath, _ = manipulations.pipeline(
+        "tests/audio_samples/inputs/test1.mp3",
+        output_path,
+        str(tmpdir),
+        active_normalize=True,
+        streaming_mode="auto",
+        two_pass=True,
+    )
+    assert exported_filepath == output_path
+    assert manipulation_result["fingerprinting"]["fingerprint"] == "AQAAfake"
+
+
+def test_pipeline_leaves_no_partial_output(monkeypatch, tmpdir):
+    def failing_fingerprint(path, max_length):
+        assert os.path.exists(path)
+        raise RuntimeError("fpcalc crashed")
+
+    monkeypatch.setattr(manipulations, "fingerprint", failing_fingerprint)
+    with pytest.raises(RuntimeError):
+        manipulations.pipeline(
+            "tests/audio_samples/inputs/test2.mp3",
+            str(tmpdir.join("test2.mp3")),
+            str(tmpdir),
+            target_bitrate=128,
+            fast_path=True,
+        )
+    assert not [p for p in tmpdir.listdir() if p.ext == ".mp3"]
+
+
+@pytest.mark.parametrize("bit_depth", [8, 16, 32])
+def test_normalize_matches_pydub(bit_depth):
+    sound = (
+        pydub.generators.Sine(440, sample_rate=44100, bit_depth=bit_depth)
+        .to_audio_segment(duration=2000, volume=-12)
+        .set_channels(2)
+    )
+    expected = pydub.effects.normalize(sound, 0.1)
+    original_dbfs, new_dbfs, change_in_dbfs, normalized = manipulations.normalize(
+        sound, 0.1
+    )
+    assert original_dbfs == sound.dBFS
+    assert new_dbfs == expected.dBFS
+    assert change_in_dbfs == pytest.approx(sound.dBFS - expected.dBFS)
+    assert normalized.raw_data == expected.raw_data
+    # The original sound is left untouched
+    assert sound.dBFS == original_dbfs
+
+
+def test_normalize_silence():
+    silence = pydub.AudioSegment.silent(duration=1000)
+    original_dbfs, new_dbfs, change_in_dbfs, normalized = manipulations.normalize(
+        silence
+    )
+    assert original_dbfs == new_dbfs == -float("infinity")
+    assert change_in_dbfs == 0
+    assert normalized is silence
+
+
+def test_normalize_loudness(sine_sound):
+    (original_lufs, true_peak), copy_input, gain = manipulations.normalize_in_memory(
+        sine_sound,
+        False,
+        active_normalize=True,
+        normalization_mode="lufs",
+        loudness_target=-20,
+        max_true_peak=-1,
+    )
+    assert original_lufs == pytest.approx(-6.7, abs=0.1)
+    assert true_peak == pytest.approx(-6, abs=0.1)
+    assert gain == pytest.approx(-20 - original_lufs)
+    _, normalized = manipulations.amplify(sine_sound, gain)
+    assert manipulations.measure_loudness(normalized)[0] == pytest.approx(-20, abs=0.05)
+
+    # Loud targets are limited by the true peak ceiling
+    _, _, gain = manipulations.normalize_in_memory(
+        sine_sound,
+        False,
+        active_normalize=True,
+        normalization_mode="lufs",
+        loudness_target=-1,
+        max_true_peak=-1,
+    )
+    assert gain == pytest.approx(5, abs=0.1)
+    _, normalized = manipulations.amplify(sine_sound, gain)
+    assert manipulations.measure_loudness(normalized)[1] == pytest.approx(-1, abs=0.05)
+
+
+@pytest.fixture
+def streamed_sound(monkeypatch, sine_sound):
+    # Decodes from and encodes to memory instead of ffmpeg pipes
+    samples = manipulations.samples_array(sine_sound)
+    encoded = []
+
+    class MemoryEncoder:
+        def __init__(self, output_path, *args):
+            pass
+
+        def write(self, chunk):
+            encoded.append(chunk.tobytes())
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    def decode(local_audio_path, sample_width, channels, chunk_frames):
+        chunk_size = chunk_frames * channels
+        for offset in range(0, len(samples), chunk_size):
+            yield samples[offset : offset + chunk_size]
+
+    monkeypatch.setattr(
+        manipulations.streaming,
+        "stream_info",
+        lambda path: {
+            "frame_rate": sine_sound.frame_rate,
+            "channels": sine_sound.channels,
+            "sample_width": sine_sound.sample_width,
+            "duration": sine_sound.duration_seconds,
+        },
+    )
+    monkeypatch.setattr(manipulations.streaming, "decode", decode)
+    monkeypatch.setattr(manipulations.streaming, "Encoder", MemoryEncoder)
+    return sine_sound, encoded
+
+
+def test_stream_manipulation(streamed_sound, tmpdir):
+    sound, encoded = streamed_sound
+    normalization_meta, copy_input, export_result, pcm_fingerprint = (
+        manipulations.stream_manipulation(
+            "input.flac",
+            str(tmpdir.join("out.mp3")),
+            {},
+            False,
+            active_normalize=True,
+            chunk_seconds=1,
+        )
+    )
+    original_dbfs, new_dbfs, change_in_dbfs, normalized = manipulations.normalize(sound)
+    assert normalization_meta == manipulations.peak_metadata(
+        original_dbfs, new_dbfs, change_in_dbfs
+    )
+    assert b"".join(encoded) == normalized.raw_data
+    assert not copy_input
+    assert export_result == ("mp3", 192, str(tmpdir.join("out.mp3")))
+    assert pcm_fingerprint is None
+
+
+def test_stream_manipulation_loudness(streamed_sound, tmpdir):
+    sound, encoded = streamed_sound
+    normalization_meta, _, _, _ = manipulations.stream_manipulation(
+        "input.flac",
+        str(tmpdir.join("out.mp3")),
+        {},
+        False,
+        active_normalize=True,
+        normalization_mode="lufs",
+        loudness_target=-20,
+        chunk_seconds=1,
+    )
+    (original_lufs, true_peak), _, gain = manipulations.normalize_in_memory(
+        sound,
+        False,
+        active_normalize=True,
+        normalization_mode="lufs",
+        loudness_target=-20,
+    )
+    assert normalization_meta == manipulations.loudness_metadata(
+        original_lufs, true_peak, gain, -20
+    )
+    _, normalized = manipulations.amplify(sound, gain)
+    assert b"".join(encoded) == normalized.raw_data
+
+
+def test_stream_manipulation_two_pass(monkeypatch, streamed_sound, tmpdir):
+    sound, encoded = streamed_sound
+
+    def no_spool(*args, **kwargs):
+        raise AssertionError("Two pass normalization should not spool audio")
+
+    monkeypatch.setattr(manipulations.streaming, "Spool", no_spool)
+    normalization_meta, _, _, _ = manipulations.stream_manipulation(
+        "input.flac",
+        str(tmpdir.join("out.mp3")),
+        {},
+        False,
+        active_normalize=True,
+        chunk_seconds=1,
+        two_pass=True,
+    )
+    original_dbfs, new_dbfs, change_in_dbfs, normalized = manipulations.normalize(sound)
+    assert normalization_meta["normalized_dbfs"] == new_dbfs
+    assert b"".join(encoded) == normalized.raw_data
+
+
+def test_manipulate_in_memory_encodes_chunks(monkeypatch, streamed_sound, tmpdir):
+    sound, encoded = streamed_sound
+
+    def no_export(*args, **kwargs):
+        raise AssertionError("The gain should be applied while encoding")
+
+    monkeypatch.setattr(manipulations, "load_audio", lambda path: sound)
+    monkeypatch.setattr(manipulations, "export", no_export)
+    normalization_meta, copy_input, export_result, _ = (
+        manipulations.manipulate_in_memory(
+            "input.flac",
+            str(tmpdir.join("out.mp3")),
+            {},
+            False,
+            active_normalize=True,
+        )
+    )
+    original_dbfs, new_dbfs, change_in_dbfs, normalized = manipulations.normalize(sound)
+    assert normalization_meta == manipulations.peak_metadata(
+        original_dbfs, new_dbfs, change_in_dbfs
+    )
+    assert b"".join(encoded) == normalized.raw_data
+    assert not copy_input
+    assert export_result == ("mp3", 192, str(tmpdir.join("out.mp3")))
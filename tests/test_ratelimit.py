@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from harmonizer import enrichments, ratelimit
+
+
+def test_token_bucket_spreads_requests():
+    bucket = ratelimit.TokenBucket(requests_per_minute=600)
+    waits = [bucket.reserve() for _ in range(5)]
+    assert waits[0] == 0
+    assert waits == sorted(waits)
+    assert waits[-1] == pytest.approx(0.4, abs=0.05)
+
+
+def test_token_bucket_pause():
+    bucket = ratelimit.TokenBucket(requests_per_minute=6000, burst=10)
+    bucket.pause(0.5)
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.05)
+
+
+def test_scheduler_retries_rate_limited_requests():
+    scheduler = ratelimit.RequestScheduler(6000, backoff_factor=0.01)
+    calls = []
+
+    def flaky_request(query):
+        calls.append(query)
+        if len(calls) < 3:
+            raise enrichments.TooMuchRequests("Slow down")
+        return query
+
+    assert (
+        scheduler.call(flaky_request, "herbie hancock thrust")
+        == "herbie hancock thrust"
+    )
+    assert len(calls) == 3
+    stats = scheduler.stats()
+    assert stats["requests"] == 3
+    assert stats["retries"] == 2
+    assert stats["queue_depth"] == 0
+    assert stats["total_wait"] > 0
+
+
+def test_scheduler_honors_retry_after():
+    scheduler = ratelimit.RequestScheduler(6000, max_retries=1)
+    calls = []
+
+    def rate_limited_request():
+        calls.append(time.monotonic())
+        raise ratelimit.RateLimitExceeded("Slow down", retry_after=0.2)
+
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        scheduler.call(rate_limited_request)
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.2
+
+
+def test_scheduler_does_not_retry_other_errors():
+    scheduler = ratelimit.RequestScheduler(6000)
+
+    def broken_request():
+        raise ValueError("Boom")
+
+    with pytest.raises(ValueError):
+        scheduler.call(broken_request)
+    assert scheduler.stats()["retries"] == 0
@@ -0,0 +1,62 @@
+import io
+import json
+
+import pytest
+
+from harmonizer import report
+
+
+@pytest.fixture
+def outcomes(tmpdir):
+    output = tmpdir.join("test1.mp3")
+    output.write(b"x" * 10)
+    succeeded = {
+        "results": {
+            "output_file_path": str(output),
+            "validation_errors": ["Missing tag: title"],
+            "timings": {"export": {"wall": 1.5, "cpu": 1.2, "peak_rss_mb": 50}},
+        },
+        "error": None,
+        "process_time": 2,
+    }
+    failed = {"results": None, "error": "Boom", "process_time": 0.5}
+    return succeeded, failed
+
+
+def test_progress_stream(tmpdir, outcomes):
+    stream = io.StringIO()
+    run_report = report.RunReport(report.ProgressStream(stream))
+    run_report.file_started("tests/audio_samples/inputs/test1.mp3")
+    run_report.file_finished("tests/audio_samples/inputs/test1.mp3", outcomes[0])
+    run_report.finish()
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [e["event"] for e in events] == [
+        "run_started",
+        "file_started",
+        "file_finished",
+        "run_finished",
+    ]
+    finished = events[2]
+    assert finished["status"] == "succeeded"
+    assert finished["bytes_in"] > 0
+    assert finished["bytes_out"] == 10
+    assert finished["stages"] == {"export": 1.5}
+    assert finished["validation_errors"] == ["Missing tag: title"]
+
+
+def test_summary(tmpdir, outcomes):
+    run_report = report.RunReport()
+    run_report.file_finished("fast.mp3", outcomes[1])
+    run_report.file_finished("slow.mp3", outcomes[0])
+    run_report.file_skipped("skipped.mp3")
+    summary = run_report.finish()
+    assert summary["totals"]["processed"] == 2
+    assert summary["totals"]["succeeded"] == 1
+    assert summary["totals"]["with_validation_errors"] == 1
+    assert summary["totals"]["skipped"] == 1
+    assert summary["totals"]["bytes_out"] == 10
+    assert summary["failures"] == [{"file": "fast.mp3", "error": "Boom"}]
+    assert [f["file"] for f in summary["slowest_files"]] == ["slow.mp3", "fast.mp3"]
+    path = tmpdir.join("report.json")
+    run_report.save(str(path), summary)
+    assert len(json.loads(path.read())["files"]) == 2
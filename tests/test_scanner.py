@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from harmonizer import config, scanner
+
+
+@pytest.fixture
+def library(tmpdir):
+    for path in [
+        "a.mp3",
+        "cover.jpeg",
+        "Artist/Album/01.flac",
+        "Artist/Album/02.FLAC",
+        "Artist/Other Album/01.m4a",
+        "Artist/Other Album/notes.txt",
+        "output/already.mp3",
+    ]:
+        tmpdir.join(path).ensure()
+    return str(tmpdir)
+
+
+def test_extensions_for():
+    assert scanner.extensions_for(["audio/mpeg", "audio/mp3"]) == {".mp3"}
+    assert scanner.extensions_for(["audio/mp4"]) == {".m4a", ".mp4"}
+    assert all(m in config.MIME_TYPES_EXTENSIONS for m in config.HANDLED_MIME_TYPES)
+
+
+def test_scan(library):
+    extensions = scanner.extensions_for(["audio/mpeg", "audio/flac", "audio/mp4"])
+    scanned = scanner.scan(library, extensions)
+    assert not isinstance(scanned, list)
+    assert [os.path.relpath(f, library) for f in scanned] == [
+        "a.mp3",
+        "Artist/Album/01.flac",
+        "Artist/Album/02.FLAC",
+        "Artist/Other Album/01.m4a",
+        "output/already.mp3",
+    ]
+
+    scanned = scanner.scan(
+        library, extensions, excluded_dirs=[os.path.join(library, "output")]
+    )
+    assert "output/already.mp3" not in [os.path.relpath(f, library) for f in scanned]
+
+
+def test_mirror_dir(library, tmpdir):
+    output_dir = str(tmpdir.join("mirrored"))
+    mirrored_dir = scanner.mirror_dir(
+        output_dir, library, os.path.join(library, "Artist/Album/01.flac")
+    )
+    assert mirrored_dir == os.path.join(output_dir, "Artist", "Album")
+    assert os.path.isdir(mirrored_dir)
+    assert scanner.mirror_dir(
+        output_dir, library, os.path.join(library, "a.mp3")
+    ) == os.path.normpath(output_dir)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from harmonizer import streaming
+
+
+def test_use_streaming():
+    assert streaming.use_streaming("always", None)
+    assert not streaming.use_streaming("never", 7200)
+    assert streaming.use_streaming("auto", 1800, min_duration=1200)
+    assert not streaming.use_streaming("auto", 600, min_duration=1200)
+    assert not streaming.use_streaming("auto", None)
+
+
+def test_spool_round_trip(tmpdir):
+    samples = np.arange(10000, dtype=np.int32)
+    with streaming.Spool(4, directory=str(tmpdir)) as spool:
+        for offset in range(0, len(samples), 3000):
+            spool.write(samples[offset : offset + 3000])
+        chunks = list(spool.chunks(4000))
+        assert [len(c) for c in chunks] == [4000, 4000, 2000]
+        assert np.array_equal(np.concatenate(chunks), samples)
+        # Chunks can be read again
+        assert len(list(spool.chunks(4000))) == 3
@@ -1,5 +1,7 @@
+import pickle
+
 import pytest
-from harmonizer import validations
+from harmonizer import instrumentation, validations
 
 
 def test_check_mandatory_tags():
@@ -166,3 +168,107 @@ def test_validate_bad_input(config):
         == "190 bitrate is below the minimum bitrate of 192"
     )
     assert validation_errors["missing_enrichments"] == ["discogs", "spotify"]
+
+
+def test_validate_timings():
+    timings = instrumentation.Timings()
+    validations.validate(
+        {"mandatory_tags": ["artist"]}, timings=timings, tags={"artist": "foo"}
+    )
+    assert list(timings.as_dict()) == ["validation.mandatory_tags"]
+
+
+def test_check_integrity():
+    assert validations.check_integrity(["Truncated file"], True) == (
+        False,
+        ["Truncated file"],
+    )
+    assert validations.check_integrity(["Truncated file"], False) == (True, [])
+    assert validations.check_integrity([], True) == (True, [])
+
+
+def test_split_preflight():
+    config = {
+        "accepted_input_mime_types": ["audio/mp3"],
+        "minimum_output_bitrate": 192,
+        "preflight": "reject",
+    }
+    preflight_config, remaining_config = validations.split_preflight(config)
+    assert preflight_config == {"accepted_input_mime_types": ["audio/mp3"]}
+    assert "accepted_input_mime_types" not in remaining_config
+    assert remaining_config["minimum_output_bitrate"] == 192
+
+
+def test_validate_many():
+    config = {
+        "mandatory_tags": ["artist", "album"],
+        "accepted_input_mime_types": ["audio/mp3"],
+        "minimum_input_bitrate": 192,
+        "required_enrichments": ["discogs"],
+    }
+    objects = [
+        {
+            "tags": {"artist": "yolo", "album": "yolo"},
+            "input_mime_type": "audio/mp3",
+            "input_bitrate": 320,
+            "enrichments": {"discogs": {"best_match": "foo"}},
+        },
+        {
+            "tags": {"album": "yolo"},
+            "input_mime_type": "audio/flac",
+            "input_bitrate": None,
+            "enrichments": {},
+        },
+        {
+            "tags": {"artist": "yolo", "album": "yolo"},
+            "input_mime_type": "audio/mp3",
+            "input_bitrate": 128,
+            "enrichments": {"discogs": {"best_match": "foo"}},
+        },
+    ]
+    plan = validations.ValidationPlan(config)
+    results = plan.validate_many(objects)
+    assert results == [validations.validate(config, **o) for o in objects]
+    assert results[0] == (True, {})
+    assert set(results[1][1]) == {
+        "missing_tags",
+        "invalid_input_mime_type",
+        "missing_enrichments",
+    }
+    assert list(results[2][1]) == ["low_input_bitrate"]
+
+    with pytest.raises(validations.CannotValidate):
+        plan.validate_many([{"tags": {}}])
+
+
+def test_result_objects():
+    results = {
+        "validation_errors": {"corrupt_input": ["Truncated file"]},
+        "enrichments_metadata": {},
+        "manipulation_metadata": {
+            "tags": {"artist": "yolo"},
+            "mime_type": "audio/mp3",
+            "original_bitrate": 128,
+            "export": {"bitrate": 192},
+        },
+    }
+    plan = validations.ValidationPlan(
+        {"minimum_input_bitrate": 192, "integrity_check": True}
+    )
+    ((is_valid, errors),) = plan.validate_many([validations.result_objects(results)])
+    assert not is_valid
+    assert errors["corrupt_input"] == ["Truncated file"]
+    assert "low_input_bitrate" in errors
+
+
+def test_compile_plans():
+    config = {
+        "accepted_input_mime_types": ["audio/mp3"],
+        "minimum_output_bitrate": 192,
+        "preflight": "reject",
+    }
+    preflight_plan, remaining_plan = validations.compile_plans(config)
+    # Plans are sent to the worker processes.
+    preflight_plan = pickle.loads(pickle.dumps(preflight_plan))
+    assert preflight_plan.validate(input_mime_type="audio/flac")[0] is False
+    assert remaining_plan.validate(output_bitrate=192) == (True, {})